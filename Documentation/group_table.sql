@@ -19,6 +19,17 @@ CREATE TABLE `groups` (
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8;
 
 
+-- Change counter of the groups table, bumped with every write to it so
+-- readers can tell from this one row whether their copy is still current
+DROP TABLE IF EXISTS `tree_version`;
+CREATE TABLE `tree_version` (
+  `id` int NOT NULL,
+  `version` bigint unsigned NOT NULL DEFAULT '0',
+  `updated` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+INSERT INTO `tree_version` (`id`, `version`) VALUES (1, 0);
+
 DROP TABLE IF EXISTS `queue_log`;
 CREATE TABLE `queue_log` (
   `id` int DEFAULT NULL,
@@ -30,6 +41,58 @@ CREATE TABLE `queue_log` (
   KEY `ts_idx` (`query_time`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8;
 
+-- Per-group idle-job sums in fixed-size time buckets, maintained as samples
+-- are inserted into queue_log when rollup_bucket is set in the config
+DROP TABLE IF EXISTS `queue_rollup`;
+CREATE TABLE `queue_rollup` (
+  `id` int NOT NULL,
+  `bucket` datetime NOT NULL,
+  `samples` int(10) unsigned NOT NULL DEFAULT '0',
+  `total` bigint unsigned NOT NULL DEFAULT '0',
+  `first_amount` int(10) unsigned NOT NULL DEFAULT '0',
+  `last_amount` int(10) unsigned NOT NULL DEFAULT '0',
+  PRIMARY KEY (`id`, `bucket`),
+  CONSTRAINT FK_qrollup_gq_id FOREIGN KEY
+    (`id`) REFERENCES `groups` (`id`)
+    ON DELETE CASCADE,
+  KEY `bucket_idx` (`bucket`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
+-- Hourly summaries of old queue_log samples, filled by the retention script
+-- when downsample is enabled in the config
+DROP TABLE IF EXISTS `queue_hourly`;
+CREATE TABLE `queue_hourly` (
+  `id` int NOT NULL,
+  `hour` datetime NOT NULL,
+  `samples` int(10) unsigned NOT NULL DEFAULT '0',
+  `total` bigint unsigned NOT NULL DEFAULT '0',
+  `min_amount` int(10) unsigned NOT NULL DEFAULT '0',
+  `max_amount` int(10) unsigned NOT NULL DEFAULT '0',
+  `avg_amount` double NOT NULL DEFAULT '0',
+  PRIMARY KEY (`id`, `hour`),
+  CONSTRAINT FK_qhourly_gq_id FOREIGN KEY
+    (`id`) REFERENCES `groups` (`id`)
+    ON DELETE CASCADE,
+  KEY `hour_idx` (`hour`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
+-- For retention method "partitions", queue_log partitioned by day instead of
+-- the definition above. Partitioned InnoDB tables can't have foreign keys, so
+-- samples of deleted groups stay until their day is dropped. The retention
+-- script adds the partitions for the coming days itself. Its first run on an
+-- existing queue_log (one pmax partition) splits the history already there
+-- into days, which rewrites the whole table once.
+--
+-- CREATE TABLE `queue_log` (
+--   `id` int DEFAULT NULL,
+--   `amount_in_queue` int(10) unsigned NOT NULL DEFAULT '0',
+--   `query_time` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+--   KEY `ts_idx` (`query_time`)
+-- ) ENGINE=InnoDB DEFAULT CHARSET=utf8
+-- PARTITION BY RANGE (UNIX_TIMESTAMP(`query_time`)) (
+--   PARTITION pmax VALUES LESS THAN MAXVALUE
+-- );
+
 CREATE USER 'atlas_update'@'%' IDENTIFIED BY 'xxx';
 CREATE USER 'atlas_edit'@'%' IDENTIFIED BY 'xxx';
 
@@ -27,6 +27,9 @@ queues = {
 # **************** Configuration variables and information *****************
 url = "https://pandaserver.cern.ch:25443/server/panda/getJobStatisticsWithLabel"
 
+# Seconds get_idle_jobs waits for get_jobs() before using the last result
+timeout = 120
+
 # According to J. Hover, this is the definitive test for if a queue is analysis
 is_analysis = lambda q: q.startswith("ANALY")
 
@@ -0,0 +1,63 @@
+# *****************************************************************************
+# Helpers shared by the benchmark scripts: synthetic group-trees and timing
+# *****************************************************************************
+
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from gq.group import QuotaGroup  # noqa
+
+
+def build_tree(fanout, grpCLS=QuotaGroup, seed=None, **kwargs):
+    """ Build a tree with @fanout[i] children per node at depth i, so a
+        fanout of (40, 35, 35) gives ~50k groups. Extra @kwargs are passed
+        to each group constructor, callables are called with the rng first
+    """
+    rng = random.Random(seed)
+    root = grpCLS('<root>')
+    level = [root]
+    for depth, width in enumerate(fanout):
+        next_level = []
+        for parent in level:
+            for n in range(width):
+                args = dict((k, v(rng) if callable(v) else v)
+                            for k, v in kwargs.items())
+                grp = grpCLS('g%d_%d' % (depth, n), **args)
+                parent.add_child(grp)
+                next_level.append(grp)
+        level = next_level
+    return root
+
+
+def timeit(fn, repeat=3):
+    """ Best wall-clock time of @repeat calls to @fn, in seconds """
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        fn()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def deep_size(obj):
+    """ Approximate bytes reachable from @obj, ignoring classes and modules """
+    import gc
+    import types
+
+    skip = (type, types.ModuleType, types.FunctionType)
+    seen = set()
+    todo = [obj]
+    total = 0
+    while todo:
+        x = todo.pop()
+        if id(x) in seen or isinstance(x, skip):
+            continue
+        seen.add(id(x))
+        total += sys.getsizeof(x)
+        todo.extend(gc.get_referents(x))
+    return total
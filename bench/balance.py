@@ -0,0 +1,96 @@
+#!/usr/bin/python
+# Benchmark calculate_surplus() on wide and deep DemandGroup trees against the
+# original algorithm (per-weight-level rescans and recursive has_demand()),
+# and check on randomized trees that both set exactly the same flags
+
+import random
+import logging
+
+from _trees import build_tree, timeit
+
+from gq.group import DemandGroup
+from gq.group.balance import calculate_surplus
+
+
+class LegacyDemandGroup(DemandGroup):
+    """ Re-walks the subtree on every has_demand()/has_slack() call """
+
+    def has_demand(self):
+        if self.is_leaf:
+            return self.weight > 0 and self.demand > self.threshold
+        return self.weight > 0 and any(x.has_demand() for x in self.get_children())
+
+    def has_slack(self):
+        if self.is_leaf:
+            return self.weight == 0 or self.demand <= self.threshold
+        return self.weight > 0 and all(x.has_slack() for x in self.get_children())
+
+
+def legacy_calculate_surplus(root):
+    """ calculate_surplus() before bucketing weights and aggregating demand """
+    for group in (x for x in root.all() if not x.is_leaf):
+        candidates = sorted(group.get_children(), key=lambda x: -x.weight)
+        already_set = False
+        for weight in sorted(set(g.weight for g in candidates), reverse=True):
+            groups = [x for x in candidates if x.weight == weight]
+            my_demand = any([x.has_demand() for x in groups])
+            lower_groups = [x for x in candidates if 0 < x.weight < weight]
+            lower_demand = any([x for x in lower_groups if x.has_demand()])
+            if (not my_demand and lower_demand) or already_set:
+                for g in groups:
+                    g.accept = False
+            else:
+                for g in groups:
+                    g.accept = True
+                already_set = True
+
+    for group in root.all():
+        all_leaf = all([x.is_leaf for x in group.siblings()])
+        slack = any([x.has_slack() for x in group.siblings() if x.weight > 0])
+        if group.accept and not slack and not all_leaf:
+            group.accept = False
+
+
+def random_tree(fanout, grpCLS, seed, weights=(0, 1, 1, 2, 8)):
+    root = build_tree(fanout, grpCLS, seed=seed,
+                      weight=lambda r: r.choice(weights),
+                      surplus_threshold=lambda r: r.randint(0, 5))
+    rng = random.Random(seed)
+    for x in root.leaf_nodes():
+        x.demand = rng.choice((0, 0, rng.randint(0, 10)))
+    return root
+
+
+def flags(root):
+    return sorted((x.full_name, x.accept) for x in root)
+
+
+def check(trials=300):
+    """ Same flags as the original algorithm on randomly shaped trees """
+    rng = random.Random(11)
+    for seed in range(trials):
+        fanout = [rng.randint(1, 6) for _ in range(rng.randint(1, 5))]
+        weights = rng.sample((0, 0.5, 1, 1, 2, 3, 8), rng.randint(1, 5))
+        old = random_tree(fanout, LegacyDemandGroup, seed, weights)
+        new = random_tree(fanout, DemandGroup, seed, weights)
+        legacy_calculate_surplus(old)
+        calculate_surplus(new)
+        assert flags(old) == flags(new), "Mismatch, seed %d %s" % (seed, fanout)
+    print 'Identical flags to the original algorithm on %d random trees' % trials
+
+
+if __name__ == '__main__':
+    logging.disable(logging.CRITICAL)
+    check()
+
+    shapes = ((8, 8, 8), (4,) * 6, (2,) * 12, (50, 50), (2, 1000), (1, 3000))
+    for fanout in shapes:
+        weights = [x / 4.0 for x in range(40)] if fanout[-1] > 100 else (0, 1, 1, 2, 8)
+        old = random_tree(fanout, LegacyDemandGroup, 1, weights)
+        new = random_tree(fanout, DemandGroup, 1, weights)
+
+        t_old = timeit(lambda: legacy_calculate_surplus(old), repeat=1)
+        t_new = timeit(lambda: calculate_surplus(new))
+        assert flags(old) == flags(new)
+        print '%-24s %6d groups: original %8.1f ms, now %7.1f ms' % \
+            ('x'.join(map(str, fanout)), len(list(new)), 1000 * t_old, 1000 * t_new)
@@ -0,0 +1,50 @@
+#!/usr/bin/python
+# Check the vectorized DemandBatch against the per-group get_average() and
+# spike_detected() loop on random histories, then time both for many groups
+
+import random
+import logging
+
+from _trees import timeit
+
+from gq.group.idlejobs import (FEWEST_DATAPOINTS, _demand_of, _batch_demand_of,
+                               sample_averages)
+from gq.group.batchdemand import ragged, DemandBatch
+
+
+def random_history(rng, count):
+    """ name -> samples (or None when get_db_demand_all() found too few) """
+    history = dict()
+    for i in range(count):
+        n = rng.choice((0, 3, 7, 8, 9, rng.randint(8, 64)))
+        style = rng.random()
+        if style < 0.2:     # Emptied out in the second half
+            data = [rng.randint(0, 50) for _ in range(n / 2)] + [0] * (n - n / 2)
+        elif style < 0.4:   # Small queues, around the m < 5 cut-off
+            data = [rng.randint(0, 9) for _ in range(n)]
+        elif style < 0.6:   # Steady decline, around the spike percentage
+            top = rng.randint(5, 5000)
+            data = [int(top * (1 - rng.uniform(0.5, 0.8) * k / float(n))) for k in range(n)]
+        else:
+            data = [rng.randint(0, 5000) for _ in range(n)]
+        history['group%d' % i] = data if n >= FEWEST_DATAPOINTS else None
+    return history
+
+
+if __name__ == '__main__':
+    logging.disable(logging.CRITICAL)
+    rng = random.Random(4)
+
+    for trial in range(200):
+        history = random_history(rng, 200)
+        assert _demand_of(history, sample_averages) == _batch_demand_of(history)
+    print "Identical demand and spike decisions on 200 batches of 200 groups"
+
+    for groups in (100, 1000, 10000):
+        history = random_history(rng, groups)
+        loop = timeit(lambda: _demand_of(history, sample_averages))
+        batch = timeit(lambda: _batch_demand_of(history))
+        offsets, values = ragged(history.values())
+        core = timeit(lambda: DemandBatch(offsets, values, FEWEST_DATAPOINTS))
+        print "%6d groups: per-group loop %8.2f ms, vectorized %7.2f ms " \
+              "(%.2f ms in DemandBatch)" % (groups, 1000 * loop, 1000 * batch, 1000 * core)
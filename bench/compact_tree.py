@@ -0,0 +1,42 @@
+#!/usr/bin/python
+# Memory and traversal benchmark of CompactTree against DemandGroup objects
+
+from _trees import build_tree, deep_size, timeit
+
+from gq.group import DemandGroup
+from gq.group.compact import CompactTree, np
+
+
+def object_sum(root):
+    """ Sum leaf demand into intermediate groups, object-per-group version """
+    for grp in root.all():
+        if not grp.is_leaf:
+            grp.demand = sum(x.demand for x in grp.get_children())
+
+
+if __name__ == '__main__':
+    for fanout in ((10, 10, 10), (20, 20, 25), (10, 10, 10, 10, 10)):
+        root = build_tree(fanout, DemandGroup, seed=1,
+                          weight=lambda r: r.choice((1, 2, 8)),
+                          surplus_threshold=lambda r: r.randint(0, 20))
+        for x in root.leaf_nodes():
+            x.demand = 7
+
+        tree = CompactTree.from_tree(root)
+        n = len(tree)
+
+        obj_mem, arr_mem = deep_size(root), deep_size(tree)
+        print '%d groups: objects %6.1f MB (%d B/group), compact %6.1f MB (%d B/group)' % \
+            (n, obj_mem / 1e6, obj_mem / n, arr_mem / 1e6, arr_mem / n)
+
+        t_obj = timeit(lambda: sum(x.demand for x in root.all()))
+        t_cpt = timeit(lambda: sum(x.demand for x in tree.all()))
+        t_raw = timeit(lambda: sum(tree.demand[x] for x in tree.post_order()))
+        print '    all():        objects %7.1f ms, compact nodes %7.1f ms, ' \
+              'positions %7.1f ms' % (1000 * t_obj, 1000 * t_cpt, 1000 * t_raw)
+
+        t_obj = timeit(lambda: object_sum(root))
+        t_cpt = timeit(lambda: tree.sum_children('demand'))
+        print '    sum children: objects %7.1f ms, compact (%s) %7.1f ms' % \
+            (1000 * t_obj, 'numpy' if np else 'array', 1000 * t_cpt)
+        assert tree.demand[0] == root.demand
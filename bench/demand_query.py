@@ -0,0 +1,88 @@
+#!/usr/bin/python
+# Round trips and wall time of populate_demand()'s one bulk history query
+# against the former query per leaf, over an in-process stand-in for the DB
+# that charges a fixed latency per query
+
+import time
+import random
+import logging
+
+from _trees import build_tree
+
+from gq.group import DemandGroup
+from gq.group.idlejobs import get_db_demand, get_db_demand_all, populate_demand
+
+
+class FakeCursor(object):
+    """ Answers the two queue_log queries idlejobs makes from a list of
+        (time, group_name, amount) rows, all within the lookback window
+    """
+
+    def __init__(self, con):
+        self.con = con
+        self.rows = []
+
+    def execute(self, query, params=()):
+        self.con.round_trips += 1
+        time.sleep(self.con.latency)
+        if 'group_name=%s' in query:
+            name = params[1]
+            self.rows = [(a,) for t, n, a in self.con.table if n == name]
+        else:
+            self.rows = [(n, a) for t, n, a in sorted(self.con.table,
+                                                      key=lambda x: (x[1], x[0]))]
+        return len(self.rows)
+
+    def fetchall(self):
+        return self.rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+
+    def __init__(self, table, latency):
+        self.table = table
+        self.latency = latency
+        self.round_trips = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def close(self):
+        pass
+
+
+def per_leaf(root, con):
+    """ populate_demand() as it was: one get_db_demand() per leaf """
+    return dict((x.full_name, get_db_demand(con, x.full_name))
+                for x in root.leaf_nodes())
+
+
+if __name__ == '__main__':
+    logging.disable(logging.CRITICAL)
+    rng = random.Random(3)
+    latency = 0.0005
+
+    for fanout in ((10,), (10, 10), (10, 10, 5), (10, 10, 10)):
+        root = build_tree(fanout, DemandGroup)
+        names = [x.full_name for x in root.leaf_nodes()]
+        # An hour of samples every 5 minutes, plus groups short of data
+        table = [(t, n, rng.randint(0, 500)) for t in range(12) for n in names
+                 if t > 4 or rng.random() > 0.05]
+
+        results = []
+        for fn in (per_leaf, populate_demand):
+            con = FakeConnection(table, latency)
+            start = time.time()
+            fn(root, con)
+            results.append((con.round_trips, time.time() - start))
+
+        (old_trips, old_time), (new_trips, new_time) = results
+        assert per_leaf(root, con) == get_db_demand_all(con, names)
+        print "%4d leaves: per leaf %4d queries %8.1f ms, bulk %d query %7.1f ms" % \
+            (len(names), old_trips, 1000 * old_time, new_trips, 1000 * new_time)
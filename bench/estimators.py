@@ -0,0 +1,84 @@
+#!/usr/bin/python
+# Check the incremental midpoint estimator against populate_demand()'s
+# window rescan over many runs (saving and restoring state in between),
+# time both, and show what the other estimators make of one queue
+
+import os
+import random
+import logging
+import tempfile
+
+from _trees import timeit
+
+from gq.group.idlejobs import FEWEST_DATAPOINTS, _demand_of, sample_averages
+from gq.group.estimators import EstimatorSet, Midpoint, EWMA, Quantile, Holt
+
+LOOKBACK = 160 * 60
+
+
+def queue(rng, runs, step=300):
+    """ (time, amount) samples of one queue filling up and draining """
+    level = 0
+    for run in range(runs):
+        if rng.random() < 0.05:
+            level = rng.choice((0, rng.randint(0, 5000)))
+        level = max(0, int(level * rng.uniform(0.8, 1.1)))
+        if rng.random() > 0.05:     # Collector runs go missing now and then
+            yield run * step + rng.uniform(-20, 20), level
+
+
+def check(groups=50, runs=400, seed=8):
+    rng = random.Random(seed)
+    names = ['group_%d' % i for i in range(groups)]
+    samples = dict((x, list(queue(rng, runs))) for x in names)
+    fname = tempfile.mktemp(prefix='gq-est-')
+    try:
+        for run in range(0, runs, 3):
+            now = run * 300.0
+            est = EstimatorSet(fname, FEWEST_DATAPOINTS)
+            est.feed((x, t, v) for x in names for t, v in samples[x] if t <= now)
+            got = est.demand(names, now)
+            est.save()
+
+            windows = dict()
+            for x in names:
+                data = [v for t, v in samples[x] if now - LOOKBACK <= t <= now]
+                windows[x] = data if len(data) >= FEWEST_DATAPOINTS else None
+            assert got == _demand_of(windows, sample_averages), "run %d" % run
+
+        # A group gone from the tree leaves the state file on the next save
+        EstimatorSet(fname, FEWEST_DATAPOINTS).save(names[1:])
+        assert names[0] not in EstimatorSet(fname, FEWEST_DATAPOINTS).estimators
+    finally:
+        os.remove(fname)
+    print "Midpoint estimator matches the window rescan over %d runs of %d groups" % \
+        (runs / 3, groups)
+
+
+if __name__ == '__main__':
+    logging.disable(logging.CRITICAL)
+    check()
+
+    # Cost per run: one new sample per group vs rescanning the window
+    rng = random.Random(1)
+    samples = list(queue(rng, 1000))
+    window = [v for t, v in samples[-32:]]
+    est = Midpoint(LOOKBACK, FEWEST_DATAPOINTS)
+    for t, v in samples[:-1]:
+        est.update(t, v)
+    last = samples[-1]
+    t_inc = timeit(lambda: [est.update(last[0], last[1]) or est.demand(last[0])
+                            for _ in range(10000)]) / 10000
+    t_scan = timeit(lambda: [_demand_of({'g': window}, sample_averages)
+                             for _ in range(10000)]) / 10000
+    print "per group and run: incremental %.1f us, window rescan %.1f us" % \
+        (1e6 * t_inc, 1e6 * t_scan)
+
+    kinds = [Midpoint(LOOKBACK, 8), EWMA(LOOKBACK, 8, 40 * 60),
+             Quantile(LOOKBACK, 8, 90), Holt(LOOKBACK, 8, 0.5, 0.2)]
+    print "%8s %8s %8s %8s %8s %8s" % ('time', 'queued', 'midpoint', 'ewma', 'p90', 'holt')
+    for i, (t, v) in enumerate(samples[:120]):
+        for k in kinds:
+            k.update(t, v)
+        if i % 8 == 0:
+            print "%8d %8d %8d %8d %8d %8d" % ((t, v) + tuple(k.demand(t)[0] for k in kinds))
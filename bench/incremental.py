@@ -0,0 +1,115 @@
+#!/usr/bin/python
+# Time IncrementalBalancer.rebalance() against a full calculate_surplus() when
+# a few leaves' demand moves between runs, and check that both always end up
+# with the same flags, and that gqd reloads its tree when the DB's changed
+
+import random
+import logging
+
+from _trees import timeit
+from balance import random_tree, flags
+
+from gq.group import DemandGroup
+from gq.group.balance import calculate_surplus, IncrementalBalancer
+
+
+def move_demand(leaves, count, rng):
+    for leaf in rng.sample(leaves, min(count, len(leaves))):
+        leaf.demand = rng.choice((0, 0, rng.randint(0, 10)))
+
+
+def check(trials=200):
+    """ Incremental and full balancing agree over many runs """
+    rng = random.Random(7)
+    for seed in range(trials):
+        fanout = [rng.randint(1, 6) for _ in range(rng.randint(1, 5))]
+        weights = rng.sample((0, 0.5, 1, 1, 2, 3, 8), rng.randint(1, 5))
+        root = random_tree(fanout, DemandGroup, seed, weights)
+        leaves = list(root.leaf_nodes())
+        balancer = IncrementalBalancer(root)
+        for run in range(10):
+            before = flags(root)
+            changed = balancer.rebalance()
+            after = flags(root)
+            assert sorted(x.full_name for x in changed) == \
+                sorted(n for (n, a), (_, b) in zip(before, after) if a != b)
+            calculate_surplus(root)
+            assert flags(root) == after, "Mismatch, seed %d run %d" % (seed, run)
+            move_demand(leaves, rng.randint(0, 3), rng)
+    print 'Same flags as calculate_surplus() over %d trees x 10 runs' % trials
+
+
+def check_reload(runs=20):
+    """ gqd's BalanceState rebuilds its tree after someone else bumped the
+        tree version, but not after its own flag writes
+    """
+    import gq.group.daemon as daemon
+
+    rng = random.Random(3)
+    db = {'version': 5, 'loads': 0, 'writes': 0}
+
+    def build():
+        db['loads'] += 1
+        return random_tree((3, 4), DemandGroup, seed=db['loads'])
+
+    def populate(root):
+        move_demand(list(root.leaf_nodes()), 3, rng)
+
+    def update(root, groups):
+        if groups:
+            db['version'] += 1
+            db['writes'] += 1
+        return list(groups), []
+
+    fakes = [(daemon.gdb, 'get_version', lambda: db['version']),
+             (daemon.gdb, 'build_demand_groups_db', build),
+             (daemon.gdb, 'update_surplus_flags', update),
+             (daemon.idlejobs, 'populate_demand', populate)]
+    saved = [(mod, name, getattr(mod, name)) for mod, name, _ in fakes]
+    try:
+        for mod, name, func in fakes:
+            setattr(mod, name, func)
+        state = daemon.BalanceState(reload_every=0)
+        for _ in range(runs):
+            state.run()
+        assert db['writes'] > 1 and db['loads'] == 1, db
+
+        db['version'] += 1      # e.g. a weight edited in gqweb
+        state.run()
+        assert db['loads'] == 2, db
+        state.run()
+        assert db['loads'] == 2, db
+    finally:
+        for mod, name, func in saved:
+            setattr(mod, name, func)
+    print 'BalanceState reloads on outside version bumps only (%d own writes)' % db['writes']
+
+
+if __name__ == '__main__':
+    logging.disable(logging.CRITICAL)
+    check()
+    check_reload()
+
+    for fanout in ((10, 10, 10), (20, 20, 20), (5, 5, 5, 5, 5)):
+        rng = random.Random(1)
+        root = random_tree(fanout, DemandGroup, seed=1)
+        leaves = list(root.leaf_nodes())
+        balancer = IncrementalBalancer(root)
+        balancer.rebalance()
+        for moved in (1, 10, 100):
+            def incremental():
+                move_demand(leaves, moved, rng)
+                balancer.rebalance()
+
+            def full():
+                move_demand(leaves, moved, rng)
+                calculate_surplus(root)
+
+            # Full runs leave the balancer's flags behind, start it over
+            t_full = timeit(full)
+            balancer = IncrementalBalancer(root)
+            balancer.rebalance()
+            t_inc = timeit(incremental)
+            print "%-16s %6d groups, %3d leaves moved: full %7.2f ms, " \
+                  "incremental %7.2f ms" % (fanout, len(list(root)), moved,
+                                            1000 * t_full, 1000 * t_inc)
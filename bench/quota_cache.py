@@ -0,0 +1,63 @@
+#!/usr/bin/python
+# Load a ~100k-group quota file by parsing it and from its parsed-tree
+# cache, and write it with overwrite_file(), which parses the text in memory
+# to verify it, against re-reading the written file
+
+import os
+import shutil
+import tempfile
+
+from _trees import build_tree, timeit
+
+import gq.group.file as gfile
+from gq.group.file import QuotaFileGroup, build_quota_groups_file, overwrite_file
+
+
+def legacy_overwrite(groups, quota_file):
+    """ overwrite_file() as it was: write, then parse it again to verify """
+    tmp = quota_file + '.tmp'
+    with open(tmp, 'w') as fp:
+        groups.write_file(fp)
+    assert build_quota_groups_file(tmp, QuotaFileGroup, cache=False).full_cmp(groups)
+    os.rename(tmp, quota_file)
+
+
+if __name__ == '__main__':
+    tree = build_tree((50, 40, 50), QuotaFileGroup, seed=3,
+                      quota=lambda r: r.randint(0, 5000),
+                      priority=lambda r: r.choice((1.0, 5.0, 10.0, 20.0)),
+                      accept_surplus=lambda r: r.random() < 0.5)
+
+    tmpdir = tempfile.mkdtemp(prefix='gq_bench_')
+    fname = os.path.join(tmpdir, 'quotas.conf')
+    gfile.c.quota_cache = True
+    try:
+        t_legacy = timeit(lambda: legacy_overwrite(tree, fname), repeat=1)
+        t_write = timeit(lambda: overwrite_file(tree, fname), repeat=1)
+        print "%d groups, %.1f MB file, %.1f MB cache" % \
+            (len(list(tree)), os.path.getsize(fname) / 1e6,
+             os.path.getsize(gfile.sidecar(fname, 'cache')) / 1e6)
+        print "write + verify by re-reading the file: %.2fs, parsing the text: %.2fs" % \
+            (t_legacy, t_write)
+
+        parse = lambda: build_quota_groups_file(fname, QuotaFileGroup, cache=False)
+        cached = lambda: build_quota_groups_file(fname, QuotaFileGroup)
+        assert cached().full_cmp(parse()) and parse().full_cmp(tree)
+
+        t_parse = timeit(parse)
+        t_cached = timeit(cached)
+        print "load by parsing: %.2fs, from cache: %.2fs" % (t_parse, t_cached)
+
+        # Same content under another inode: found by hashing the file
+        shutil.copy(fname, fname + '.new')
+        os.rename(fname + '.new', fname)
+        t_hashed = timeit(lambda: cached(), repeat=1)
+        assert cached().full_cmp(tree)
+        print "from cache after a copy (hashed): %.2fs" % t_hashed
+
+        # Changed content: the cache must not be used
+        with open(fname, 'a') as fp:
+            fp.write("GROUP_QUOTA_g0_0 = 1\n")
+        assert cached().find('g0_0').quota == 1
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,103 @@
+#!/usr/bin/python
+# Parse a ~100k-group condor quota file with build_quota_groups_file()
+# against the regex-per-line parser it replaced
+
+import os
+import re
+import tempfile
+
+from _trees import build_tree, timeit
+
+from gq.group import QuotaGroup
+from gq.group.file import QuotaFileGroup, build_quota_groups_file, _read_quotas
+
+
+def legacy_lines(fobj):
+    """ The old read_lines_continue() """
+    in_line = False
+    tmp = ''
+    for line in (x.strip() for x in fobj if x):
+        if re.match('^\s*#', line):
+            continue
+        if line.endswith('\\'):
+            tmp += line.rstrip('\\')
+            in_line = True
+            continue
+        elif in_line:
+            in_line = False
+            line = tmp + line.rstrip('\\')
+            tmp = ''
+        yield line
+
+
+def legacy_parse(fname):
+    """ The old _read_quotas(), minus the error exits """
+    regexes = {
+        "names":   re.compile('^GROUP_NAMES\s*=\s*(.*)$'),
+        "quota":   re.compile('^GROUP_QUOTA_([\w\.]+)\s*=\s*(\d+)$'),
+        "prio":    re.compile('^GROUP_PRIO_FACTOR_([\w\.]+)\s*=\s*([\d\.]+)$'),
+        "surplus": re.compile('^GROUP_ACCEPT_SURPLUS_([\w\.]+)\s*=\s*(\w+)$'),
+    }
+    grps = {}
+    group_names = []
+    with open(fname) as fp:
+        for line in legacy_lines(fp):
+            for kind, regex in regexes.items():
+                if not regex.match(line):
+                    continue
+                if kind == "names":
+                    group_names = regex.match(line).group(1).replace(' ', '').split(',')
+                else:
+                    grp, val = regex.match(line).groups()
+                    if not grps.get(grp):
+                        grps[grp] = {}
+                    if kind == "surplus":
+                        val = val.upper() == "TRUE"
+                    grps[grp][kind] = val
+    return group_names, grps
+
+
+def legacy_read(fname):
+    """ The old build_quota_groups_file() """
+    group_names, grps = legacy_parse(fname)
+    root = QuotaGroup('<root>')
+    for grp in sorted(group_names):
+        p = grps[grp]
+        parts = grp.split('.')
+        parent = root
+        for x in parts[:-1]:
+            parent = parent[x]
+        parent.add_child(QuotaGroup(parts[-1], p["quota"], p["prio"], p["surplus"]))
+    return root
+
+
+if __name__ == '__main__':
+    tree = build_tree((50, 40, 50), QuotaFileGroup, seed=3,
+                      quota=lambda r: r.randint(0, 5000),
+                      priority=lambda r: r.choice((1.0, 5.0, 10.0, 20.0)),
+                      accept_surplus=lambda r: r.random() < 0.5)
+
+    fd, fname = tempfile.mkstemp(prefix='gq_bench_', suffix='.conf')
+    try:
+        with os.fdopen(fd, 'w') as fp:
+            tree.write_file(fp)
+            # Knobs the parser must step over
+            fp.write("\nGROUP_SORT_EXPR = ifThenElse(AccountingGroup =?= \"<none>\", 3.4e+38, 0)\n"
+                     "GROUP_QUOTA_DYNAMIC_g0_0 = 0.5\nGROUP_ACCEPT_SURPLUS = True\n")
+        size = os.path.getsize(fname)
+        count = len(list(tree))
+
+        new = build_quota_groups_file(fname)
+        old = legacy_read(fname)
+        assert new.full_cmp(old) and new.full_cmp(tree)
+
+        print "%d groups, %.1f MB file" % (count, size / 1e6)
+        p_old = timeit(lambda: legacy_parse(fname))
+        p_new = timeit(lambda: _read_quotas(fname))
+        print "parse  regex per line: %.2fs, prefix dispatch: %.2fs (%.1fx)" % \
+            (p_old, p_new, p_old / p_new)
+        t_old = timeit(lambda: legacy_read(fname))
+        t_new = timeit(lambda: build_quota_groups_file(fname))
+        print "parse + build tree:    %.2fs, %.2fs (%.1fx)" % (t_old, t_new, t_old / t_new)
+    finally:
+        os.unlink(fname)
@@ -0,0 +1,70 @@
+#!/usr/bin/python
+# Replay a synthetic month of queue_log history for 500 groups through the
+# balancer, and check the windowed demand against get_average() and
+# spike_detected() run on the raw samples
+
+import random
+import logging
+
+from _trees import timeit
+from balance import random_tree
+
+from gq.group import DemandGroup
+from gq.group.idlejobs import FEWEST_DATAPOINTS, get_average, spike_detected
+from gq.group.replay import Replay, window_demand
+
+
+def synthetic_history(names, days, step=300, seed=0):
+    """ (time, group, amount) every @step seconds for each group: bursts of
+        queued jobs that drain away, with some groups idle for hours
+    """
+    rng = random.Random(seed)
+    level = dict((x, 0) for x in names)
+    for t in xrange(0, days * 86400, step):
+        for name in names:
+            if rng.random() < 0.01:
+                level[name] = rng.choice((0, rng.randint(10, 5000)))
+            else:
+                level[name] = max(0, int(level[name] * rng.uniform(0.9, 1.02)))
+            yield t, name, level[name]
+
+
+def naive_demand(samples):
+    if len(samples) < FEWEST_DATAPOINTS:
+        return 0
+    average = int(round(get_average(samples)))
+    if average > 0 and spike_detected(samples):
+        return 0
+    return average
+
+
+def check(trials=2000, seed=3):
+    rng = random.Random(seed)
+    times = sorted(rng.uniform(0, trials) for _ in xrange(trials))
+    values = [rng.choice((0, rng.randint(0, 40), rng.randint(0, 4000))) for _ in times]
+    ticks = [rng.uniform(0, trials) for _ in xrange(trials)]
+    for window in (5, 30):
+        demand = window_demand(times, values, ticks, window, None)
+        for tick, got in zip(ticks, demand):
+            samples = [v for t, v in zip(times, values) if tick - window <= t <= tick]
+            assert got == naive_demand(samples)
+
+
+if __name__ == '__main__':
+    logging.disable(logging.CRITICAL)
+    check()
+
+    days = 30
+    root = random_tree((5, 10, 10), DemandGroup, seed=1)
+    names = [x.full_name for x in root.leaf_nodes()]
+    history = list(synthetic_history(names, days))
+
+    report = []
+    took = timeit(lambda: report.append(Replay(root, change_lookback=30).run(history)),
+                  repeat=1)
+    report = report[-1]
+    print "%d leaves, %d days, %d samples: %.2f s, %d toggles" % \
+        (len(names), days, len(history), took, report.total_toggles)
+    print "demand at all ticks %.2f s, %d ticks %.2f s (median %.3f ms, max %.2f ms)" % \
+        (report.demand_time, len(report.tick_times), sum(report.tick_times),
+         1000 * report.tick_stats()[1], 1000 * report.tick_stats()[3])
@@ -0,0 +1,60 @@
+#!/usr/bin/python
+# Fill ring buffers for a few hundred groups past their capacity, check the
+# windows read back against a plain list of samples, and time the balancer's
+# read of all windows
+
+import time
+import shutil
+import random
+import logging
+import tempfile
+
+from _trees import timeit
+
+from gq.group.ringbuf import RingStore
+
+LOOKBACK = 160 * 60
+
+
+if __name__ == '__main__':
+    logging.disable(logging.CRITICAL)
+    rng = random.Random(6)
+    path = tempfile.mkdtemp(prefix='gq-ring-')
+    try:
+        groups = 500
+        names = ['group_%d' % i for i in range(groups)]
+        store = RingStore(path, capacity=256)
+        store.update_index((x, i) for i, x in enumerate(names))
+
+        # 300 collector runs, 5 minutes apart: wraps every ring once
+        samples = dict((x, []) for x in names)
+        spent = 0
+        for run in range(300):
+            when = run * 300.0
+            data = dict((x, rng.randint(0, 5000)) for x in names)
+            start = time.time()
+            store.append(data, when)
+            spent += time.time() - start
+            for x in names:
+                samples[x].append(data[x])
+
+            if run % 7 == 0:
+                history = store.history(names, LOOKBACK, 8, now=when)
+                for x in names:
+                    expect = samples[x][-(LOOKBACK / 300 + 1):]
+                    got = history[x]
+                    assert (got is None and len(expect) < 8) or list(got) == expect, x
+        write = spent / 300
+        store.close()
+
+        reader = RingStore(path, capacity=256)
+        read = timeit(lambda: reader.history(names, LOOKBACK, 8, now=300 * 300.0))
+        print "%d groups: append %.2f ms per collector run, read all windows %.2f ms" % \
+            (groups, 1000 * write, 1000 * read)
+        # The windows are copies, usable after the store is closed
+        kept = reader.history(names, LOOKBACK, 8, now=299 * 300.0)
+        reader.close()
+        for x in names:
+            assert list(kept[x]) == samples[x][-(LOOKBACK / 300 + 1):], x
+    finally:
+        shutil.rmtree(path)
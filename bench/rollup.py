@@ -0,0 +1,108 @@
+#!/usr/bin/python
+# How far demand computed from queue_rollup buckets strays from the raw
+# queue_log samples for a few bucket sizes, and how many rows each reads
+
+import random
+import logging
+
+from _trees import timeit
+
+from gq.group.idlejobs import (FEWEST_DATAPOINTS, sample_averages, rollup_averages,
+                               spike_from_averages)
+
+LOOKBACK = 160 * 60
+
+
+def history(rng, end, step=300):
+    """ (time, amount) of collector runs every ~@step seconds up to @end """
+    t, level, out = rng.uniform(0, step), rng.randint(0, 3000), []
+    while t < end:
+        if rng.random() < 0.05:
+            level = rng.choice((0, rng.randint(0, 5000)))
+        level = max(0, int(level * rng.uniform(0.85, 1.05)))
+        out.append((t, level))
+        t += step * rng.uniform(0.9, 1.1)
+    return out
+
+
+def raw_window(data, now):
+    return [v for t, v in data if t >= now - LOOKBACK]
+
+
+def rollup_window(data, now, size):
+    """ What get_rollup_demand_all() reads: buckets starting in the window """
+    start = -(-(now - LOOKBACK) // size) * size
+    rows = []
+    for t, v in data:
+        if t < start:
+            continue
+        b = int(t // size)
+        if rows and rows[-1][0] == b:
+            _, n, total, first, _ = rows[-1]
+            rows[-1] = (b, n + 1, total + v, first, v)
+        else:
+            rows.append((b, 1, v, v, v))
+    return [x[1:] for x in rows]
+
+
+def demand(averages, data):
+    whole, m, n = averages(data)
+    average = int(round(whole))
+    return 0 if average > 0 and spike_from_averages(m, n) else average
+
+
+if __name__ == '__main__':
+    logging.disable(logging.CRITICAL)
+    rng = random.Random(2)
+
+    cases = list()
+    for _ in range(2000):
+        now = LOOKBACK + rng.uniform(0, 3600)
+        cases.append((history(rng, now), now))
+
+    for size in (300, 600, 1200, 2400):
+        raw_rows = rolled_rows = differ = 0
+        errors = []
+        worst = 0.0
+        for data, now in cases:
+            values, rolled = raw_window(data, now), rollup_window(data, now, size)
+            if len(values) < FEWEST_DATAPOINTS or sum(x[0] for x in rolled) < FEWEST_DATAPOINTS:
+                continue
+            raw_rows += len(values)
+            rolled_rows += len(rolled)
+
+            # The whole-window average is that of the samples from the first
+            # bucket boundary on, so the k before it move it by at most
+            # k / (n - 1) of the window's range, k < one bucket of samples
+            n, k = len(values), len(values) - sum(x[0] for x in rolled)
+            spread = max(values) - min(values)
+            off = abs(rollup_averages(rolled)[0] - sample_averages(values)[0])
+            assert k <= size / (0.9 * 300) + 1
+            assert off <= k / (n - 1.0) * spread + 1e-6, (size, off, k, n, spread)
+            if spread:
+                worst = max(worst, off / spread)
+            exact, approx = demand(sample_averages, values), demand(rollup_averages, rolled)
+            differ += (exact == 0) != (approx == 0)
+            if exact and approx:
+                errors.append(abs(approx - exact) / float(exact))
+        errors.sort()
+        print "%3d min buckets: %5.1f%% of the raw rows, demand off by median %5.2f%% " \
+              "p95 %5.2f%%, zero/non-zero differs in %d/%d" % \
+              (size / 60, 100.0 * rolled_rows / raw_rows, 100 * errors[len(errors) / 2],
+               100 * errors[int(len(errors) * 0.95)], differ, len(cases))
+        print "    average off by at most %4.1f%% of the window's range, " \
+              "about (bucket + interval) / lookback = %4.1f%%" % \
+            (100 * worst, 100.0 * (size + 300) / LOOKBACK)
+
+    # Exact when every bucket holds a single sample
+    for data, now in cases[:200]:
+        values = raw_window(data, now)
+        if len(values) >= FEWEST_DATAPOINTS:
+            single = [(1, v, v, v) for v in values]
+            assert sample_averages(values) == rollup_averages(single)
+
+    data = [rng.randint(0, 5000) for _ in range(32)]
+    rolled = [(4, sum(data[i:i + 4]), data[i], data[i + 3]) for i in range(0, 32, 4)]
+    print "averages of 32 samples: raw %.1f us, 8 buckets %.1f us" % \
+        (1e6 * timeit(lambda: [sample_averages(data) for _ in range(10000)]) / 10000,
+         1e6 * timeit(lambda: [rollup_averages(rolled) for _ in range(10000)]) / 10000)
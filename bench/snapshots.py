@@ -0,0 +1,43 @@
+#!/usr/bin/python
+# Memory and time of keeping many copy-on-write Snapshot versions of a
+# ~50k-group tree, against a full copy per version
+
+import random
+from collections import deque
+
+from _trees import build_tree, deep_size, timeit
+
+from gq.group.diff import tree_diff
+from gq.group.snapshot import Snapshot
+
+
+if __name__ == '__main__':
+    rng = random.Random(3)
+    root = build_tree((40, 35, 35), quota=lambda r: r.randint(1, 1000), seed=1)
+    names = [x.full_name for x in root]
+
+    t_freeze = timeit(lambda: Snapshot.freeze(root), repeat=1)
+    base = Snapshot.freeze(root)
+    one = deep_size(base)
+    print '%d groups: freeze() %.0f ms, %.1f MB per full copy' % \
+        (len(names), 1000 * t_freeze, one / 1e6)
+
+    versions = 50
+    history = deque([base], maxlen=versions)
+
+    def edit():
+        snap = history[-1]
+        for name in rng.sample(names, 5):
+            snap = snap.set(name, quota=rng.randint(1, 1000))
+        history.append(snap)
+
+    t_edit = timeit(lambda: [edit() for _ in range(versions - 1)], repeat=1)
+    total = deep_size(list(history))
+    print '%d versions, 5 edits each: %.2f ms per version, %.1f MB total ' \
+          '(%.1f MB as full copies)' % (versions, 1000 * t_edit / (versions - 1),
+                                       total / 1e6, versions * one / 1e6)
+
+    t_cold = timeit(lambda: tree_diff(history[-2], history[-1]), repeat=1)
+    t_warm = timeit(lambda: tree_diff(history[-3], history[-2]))
+    print 'tree_diff() of consecutive versions: %.1f ms cold, %.2f ms warm, ' \
+          '%d changes' % (1000 * t_cold, 1000 * t_warm, len(tree_diff(history[-2], history[-1])))
@@ -0,0 +1,85 @@
+#!/usr/bin/python
+# Diff two ~20k-group quota trees that differ in a few hundred places, with
+# tree_diff() against the set-and-find algorithm get_diff_str() used
+
+import random
+
+from _trees import build_tree, timeit
+
+from gq.group import QuotaGroup
+from gq.group.diff import tree_diff, format_text
+
+
+def legacy_diff_str(old, new, find=lambda root, name: root.find(name)):
+    """ The algorithm of the old UpdateQuotaGroup.get_diff_str() """
+    mine = set([x.full_name for x in old.all()])
+    theirs = set([x.full_name for x in new.all()])
+
+    s = ''
+    for grp in theirs - mine:
+        s += "Added " + repr(find(new, grp)) + "\n"
+    for grp in mine - theirs:
+        s += "Deleted " + repr(find(old, grp)) + "\n"
+    for grpname in mine & theirs:
+        mygrp, theirgrp = find(old, grpname), find(new, grpname)
+        for attr in mygrp.diff(theirgrp):
+            s += "Group '%s' - %s changed from %s to %s\n" % \
+                (grpname, attr, getattr(mygrp, attr), getattr(theirgrp, attr))
+    return s
+
+
+def linear_find(root, name):
+    """ find() as it was before the full-name index """
+    for x in root.all():
+        if name == x.full_name:
+            return x
+
+
+def mutate(root, n, rng):
+    """ Make @n random edits: quota/prio changes, additions and removals """
+    for _ in range(n):
+        grp = rng.choice(list(root.children.values()))
+        while grp.children and rng.random() < 0.7:
+            grp = rng.choice(list(grp.children.values()))
+        what = rng.random()
+        if what < 0.6:
+            grp.quota += rng.randint(1, 100)
+        elif what < 0.8:
+            grp.prio = rng.choice((1.0, 5.0, 20.0))
+        elif what < 0.9:
+            grp.add_child(QuotaGroup('new%d' % rng.randint(0, 1 << 30), 10))
+        elif grp.parent is not root:
+            grp.parent.remove_child(grp.name)
+
+
+if __name__ == '__main__':
+    rng = random.Random(7)
+    quota = lambda r: r.randint(1, 1000)
+    old = build_tree((20, 30, 33), quota=quota, seed=1)
+    new = build_tree((20, 30, 33), quota=quota, seed=1)
+    mutate(new, 300, rng)
+    n = len(list(old))
+    print 'Trees of %d and %d groups' % (n, len(list(new)))
+
+    t_new = timeit(lambda: format_text(tree_diff(old, new)), repeat=1)
+    changes = tree_diff(old, new)
+    print 'tree_diff(), cold         %8.1f ms, %d changes' % (1000 * t_new, len(changes))
+
+    # tree_diff() uses digests only once something (e.g. full_cmp()) has
+    # computed them
+    t_hash = timeit(lambda: (old.digest, new.digest), repeat=1)
+    print 'digests of both trees     %8.1f ms' % (1000 * t_hash)
+
+    t_warm = timeit(lambda: format_text(tree_diff(old, new)))
+    print 'tree_diff(), digests warm %8.1f ms' % (1000 * t_warm)
+
+    t_old = timeit(lambda: legacy_diff_str(old, new), repeat=1)
+    print 'get_diff_str(), indexed   %8.1f ms' % (1000 * t_old)
+
+    sample = rng.sample([x.full_name for x in old], 20)
+    t_find = timeit(lambda: [linear_find(old, x) for x in sample], repeat=1) / 20
+    print 'get_diff_str(), linear    %8.1f s (estimated from %d finds at %.1f ms)' % \
+        (2 * n * t_find, len(sample), 1000 * t_find)
+
+    legacy = sorted(x for x in legacy_diff_str(old, new).split('\n') if x)
+    assert legacy == sorted(format_text(tree_diff(old, new)).split('\n'))
@@ -0,0 +1,45 @@
+#!/usr/bin/python
+# Per-node cost of walk()/all()/pre_order() as trees get deeper, against the
+# nested recursive generators walk() used to be built from
+
+from _trees import timeit
+
+from gq.group import AbstractGroup
+
+
+def recursive_walk(grp):
+    """ The pre-stack implementation of AbstractGroup.walk() """
+    for x in grp.get_children():
+        for y in recursive_walk(x):
+            yield y
+        yield x
+
+
+def chains(total, depth):
+    """ A root with @total / @depth chains of @depth groups hanging off it """
+    root = AbstractGroup('<root>')
+    for n in range(total // depth):
+        node = AbstractGroup('c%d' % n)
+        root.add_child(node)
+        for _ in range(depth - 1):
+            child = AbstractGroup('c')
+            node.add_child(child)
+            node = child
+    return root
+
+
+if __name__ == '__main__':
+    total = 20000
+    for depth in (1, 10, 100, 500, 1000):
+        root = chains(total, depth)
+        per_node = lambda t: 1e6 * t / total
+
+        t_walk = timeit(lambda: sum(1 for _ in root.walk()))
+        t_pre = timeit(lambda: sum(1 for _ in root.pre_order()))
+        if depth < 900:
+            t_rec = per_node(timeit(lambda: sum(1 for _ in recursive_walk(root))))
+            t_rec = '%6.2f' % t_rec
+        else:
+            t_rec = '   n/a'    # Nested generators hit the recursion limit
+        print 'depth %4d: walk() %5.2f us/node, pre_order() %5.2f us/node, ' \
+              'recursive %s us/node' % (depth, per_node(t_walk), per_node(t_pre), t_rec)
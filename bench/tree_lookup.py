@@ -0,0 +1,38 @@
+#!/usr/bin/python
+# Benchmark name lookups (find / in / [dotted.name]) on a ~50k-group tree,
+# comparing the full-name index against the old walk-the-tree lookup
+
+import time
+import random
+
+from _trees import build_tree, timeit
+
+
+def linear_find(root, name):
+    """ The pre-index implementation of AbstractGroup.find() """
+    for x in root.all():
+        if name == x.full_name:
+            return x
+    return None
+
+
+if __name__ == '__main__':
+    start = time.time()
+    root = build_tree((40, 35, 35))
+    build = time.time() - start
+    names = [x.full_name for x in root]
+    print 'Tree of %d groups built in %.2fs' % (len(names), build)
+
+    sample = random.Random(1).sample(names, 20)
+
+    old = timeit(lambda: [linear_find(root, x) for x in sample], repeat=1)
+    new = timeit(lambda: [root.find(x) for x in sample])
+    print 'find():      linear %9.3f ms/lookup, indexed %7.4f ms/lookup (%dx)' % \
+        (1000 * old / len(sample), 1000 * new / len(sample), old / max(new, 1e-9))
+
+    t_in = timeit(lambda: [x in root for x in sample])
+    t_get = timeit(lambda: [root[x] for x in sample])
+    print '"in":        indexed %7.4f ms/lookup' % (1000 * t_in / len(sample))
+    print '[dotted]:    indexed %7.4f ms/lookup' % (1000 * t_get / len(sample))
+
+    assert all(linear_find(root, x) is root.find(x) for x in sample[:3])
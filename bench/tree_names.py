@@ -0,0 +1,38 @@
+#!/usr/bin/python
+# Benchmark full_name / depth access over a ~100k-group tree, comparing the
+# memoized properties against the old walk-up-and-join on every access
+
+from _trees import build_tree, timeit
+
+
+def legacy_full_name(grp):
+    """ The pre-cache implementation of AbstractGroup.full_name """
+    if not grp.parent:
+        return grp.name
+
+    names = list()
+    parent = grp
+    while parent is not None:
+        names.append(parent.name)
+        parent = parent.parent
+    return ".".join(reversed(names[:-1]))
+
+
+if __name__ == '__main__':
+    root = build_tree((10, 10, 10, 10, 10))
+    nodes = list(root)
+    print 'Tree of %d groups, depth 5' % len(nodes)
+
+    old = timeit(lambda: [legacy_full_name(x) for x in nodes])
+    new = timeit(lambda: [x.full_name for x in nodes])
+    print 'full_name: legacy %6.1f ms, cached %6.1f ms per pass' % (1000 * old, 1000 * new)
+
+    old = timeit(lambda: [repr(x) for x in root])
+    print 'iterate+repr():   %6.1f ms per pass' % (1000 * old)
+
+    top = root.children['g0_0']
+    top.rename('renamed')
+    new = timeit(lambda: [x.full_name for x in nodes], repeat=1)
+    print 'full_name right after renaming a 10%% subtree: %6.1f ms' % (1000 * new)
+
+    assert all(legacy_full_name(x) == x.full_name for x in nodes)
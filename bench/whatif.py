@@ -0,0 +1,57 @@
+#!/usr/bin/python
+# Time WhatIf.surplus() sweeping thousands of demand scenarios, and check it
+# against calculate_surplus() run on the tree once per scenario
+
+import time
+import random
+import logging
+
+from _trees import timeit
+from balance import random_tree
+
+from gq.group import DemandGroup
+from gq.group.balance import calculate_surplus
+from gq.group.whatif import WhatIf
+
+
+def check(root, wi, demands):
+    leaves = [root.find(x) for x in wi.leaves]
+    groups = [root.find(x) for x in wi.groups]
+    flags = wi.surplus(demands)
+    for row, expect in zip(demands, flags):
+        for leaf, d in zip(leaves, row):
+            leaf.demand = d
+        calculate_surplus(root)
+        assert [x.accept for x in groups] == list(expect)
+
+
+if __name__ == '__main__':
+    logging.disable(logging.CRITICAL)
+    rng = random.Random(5)
+
+    for seed in range(30):
+        fanout = [rng.randint(1, 5) for _ in range(rng.randint(1, 4))]
+        root = random_tree(fanout, DemandGroup, seed)
+        wi = WhatIf(root)
+        demands = wi.scenarios(20)
+        for row in demands:
+            for i in range(len(row)):
+                row[i] = rng.choice((0, rng.randint(0, 12)))
+        check(root, wi, demands)
+    print 'Same flags as calculate_surplus() on 30 random trees x 20 scenarios'
+
+    root = random_tree((4, 5, 6), DemandGroup, 1)
+    start = time.time()
+    wi = WhatIf(root)
+    print '%d groups, %d leaves: plan built in %.1f ms' % \
+        (len(wi.groups), len(wi.leaves), 1000 * (time.time() - start))
+
+    for count in (1, 100, 1000, 5000):
+        demands = wi.scenarios(count)
+        demands *= [[rng.choice((0, 0.5, 1, 2)) for _ in wi.leaves] for _ in range(count)]
+        t = timeit(lambda: wi.surplus(demands))
+        print '%5d scenarios: %7.1f ms' % (count, 1000 * t)
+
+    t = timeit(lambda: calculate_surplus(root))
+    print 'calculate_surplus() once: %.2f ms, so %.0f ms for 5000 scenarios' % \
+        (1000 * t, 5000 * 1000 * t)
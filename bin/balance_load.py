@@ -2,11 +2,13 @@
 
 import optparse
 import logging
+import time
 import sys
 
 import gq.group.db as group_db
 import gq.group.idlejobs as idle
 import gq.group.balance as balance
+import gq.group.daemon as daemon
 import gq.config as c
 
 from gq.log import setup_logging
@@ -21,22 +23,50 @@ parser = optparse.OptionParser(
     epilog="Script to balance the accept-surplus flag for ATLAS"
 )
 
+parser.add_option("-i", "--interval", action="store", type="int",
+                  help="Keep running, rebalancing every INTERVAL seconds and "
+                       "only where demand changed")
+parser.add_option("-r", "--reload", action="store", type="int", default=12,
+                  help="With --interval, rebuild the tree from the DB every "
+                       "RELOAD runs, 0 for only when it changes (%default)")
 parser.add_option("-d", "--debug", action="store_true",
                   help="Enable debug mode for logging")
 parser.add_option("-l", "--logfile", action="store", default=c.analyze_logfile,
                   help="File to log information to ('-' for stderr)")
 options, args = parser.parse_args()
+if options.reload < 0:
+    parser.error("--reload can't be negative")
 
 loglevel = logging.DEBUG if options.debug else c.log_level
 
 log = setup_logging(options.logfile, backup=3, size_mb=50, level=loglevel)
 
+
+def run_forever(interval, reload_every):
+    """ Long-lived mode: keep the tree in memory, rebalance only the sibling
+        sets whose demand changed and write only the changed flags, plus any
+        the change_lookback held back last time
+    """
+    state = daemon.BalanceState(reload_every)
+    while True:
+        start = time.time()
+        try:
+            state.run()
+        except Exception:
+            log.exception("Uncaught exception, reloading on next run")
+
+        time.sleep(max(0, interval - (time.time() - start)))
+
+
 field_map = {'group_name': 'name',
              'accept_surplus': 'surplus',
              'surplus_threshold': 'threshold',
              'weight': 'weight'}
 
 if __name__ == "__main__":
+    if options.interval:
+        run_forever(options.interval, options.reload)
+
     try:
         log.info("===================== START Balance =======================")
         groups = group_db.build_demand_groups_db()
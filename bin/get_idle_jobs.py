@@ -2,35 +2,15 @@
 
 import optparse
 import logging
-import glob
 import sys
-import imp
-
-import os.path as path
 
 import gq.config as c
 
+from gq.group.collectors import load_modules
 from gq.group.idlejobs import insert_data
 from gq.log import setup_logging
 
 
-def load_module_path(arg):
-    mods = None
-    name = lambda x: path.basename(x).split('.')[0]
-
-    if not path.exists(arg):
-        log.error("Module path '%s' does not exist", arg)
-        return None
-    elif path.isdir(arg):
-        pyfiles = glob.glob(path.join(arg, '*.py'))
-        pyfiles = filter(lambda x: '__init__.py' not in x, pyfiles)
-        mods = [imp.load_source(name(x), x) for x in pyfiles]
-    elif path.isfile(arg):
-        mods = [imp.load_source(name(arg), arg)]
-
-    return mods
-
-
 parser = optparse.OptionParser(
     usage="%prog [-h] [-d] [-l <log>] MODULE_SOURCE",
     description="Script to populate group-quota db with jobs\n\n",
@@ -54,7 +34,7 @@ if not args or len(args) != 1:
     print >>sys.stderr, "Wrong number of arguments!"
     sys.exit(1)
 
-modules = load_module_path(args[0])
+modules = load_modules(args[0])
 
 if modules is None:
     sys.exit(1)
@@ -64,8 +44,5 @@ elif len(modules) < 1:
 
 log.debug("Loaded %d module(s): %s", len(modules), ", ".join(x.__name__ for x in modules))
 
-# Days to keep old data around
-keep_days = 30
-
 if __name__ == '__main__':
-    sys.exit(0 if insert_data(modules, keep_days) else 1)
+    sys.exit(0 if insert_data(modules) else 1)
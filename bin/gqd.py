@@ -0,0 +1,119 @@
+#!/usr/bin/python -Wignore
+# Desc: Long-running replacement for the get_idle_jobs.py, balance_load.py,
+#       update_quotas.py and (with -P) prune_queue_log.py cron jobs: collects
+#       idle jobs, balances the accept-surplus flags, writes the condor quota
+#       file and prunes old idle-job samples as stages of one pipeline,
+#       keeping the group trees in memory between cycles.
+#
+#       SIGTERM/SIGINT stop it after the running stage, SIGHUP rebuilds the
+#       demand tree from the DB on the next balance, SIGUSR1 logs the
+#       per-stage timings (also kept in the [daemon] status_file).
+
+import optparse
+import logging
+import signal
+import sys
+
+import gq.config as c
+import gq.group.daemon as daemon
+import gq.group.retention as retention
+
+from gq.group.collectors import load_modules
+from gq.group.idlejobs import insert_data
+from gq.log import setup_logging
+
+CONDOR_RECONFIG = 'condor_reconfig'
+
+
+parser = optparse.OptionParser(
+    usage="%prog [options]",
+    description="Daemon that collects idle jobs, balances the surplus flags and "
+                "writes the condor quota file, each stage every so many seconds "
+                "as set in the [daemon] section of the config",
+    epilog="Stages without the options they need are left out, e.g. only give "
+           "-q where the negotiator runs to just keep its quota file updated.",
+)
+parser.add_option("-m", "--modules", action="store",
+                  help="Collector module or directory of them, see get_idle_jobs.py; "
+                       "enables the collect stage")
+parser.add_option("-B", "--no-balance", action="store_false", dest="balance", default=True,
+                  help="Leave out the balance stage")
+parser.add_option("-q", "--quota-file", action="store",
+                  help="Condor quota file to keep up to date; enables the write-config stage")
+parser.add_option("-b", "--backup-file", dest="backup",
+                  help="File to back-up quotas to, defaults to no backup")
+parser.add_option("-r", "--reconfig", action="store_true", default=False,
+                  help="Issue a condor_reconfig after the quota file changed")
+parser.add_option("-P", "--prune", action="store_true", default=False,
+                  help="Apply the [retention] policy to the idle-job history; "
+                       "enables the prune stage")
+parser.add_option("-1", "--once", action="store_true", default=False,
+                  help="Run every stage once and exit")
+parser.add_option("-d", "--debug", action="store_true",
+                  help="Enable debug mode for logging")
+parser.add_option("-l", "--logfile", action="store", default=c.gqd_logfile,
+                  help="File to log information to ('-' for stderr)")
+options, args = parser.parse_args()
+
+loglevel = logging.DEBUG if options.debug else c.log_level
+
+log = setup_logging(options.logfile, backup=3, size_mb=50, level=loglevel)
+
+
+def build_pipeline():
+    stages = list()
+    state = None
+
+    if options.modules:
+        modules = load_modules(options.modules)
+        if not modules:
+            log.error("No collector modules loaded from %s", options.modules)
+            sys.exit(1)
+        log.info("Loaded %d module(s): %s", len(modules), ", ".join(x.__name__ for x in modules))
+        stages.append(daemon.Stage('collect', lambda: insert_data(modules),
+                                   c.collect_interval))
+
+    if options.balance:
+        state = daemon.BalanceState(c.reload_runs)
+        stages.append(daemon.Stage('balance', state.run, c.balance_interval))
+
+    if options.quota_file:
+        writer = daemon.QuotaWriter(options.quota_file, options.backup,
+                                    CONDOR_RECONFIG if options.reconfig else None)
+        stages.append(daemon.Stage('write-config', writer.run, c.config_interval))
+
+    if options.prune:
+        stages.append(daemon.Stage('prune', retention.prune, c.prune_interval))
+
+    if not stages:
+        parser.error("No stages to run")
+
+    return daemon.Pipeline(stages, c.gqd_status_file), state
+
+
+def log_timings(pipeline):
+    for name, t in sorted(pipeline.timings().items()):
+        log.info("%s: %d runs (%d failed), last %.3fs, mean %.3fs, max %.3fs",
+                 name, t['runs'], t['failures'], t['last'], t['mean'], t['max'])
+
+
+if __name__ == '__main__':
+    pipeline, state = build_pipeline()
+
+    if options.once:
+        pipeline.cycle()
+        log_timings(pipeline)
+        sys.exit(0 if all(x.failures == 0 for x in pipeline.stages) else 1)
+
+    signal.signal(signal.SIGTERM, lambda *x: pipeline.stop())
+    signal.signal(signal.SIGINT, lambda *x: pipeline.stop())
+    signal.signal(signal.SIGUSR1, lambda *x: log_timings(pipeline))
+    if state is not None:
+        signal.signal(signal.SIGHUP, lambda *x: state.reload())
+
+    log.info("===================== START gqd =======================")
+    try:
+        pipeline.run_forever()
+    finally:
+        log_timings(pipeline)
+        log.info("===================== END gqd =======================")
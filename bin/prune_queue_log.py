@@ -0,0 +1,41 @@
+#!/usr/bin/python
+# Remove old idle-job samples, separately from the collector that inserts
+# them. Meant to run from Cron a few times a day.
+
+import optparse
+import logging
+import sys
+
+import gq.group.retention as retention
+import gq.config as c
+
+from gq.log import setup_logging
+
+parser = optparse.OptionParser(
+    description="Apply the retention policy to the queue_log history: delete "
+                "or drop samples older than keep_days, optionally folding them "
+                "into hourly summaries first",
+)
+parser.add_option("-k", "--keep-days", action="store", type="int", default=c.keep_days,
+                  help="Days of samples to keep (%default)")
+parser.add_option("-m", "--method", action="store", default=c.retention_method,
+                  choices=("delete", "partitions"),
+                  help="'delete' in chunks or drop daily 'partitions' (%default)")
+parser.add_option("--downsample", action="store_true", default=c.downsample,
+                  help="Fold old samples into hourly min/avg/max rows first")
+parser.add_option("-d", "--debug", action="store_true",
+                  help="Enable debug mode for logging")
+parser.add_option("-l", "--logfile", action="store", default=c.retention_logfile,
+                  help="File to log information to ('-' for stderr)")
+options, args = parser.parse_args()
+
+loglevel = logging.DEBUG if options.debug else c.log_level
+
+log = setup_logging(options.logfile, backup=2, size_mb=10, level=loglevel)
+
+if __name__ == '__main__':
+    try:
+        retention.prune(options.keep_days, options.method, options.downsample)
+    except Exception:
+        log.exception("Uncaught exception!")
+        sys.exit(1)
@@ -0,0 +1,85 @@
+#!/usr/bin/python
+# Replay recorded idle-job history through the balancer to see how often the
+# surplus flags would flip under different parameters, without touching the
+# production database flags
+
+import optparse
+import datetime
+import logging
+import sys
+
+import gq.group.db as group_db
+import gq.group.replay as replay
+import gq.config as c
+
+from gq.group import DemandGroup
+from gq.log import setup_logging
+
+
+def read_groups_file(fname):
+    """ Rows of group_name,weight,surplus_threshold,accept_surplus as dicts """
+    def builder(fields):
+        for line in open(fname):
+            parts = [x.strip() for x in line.split(',')]
+            if len(parts) != 4 or parts[0] == 'group_name':
+                continue
+            yield {'group_name': parts[0], 'weight': float(parts[1]),
+                   'surplus_threshold': int(parts[2]),
+                   'accept_surplus': parts[3].lower() in ('1', 'true')}
+    return builder
+
+
+parser = optparse.OptionParser(
+    usage="%prog [options]",
+    description="Replay queue_log history (from the database or an exported "
+                "file) through calculate_surplus() at simulated ticks and report "
+                "flag toggles, time with surplus per group and per-tick runtime",
+)
+parser.add_option("-f", "--file", help="Exported queue_log history: lines of "
+                  "query_time,group_name,amount_in_queue (default: read the DB)")
+parser.add_option("-g", "--groups", help="CSV of group_name,weight,surplus_threshold,"
+                  "accept_surplus to use instead of the DB groups table")
+parser.add_option("-s", "--start", help="Start date (YYYY-MM-DD) for DB history")
+parser.add_option("-e", "--end", help="End date (YYYY-MM-DD) for DB history, "
+                  "defaults to now")
+parser.add_option("-t", "--tick", type="int", default=300,
+                  help="Seconds between simulated balancer runs (%default)")
+parser.add_option("--change-lookback", type="int", default=c.change_lookback,
+                  help="Minutes between changes of one flag (%default)")
+parser.add_option("--demand-lookback", type="int", default=c.demand_lookback,
+                  help="Minutes of demand to average (%default)")
+parser.add_option("--pct-dec-spike", type="float", default=c.pct_dec_spike,
+                  help="Percent decrease between halves that counts as a spike (%default)")
+parser.add_option("-d", "--debug", action="store_true",
+                  help="Log the balancer's decisions (very verbose)")
+parser.add_option("-l", "--logfile", action="store", default='-',
+                  help="File to log information to ('-' for stderr)")
+options, args = parser.parse_args()
+
+log = setup_logging(options.logfile, level=logging.DEBUG if options.debug else logging.WARNING)
+
+if __name__ == '__main__':
+    if options.file:
+        history = replay.read_history_file(options.file)
+    elif options.start:
+        parse = lambda x: datetime.datetime.strptime(x, '%Y-%m-%d')
+        end = parse(options.end) if options.end else datetime.datetime.now()
+        history = replay.read_history_db(parse(options.start), end)
+    else:
+        parser.error("Need either a history file (-f) or a start date (-s)")
+
+    if options.groups:
+        root = group_db._build_groups_db(DemandGroup, None,
+                                         group_builder=read_groups_file(options.groups))
+    else:
+        root = group_db.build_demand_groups_db()
+
+    sim = replay.Replay(root, tick=options.tick,
+                        demand_lookback=options.demand_lookback,
+                        pct_dec_spike=options.pct_dec_spike,
+                        change_lookback=options.change_lookback)
+    start = datetime.datetime.now()
+    report = sim.run(history)
+    print report.format()
+    print "Replayed in %s" % (datetime.datetime.now() - start)
+    sys.exit(0)
@@ -13,19 +13,15 @@
 #   8/24/15     v2.0 take arguments from command line
 
 
+import json
 import logging
 import optparse
-import os
-import os.path
-import shutil
 import smtplib
 import subprocess
 import sys
-import tempfile
-import time
 
-import gq.group as group
 import gq.group.db as gdb
+import gq.group.diff as gdiff
 import gq.group.file as gfile
 from gq.log import setup_logging
 
@@ -35,99 +31,42 @@ from email.utils import formatdate
 CONDOR_RECONFIG = 'condor_reconfig'
 
 
-class UpdateQuotaGroup(group.QuotaGroup):
-
-    file_template = """\
-# /-----------------------------------------------------\\
-# | This file is automatically generated -- DO NOT EDIT |
-# | Last updated:     %s          |
-# \-----------------------------------------------------/
-{0}
-""" % time.ctime()
-
-    def get_diff_str(self, other):
-        mine = set([x.full_name for x in self.all()])
-        theirs = set([x.full_name for x in other.all()])
-
-        grps_added = theirs - mine
-        grps_removed = mine - theirs
-
-        s = ''
-
-        for grp in grps_added:
-            s += "Added " + repr(other.find(grp)) + "\n"
-        for grp in grps_removed:
-            s += "Deleted " + repr(self.find(grp)) + "\n"
-
-        for grpname in mine & theirs:
-            mygrp = self.find(grpname)
-            theirgrp = other.find(grpname)
-
-            diffattrs = mygrp.diff(theirgrp)
-            for attr, myval, theirval in ((x, getattr(mygrp, x), getattr(theirgrp, x))
-                                          for x in diffattrs):
-                s += "Group '%s' - %s changed from %s to %s\n" % \
-                    (grpname, attr, myval, theirval)
-
-        return s
-
-    def __str__(self):
-
-        msg = "GROUP_NAMES = %s\n" % ', \\\n'.join(x.full_name for x in self)
-        for g in reversed(list(self)):
-            msg += '\n'
-            msg += 'GROUP_QUOTA_%s = %d\n' % (g.full_name, g.quota)
-            msg += 'GROUP_PRIO_FACTOR_%s = %.1f\n' % (g.full_name, g.prio)
-            msg += 'GROUP_ACCEPT_SURPLUS_%s = %s\n' % (g.full_name, g.surplus)
-        return msg
-
-    def write_file(self, fobj):
-        try:
-            fobj.write(self.file_template.format(self))
-        except EnvironmentError as e:
-            log.exception("Error writing temp: %s", e)
-            os.unlink(fobj.name)
-            sys.exit(1)
-
-
-get_file_groups = lambda x: gfile.build_quota_groups_file(x, UpdateQuotaGroup)
-get_db_groups = lambda: gdb.build_quota_groups_db(UpdateQuotaGroup)
+get_file_groups = lambda x: gfile.build_quota_groups_file(x, gfile.QuotaFileGroup)
+get_db_groups = lambda: gdb.build_quota_groups_db(gfile.QuotaFileGroup)
 
 
 def overwrite_file(groups, quota_file, backup_file=None):
-    # 1. Open temporary file --> Write Changed quota file to temp file
-    # 2. A bit pedantic, but re-scan temp file for consistency
-    # 3. Overwrite backup file with copy of current file
-    # 4. Replace current file with temp copy
-
-    # Needs to be on same fs to allow os.rename() to work, hence dir=*
-    tmpf = tempfile.NamedTemporaryFile(delete=False, prefix='gq_', suffix='_QU',
-                                       dir=os.path.dirname(quota_file))
-    tempname = tmpf.name
-    log.debug("Writing temporary file: %s", tempname)
-    groups.write_file(tmpf)
-    tmpf.close()
-
-    # This may be overkill...but can't hurt -- reread tmpfile and compare w/ db
-    new_groups = get_file_groups(tempname)
-    if not new_groups.full_cmp(groups):
-        log.error("Very strange, new file %s is corrupt", tempname)
+    try:
+        gfile.overwrite_file(groups, quota_file, backup_file)
+    except (gfile.CorruptQuotaFile, gfile.QuotaFileError) as e:
+        log.error("%s", e)
+        sys.exit(1)
+    except EnvironmentError as e:
+        log.error("Error writing quota file: %s", e)
         sys.exit(1)
 
-    # Overwrite the backup with a simple copy operation
-    if backup_file and os.path.exists(quota_file):
-        log.info("Backing up %s -> %s", quota_file, backup_file)
-        try:
-            shutil.copy2(quota_file, backup_file)
-        except EnvironmentError as e:
-            log.error('Error backing up file: %s', e)
-            os.unlink(tempname)
-            sys.exit(1)
 
-    # Replace (atomically) the actual file with the new version
-    os.rename(tempname, quota_file)
+# The DB's tree version the quota file was last in sync with is kept next to
+# it in a hidden .<file>.version, which condor skips when the quota file is
+# in a config directory (a plain <file>.version there would be read too)
+def read_synced(quota_file):
+    """ (tree version, file stat) last recorded as in sync for @quota_file """
+    try:
+        with open(gfile.sidecar(quota_file, 'version')) as fp:
+            synced = json.load(fp)
+        return synced['version'], tuple(synced['file'])
+    except (EnvironmentError, ValueError, KeyError, TypeError):
+        return None
+
 
-    log.info('Quota file updated with new values')
+def save_synced(quota_file, version):
+    if version is None:
+        return
+    try:
+        with open(gfile.sidecar(quota_file, 'version'), 'w') as fp:
+            json.dump({'version': version, 'file': gfile.file_stat(quota_file)}, fp)
+    except EnvironmentError as e:
+        log.warning("Can't record tree version: %s", e)
 
 
 def send_email(address, changes):
@@ -192,19 +131,32 @@ if __name__ == '__main__':
     options, quota_file = parse_options()
     log = setup_logging(options.log, backup=2, size_mb=20, level=options.level)
 
+    # Read before the groups, a change in between is seen next time
+    version = gdb.get_version()
+    if version is not None and \
+            read_synced(quota_file) == (version, gfile.file_stat(quota_file)):
+        log.debug('No Database Change (version %d)...', version)
+        sys.exit(0)
+
     db_groups = get_db_groups()
-    fp_groups = get_file_groups(quota_file)
+    try:
+        fp_groups = get_file_groups(quota_file)
+    except gfile.QuotaFileError as e:
+        log.error("Can't read current quota file: %s", e)
+        sys.exit(1)
 
     if db_groups.full_cmp(fp_groups):
         log.debug('No Database Change...')
+        save_synced(quota_file, version)
         sys.exit(0)
 
     # Write the DB groups to the file
     overwrite_file(db_groups, quota_file, options.backup)
+    save_synced(quota_file, version)
 
-    changes = fp_groups.get_diff_str(db_groups)
+    changes = gdiff.tree_diff(fp_groups, db_groups)
     log.info('Changes made are:')
-    for line in changes.split("\n"):
+    for line in gdiff.format_text(changes).split("\n"):
         if line:
             log.info(line)
 
@@ -218,6 +170,6 @@ if __name__ == '__main__':
         log.debug('No reconfig done...')
 
     if options.email:
-        sys.exit(send_email(options.email, changes))
+        sys.exit(send_email(options.email, gdiff.format_email(changes)))
     else:
         log.info('Not sending mail...')
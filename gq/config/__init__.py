@@ -25,15 +25,52 @@ db = {
     'user':     _cfg.get('mysql-db', 'user'),
     'passwd':   _cfg.get('mysql-db', 'password'),
 }
+db_pool_size = _cfg.getint('mysql-db', 'pool_size')
+db_pool_recycle = _cfg.getint('mysql-db', 'pool_recycle')
+db_pool_ping = _cfg.getint('mysql-db', 'pool_ping')
 
 change_lookback = _cfg.getint('params', 'change_lookback')
 
 demand_lookback = _cfg.getint('params', 'demand_lookback')
 pct_dec_spike = _cfg.getfloat('params', 'pct_dec_spike')
+rollup_bucket = _cfg.getint('params', 'rollup_bucket')
+
+keep_days = _cfg.getint('retention', 'keep_days')
+retention_method = _cfg.get('retention', 'method')
+chunk_rows = _cfg.getint('retention', 'chunk_rows')
+chunk_pause = _cfg.getfloat('retention', 'chunk_pause')
+downsample = _cfg.getboolean('retention', 'downsample')
+hourly_keep_days = _cfg.getint('retention', 'hourly_keep_days')
+
+collector_timeout = _cfg.getint('collectors', 'timeout')
+collector_cache = _cfg.get('collectors', 'cache_file')
+collector_max_age = _cfg.getint('collectors', 'max_age')
+
+ring_dir = _cfg.get('ringbuffer', 'directory')
+ring_capacity = _cfg.getint('ringbuffer', 'capacity')
+
+estimator_state = _cfg.get('estimators', 'state_file')
+estimator_default = _cfg.get('estimators', 'default')
+estimator_groups = [tuple(x.strip() for x in pair.rsplit(':', 1))
+                    for pair in _cfg.get('estimators', 'groups').split(',') if pair.strip()]
+ewma_halflife = _cfg.getfloat('estimators', 'ewma_halflife')
+quantile_pct = _cfg.getfloat('estimators', 'quantile_pct')
+holt_alpha = _cfg.getfloat('estimators', 'holt_alpha')
+holt_beta = _cfg.getfloat('estimators', 'holt_beta')
+
+collect_interval = _cfg.getint('daemon', 'collect_interval')
+balance_interval = _cfg.getint('daemon', 'balance_interval')
+config_interval = _cfg.getint('daemon', 'config_interval')
+prune_interval = _cfg.getint('daemon', 'prune_interval')
+reload_runs = _cfg.getint('daemon', 'reload_runs')
+gqd_status_file = _cfg.get('daemon', 'status_file')
 
 analyze_logfile = _cfg.get('logging', 'analyze_logfile')
 panda_logfile = _cfg.get('logging', 'panda_logfile')
+retention_logfile = _cfg.get('logging', 'retention_logfile')
+gqd_logfile = _cfg.get('logging', 'gqd_logfile')
 
 condor_cm = _cfg.get('htcondor', 'cm_addr')
+quota_cache = _cfg.getboolean('htcondor', 'quota_cache')
 
 log_level = getattr(logging, _cfg.get('logging', 'level').upper())
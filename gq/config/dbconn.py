@@ -1,30 +1,158 @@
-from . import db
+from . import db, db_pool_size, db_pool_recycle, db_pool_ping
 import MySQLdb
-import sys
+import time
+import threading
+from contextlib import contextmanager
 
 import logging
 
 log = logging.getLogger()
 
+# Connections are kept in a process-wide pool, so a long-running process
+# (or one run calling several of the gq functions) pays for the connect and
+# authentication once. Checked-out connections are handed out wrapped: their
+# close() gives them back, rolling back whatever wasn't committed. Errors are
+# raised as MySQLdb.Error for the caller to handle instead of exiting.
+
+
+class PooledConnection(object):
+    """ A MySQLdb connection checked out of @pool, behaving like the plain
+        connection except that close() returns it to the pool
+    """
+
+    def __init__(self, pool, con, created):
+        self._pool = pool
+        self._con = con
+        self.created = created
+        self.used = time.time()
+        self.valid = True
+
+    def cursor(self, *args, **kwargs):
+        return self._con.cursor(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._con, name)
+
+    def invalidate(self):
+        """ Don't reuse this connection, e.g. after it failed """
+        self.valid = False
+
+    def close(self):
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            pool.release(self)
+
+
+class Pool(object):
+    """ Up to @size idle connections with the parameters @params. Those
+        older than @recycle seconds are replaced, those idle for longer than
+        @ping seconds are pinged before being handed out. More than @size
+        can be checked out at once, the extra ones are closed on return.
+    """
+
+    def __init__(self, params, size=4, recycle=3600, ping=30):
+        self.params = params
+        self.size = size
+        self.recycle = recycle
+        self.ping = ping
+        self._idle = list()
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        try:
+            return MySQLdb.connect(**self.params)
+        except MySQLdb.Error as E:
+            log.error("Error connecting to database: %s", E)
+            raise
+
+    @staticmethod
+    def _discard(con):
+        try:
+            con.close()
+        except MySQLdb.Error:
+            pass
+
+    def _healthy(self, entry):
+        con, created, used = entry
+        now = time.time()
+        if self.recycle and now - created > self.recycle:
+            log.debug("Recycling database connection after %ds", now - created)
+            return False
+        if now - used > self.ping:
+            try:
+                con.ping()
+            except MySQLdb.Error as E:
+                log.warning("Dropping dead database connection: %s", E)
+                return False
+        return True
+
+    def checkout(self):
+        while True:
+            with self._lock:
+                entry = self._idle.pop() if self._idle else None
+            if entry is None:
+                return PooledConnection(self, self._connect(), time.time())
+            if self._healthy(entry):
+                return PooledConnection(self, entry[0], entry[1])
+            self._discard(entry[0])
+
+    def release(self, pcon):
+        con = pcon._con
+        if pcon.valid:
+            try:
+                con.rollback()
+            except MySQLdb.Error:
+                pcon.invalidate()
+        with self._lock:
+            if pcon.valid and len(self._idle) < self.size:
+                self._idle.append((con, pcon.created, time.time()))
+                return
+        self._discard(con)
+
+    def dispose(self):
+        """ Close all idle connections """
+        with self._lock:
+            idle, self._idle = self._idle, list()
+        for con, _, _ in idle:
+            self._discard(con)
+
+
+_pool = Pool(db, db_pool_size, db_pool_recycle, db_pool_ping)
+
 
 def get(curclass=None):
+    """ (connection, cursor) from the pool; closing the connection returns it """
+    con = _pool.checkout()
     try:
-        con = MySQLdb.connect(**db)
         cur = con.cursor(cursorclass=curclass)
-    except MySQLdb.Error as E:
-        log.error("Error connecting to database: %s" % E)
-        sys.exit(1)
-
+    except MySQLdb.Error:
+        con.invalidate()
+        con.close()
+        raise
     return con, cur
 
 
-def run(query):
-    con, cur = get()
+@contextmanager
+def transaction(curclass=None):
+    """ Cursor of a pooled connection whose work is committed if the block
+        finishes, else rolled back, the connection returned either way
+    """
+    con, cur = get(curclass)
     try:
-        cur.execute(query)
+        yield cur
         con.commit()
+    except MySQLdb.Error:
+        con.invalidate()
+        raise
+    finally:
         cur.close()
         con.close()
-    except MySQLdb.Error as E:
-        log.error("Error connecting to database: %s" % E)
-        sys.exit(1)
+
+
+def run(query):
+    with transaction() as cur:
+        cur.execute(query)
+
+
+def dispose():
+    _pool.dispose()
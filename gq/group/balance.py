@@ -1,10 +1,12 @@
 # *****************************************************************************
 
 import logging
+from itertools import groupby
+from operator import attrgetter
 
 log = logging.getLogger()
 
-__all__ = ['calculate_surplus']
+__all__ = ['calculate_surplus', 'IncrementalBalancer']
 
 
 def turn_surplus_flag(groups, val):
@@ -13,6 +15,61 @@ def turn_surplus_flag(groups, val):
         g.accept = val
 
 
+def balance_siblings(candidates):
+    """ Set the accept flag among one set of sibling groups: the highest
+        weighted groups with demand get it, all groups with the same weight
+        are treated alike, and a weight level without demand only gets it if
+        no (non-zero) lower weight has demand either.
+    """
+
+    # Weights in descending order, the levels are sorted and bucketed once
+    weight_of = attrgetter('weight')
+    by_weight = sorted(candidates, key=weight_of, reverse=True)
+    levels = [(w, list(g)) for w, g in groupby(by_weight, key=weight_of)]
+    demand = [any(x.has_demand() for x in groups) for _, groups in levels]
+
+    # lower_demand[i]: does any level with 0 < weight < levels[i] have demand
+    lower_demand = [False] * len(levels)
+    seen = False
+    for i in range(len(levels) - 1, -1, -1):
+        lower_demand[i] = seen
+        if levels[i][0] > 0:
+            seen = seen or demand[i]
+
+    debug = log.isEnabledFor(logging.DEBUG)
+    already_set = False
+    for (weight, groups), my_demand, l_demand in zip(levels, demand, lower_demand):
+        if debug:
+            lower = (x for x in by_weight if 0 < x.weight < weight)
+            log.debug("%s -- lower groups=%s, demand=%s, l_demand=%s",
+                      ", ".join(x.full_name for x in groups),
+                      ", ".join(x.full_name for x in lower),
+                      my_demand, l_demand)
+
+        if (not my_demand and l_demand) or already_set:
+            turn_surplus_flag(groups, False)
+        else:
+            turn_surplus_flag(groups, True)
+            already_set = True
+
+
+def limit_intermediate(siblings):
+    """ Turn off intermediate groups' flags in a sibling set that has no
+        weighted slack, just to prevent toggling too much
+    """
+
+    if all(x.is_leaf for x in siblings):
+        return
+    if any(x.has_slack() for x in siblings if x.weight > 0):
+        return
+
+    for group in siblings:
+        if group.accept:
+            log.info("%s (intermediate and no weighted slack) toggle t->f",
+                     group.full_name)
+            group.accept = False
+
+
 def calculate_surplus(root):
     """ This is the core balancing algorithm for figuring out which group
         get the accept_surplus flag
@@ -20,41 +77,75 @@ def calculate_surplus(root):
 
     log.debug("*********************  Get Candidates  **********************")
 
-    for group in (x for x in root.all() if not x.is_leaf):
+    # Demand & slack of every group, computed once bottom-up for this run
+    nodes = root.aggregate_demand()
 
-        # Candidates are the children of the intermediate groups in DFS order
-        candidates = sorted(group.get_children(), key=lambda x: -x.weight)
+    # Candidates are the children of the intermediate groups in DFS order
+    parents = [x for x in nodes if not x.is_leaf]
 
+    for group in parents:
         log.info("Sibling group -- children of %s", group.full_name)
+        balance_siblings(list(group.get_children()))
 
-        already_set = False
-
-        # Weights in descending order
-        for weight in sorted(set(g.weight for g in candidates), reverse=True):
-            # All groups with same weight get same treatment
-            groups = [x for x in candidates if x.weight == weight]
-            my_demand = any([x.has_demand() for x in groups])
-
-            lower_groups = [x for x in candidates if 0 < x.weight < weight]
+    # Go through again and turn off non-leaf intermediate nodes that don't
+    # have slack from their neighbors, just to prevent toggling too much
+    for group in parents:
+        limit_intermediate(list(group.get_children()))
 
-            lower_demand = any([x for x in lower_groups if x.has_demand()])
-            log.debug("%s -- lower groups=%s, demand=%s, l_demand=%s",
-                      ", ".join(x.full_name for x in groups),
-                      ", ".join(x.full_name for x in lower_groups),
-                      my_demand, lower_demand)
 
-            if (not my_demand and lower_demand) or already_set:
-                turn_surplus_flag(groups, False)
-            else:
-                turn_surplus_flag(groups, True)
-                already_set = True
+class IncrementalBalancer(object):
+    """ Balancer for a DemandGroup tree kept in memory between runs. The
+        first rebalance() is a full calculate_surplus(), after that only the
+        sibling sets with a group whose demand/slack changed since the last
+        run (the ancestors of leaves whose demand crossed their threshold)
+        are balanced again. Start a new one after changing the tree's shape.
+    """
 
-    # Go through again and turn off non-leaf intermediate nodes that don't
-    # have slack from their neighbors, just to prevent toggling too much
-    for group in root.all():
-        all_leaf = all([x.is_leaf for x in group.siblings()])
-        slack = any([x.has_slack() for x in group.siblings() if x.weight > 0])
-        if group.accept and not slack and not all_leaf:
-            log.info("%s (intermediate and no weighted slack) toggle t->f",
-                     group.full_name)
-            group.accept = False
+    def __init__(self, root):
+        self.root = root
+        self.leaves = list(root.leaf_nodes())
+
+        # (has_demand, has_slack) of every group as of the last rebalance()
+        self._flags = None
+
+    def dirty_parents(self, leaves=None):
+        """ Groups whose children must be balanced again, by name, looking
+            at @leaves only if given
+        """
+        flags = self._flags
+        dirty = set()
+        for leaf in self.leaves if leaves is None else leaves:
+            node = leaf
+            # Stop as soon as a group's flags didn't change, the parents
+            # above can only be touched through another leaf
+            while node.parent is not None:
+                new = node._get_flags()
+                if flags.get(node) == new:
+                    break
+                flags[node] = new
+                dirty.add(node.parent)
+                node = node.parent
+        return sorted(dirty, key=lambda x: x.full_name)
+
+    def rebalance(self, leaves=None):
+        """ Bring the accept flags up to date with the current demand and
+            return the groups whose flag changed. @leaves, if given, must
+            hold every leaf whose demand crossed its threshold since the
+            last run, the others aren't looked at.
+        """
+
+        if self._flags is None:
+            before = dict((x, x.accept) for x in self.root)
+            calculate_surplus(self.root)
+            self._flags = dict((x, x._get_flags()) for x in self.root)
+            return [x for x in self.root if x.accept != before[x]]
+
+        changed = list()
+        for group in self.dirty_parents(leaves):
+            siblings = list(group.get_children())
+            before = [x.accept for x in siblings]
+            log.info("Sibling group -- children of %s", group.full_name)
+            balance_siblings(siblings)
+            limit_intermediate(siblings)
+            changed.extend(x for x, old in zip(siblings, before) if x.accept != old)
+        return changed
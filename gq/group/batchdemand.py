@@ -0,0 +1,94 @@
+# *****************************************************************************
+# Demand of many groups at once: get_average() and spike_detected() from
+# idlejobs evaluated with NumPy over a ragged batch of sample arrays
+# *****************************************************************************
+#
+# The samples of all groups are concatenated in one array, group g owning
+# values[offsets[g]:offsets[g + 1]]. With integer samples the midpoint sums
+# are exact half-integers both ways, so every average, percent change and
+# decision comes out bit-for-bit the same as the per-group loop.
+
+import numpy as np
+
+from .. import config as c
+
+__all__ = ['ragged', 'DemandBatch', 'batch_demand']
+
+
+def ragged(series):
+    """ (offsets, values) arrays for the list of sample lists @series, None
+        counting as an empty one
+    """
+    lengths = np.array([len(x) if x is not None else 0 for x in series], dtype=np.intp)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.intp)
+    np.cumsum(lengths, out=offsets[1:])
+    values = np.concatenate([np.zeros(0, dtype=np.int64)] +
+                            [np.asarray(x, dtype=np.int64) for x in series if x is not None])
+    return offsets, values
+
+
+def _round(x):
+    """ Python 2's round() to an integer: halves away from zero """
+    a = np.abs(x)
+    whole = np.floor(a)
+    return np.copysign(whole + (a - whole >= 0.5), x)
+
+
+class DemandBatch(object):
+    """ The demand calculation for each group of a ragged batch, as arrays
+        indexed by group. Groups with fewer than @fewest samples are not
+        enough and get no demand, their averages are NaN. Given @ends, group
+        g owns values[offsets[g]:ends[g]] instead, so the slices may overlap
+        (e.g. one group's sliding windows).
+    """
+
+    def __init__(self, offsets, values, fewest, pct_dec_spike=None, ends=None):
+        if pct_dec_spike is None:
+            pct_dec_spike = c.pct_dec_spike
+        assert fewest >= 4, "Both halves need at least two samples"
+
+        offsets = np.asarray(offsets, dtype=np.intp)
+        values = np.asarray(values, dtype=np.int64)
+
+        prefix = np.zeros(len(values) + 1, dtype=np.int64)
+        np.cumsum(values, out=prefix[1:])
+
+        if ends is None:
+            start, end = offsets[:-1], offsets[1:]
+        else:
+            start, end = offsets, np.asarray(ends, dtype=np.intp)
+        count = len(start)
+        self.enough = (end - start) >= fewest
+        s, e = start[self.enough], end[self.enough]
+        mid = s + (e - s) // 2
+
+        def average(a, b):
+            # Midpoint rule: the sum minus half of each end sample
+            halves = 2 * (prefix[b] - prefix[a]) - values[a] - values[b - 1]
+            return (halves / 2.0) / (b - a - 1).astype(float)
+
+        self.average = np.full(count, np.nan)
+        self.first = np.full(count, np.nan)
+        self.second = np.full(count, np.nan)
+        self.average[self.enough] = average(s, e)
+        self.first[self.enough] = average(s, mid)
+        self.second[self.enough] = average(mid, e)
+
+        m, n = self.first, self.second
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.change = np.where(m >= 5, 100 * (n - m) / m, np.nan)
+            exhausted = (m > 0) & (n == 0)
+            dropped = (m >= 5) & (self.change < -pct_dec_spike)
+        self.spike = self.enough & (exhausted | dropped)
+
+        rounded = np.zeros(count, dtype=np.int64)
+        rounded[self.enough] = _round(self.average[self.enough])
+        self.spike &= rounded > 0
+        self.demand = np.where(self.spike, 0, rounded)
+
+
+def batch_demand(offsets, values, fewest, pct_dec_spike=None):
+    """ Demand of every group in the ragged batch, as populate_demand()
+        would set it
+    """
+    return DemandBatch(offsets, values, fewest, pct_dec_spike).demand
@@ -0,0 +1,152 @@
+# *****************************************************************************
+# Run the idle-job collector modules concurrently, each with a deadline
+# *****************************************************************************
+#
+# Every module's get_jobs() runs in its own daemon thread. A module that
+# raises, returns None or misses its deadline (the module's "timeout"
+# attribute in seconds, else the configured one) is replaced by the last
+# result it returned successfully, as long as that is recent enough, so one
+# slow or broken source doesn't hold up or throw away the others. Python
+# can't stop a hung thread, being a daemon it just doesn't keep the process
+# alive once the others are done. In a long-running process a module whose
+# thread from an earlier call is still running isn't started again, its last
+# good result is used instead, so a hung module holds on to one thread only.
+
+import os
+import imp
+import glob
+import json
+import time
+import logging
+import threading
+
+from .. import config as c
+
+log = logging.getLogger()
+
+__all__ = ['collect', 'load_modules', 'LastKnownGood']
+
+# Module name -> the thread last started for it
+_threads = dict()
+
+
+def load_modules(arg):
+    """ The collector modules in the file or directory @arg, None if it
+        doesn't exist
+    """
+    mods = None
+    name = lambda x: os.path.basename(x).split('.')[0]
+
+    if not os.path.exists(arg):
+        log.error("Module path '%s' does not exist", arg)
+        return None
+    elif os.path.isdir(arg):
+        pyfiles = glob.glob(os.path.join(arg, '*.py'))
+        pyfiles = filter(lambda x: '__init__.py' not in x, pyfiles)
+        mods = [imp.load_source(name(x), x) for x in pyfiles]
+    elif os.path.isfile(arg):
+        mods = [imp.load_source(name(arg), arg)]
+
+    return mods
+
+
+class LastKnownGood(object):
+    """ The last successful get_jobs() result of each module, with the time
+        it was taken, kept in a JSON file between runs
+    """
+
+    def __init__(self, fname=None, max_age=None):
+        self.fname = fname or c.collector_cache
+        self.max_age = 60 * (max_age or c.collector_max_age)
+        try:
+            with open(self.fname) as fp:
+                self.entries = json.load(fp)
+        except (EnvironmentError, ValueError):
+            self.entries = dict()
+
+    def get(self, name, now=None):
+        """ The cached jobs of module @name if not too old, else None """
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+        age = (now or time.time()) - entry['time']
+        if age > self.max_age:
+            log.warning("Last result of %s is %d minutes old, too old to use",
+                        name, age / 60)
+            return None
+        log.warning("Using last result of %s from %d minutes ago", name, age / 60)
+        return entry['jobs']
+
+    def update(self, name, jobs, now=None):
+        self.entries[name] = {'time': now or time.time(), 'jobs': jobs}
+
+    def save(self):
+        tmp = self.fname + '.tmp'
+        try:
+            with open(tmp, 'w') as fp:
+                json.dump(self.entries, fp)
+            os.rename(tmp, self.fname)
+        except EnvironmentError as E:
+            log.error("Can't save collector cache %s: %s", self.fname, E)
+
+
+def _run(mod, results, took):
+    start = time.time()
+    try:
+        results[mod.__name__] = mod.get_jobs()
+    except Exception:
+        log.exception("Module %s failed", mod.__name__)
+    took[mod.__name__] = time.time() - start
+
+
+def collect(modules, cache=None):
+    """ Call get_jobs() of all @modules at once and return a dict of their
+        merged group_name -> #idle, falling back on @cache (a LastKnownGood)
+        for those that fail or time out. Returns None if none had data.
+    """
+
+    cache = cache if cache is not None else LastKnownGood()
+    results, took = dict(), dict()
+    start = time.time()
+
+    running = list()
+    chosen = dict()
+    for mod in modules:
+        name = mod.__name__
+        if name in _threads and _threads[name].is_alive():
+            log.error("Module %s still running since an earlier call, not started", name)
+            chosen[name] = cache.get(name)
+            continue
+        t = threading.Thread(target=_run, args=(mod, results, took),
+                             name="collector-%s" % name)
+        t.daemon = True
+        t.start()
+        _threads[name] = t
+        running.append((start + getattr(mod, 'timeout', c.collector_timeout), mod, t))
+
+    for deadline, mod, t in sorted(running, key=lambda x: x[0]):
+        name = mod.__name__
+        t.join(max(0, deadline - time.time()))
+
+        nums = results.get(name)
+        if t.is_alive():
+            log.error("Module %s timed out after %.1fs", name, time.time() - start)
+            nums = cache.get(name)
+        elif nums is None:
+            log.error("Module %s returned no data", name)
+            nums = cache.get(name)
+        else:
+            log.debug("Module %s took %.2fs", name, took[name])
+            cache.update(name, nums)
+        chosen[name] = nums
+
+    cache.save()
+
+    # Merged in the order given, like calling them one after another
+    found = [chosen[x.__name__] for x in modules if chosen[x.__name__] is not None]
+    if not found:
+        return None
+    data = dict()
+    for nums in found:
+        data.update(nums)
+    return data
@@ -0,0 +1,302 @@
+# *****************************************************************************
+# Compact group-tree: one typed array per field instead of an object per group
+# *****************************************************************************
+#
+# Groups are stored in pre-order (every parent before all of its descendants,
+# siblings sorted by name), so a subtree is the contiguous slice
+# [i, end[i]) and a reversed scan visits children before their parents.
+
+from array import array
+from collections import deque
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+__all__ = ['CompactTree', 'CompactNode']
+
+
+class CompactTree(object):
+    """ Struct-of-arrays version of a group tree, for very large hierarchies.
+        Column values are per-group, indexed by position in pre-order, with
+        the root at position 0.
+    """
+
+    # Column name, array typecode, default
+    columns = (
+        ('quota', 'l', 0),
+        ('prio', 'd', 10.0),
+        ('weight', 'd', 1.0),
+        ('threshold', 'l', 0),
+        ('demand', 'l', 0),
+        ('accept', 'b', 0),
+    )
+
+    def __init__(self, rows, root='<root>'):
+        """ Build from @rows, an iterable of (full_name, {column: value})
+            pairs, each group's parent must be present too
+        """
+
+        by_path = sorted(((name.split('.'), vals) for name, vals in rows),
+                         key=lambda x: x[0])
+
+        self.names = [root]
+        self.parent = array('l', [-1])
+        self.end = array('l', [0])
+        self.depth = array('B', [0])
+        for col, code, default in self.columns:
+            setattr(self, col, array(code, [default]))
+
+        stack = [0]     # Positions of the ancestors of the next group
+        above = []      # and their names, below the root
+        for path, vals in by_path:
+            del stack[len(path):]
+            del above[len(path) - 1:]
+            if len(stack) != len(path) or above != path[:-1]:
+                raise KeyError("%s without parent found" % ".".join(path))
+            pos = len(self.names)
+            self.names.append(path[-1])
+            self.parent.append(stack[-1])
+            self.end.append(0)
+            self.depth.append(len(path))
+            for col, code, default in self.columns:
+                getattr(self, col).append(vals.get(col, default))
+            stack.append(pos)
+            above.append(path[-1])
+
+        # Subtree end positions, children before parents in a reversed scan
+        n = len(self.names)
+        for i in range(n - 1, -1, -1):
+            if not self.end[i]:
+                self.end[i] = i + 1
+            p = self.parent[i]
+            if p >= 0 and self.end[i] > self.end[p]:
+                self.end[p] = self.end[i]
+
+        self._index = None
+        self._levels = None
+
+    @classmethod
+    def from_tree(cls, root):
+        """ Build from an AbstractGroup tree, taking whichever of the column
+            attributes each group has (QuotaGroup's surplus string counts
+            as accept)
+        """
+        def row(grp):
+            vals = dict((col, getattr(grp, col)) for col, _, _ in cls.columns
+                        if hasattr(grp, col))
+            if hasattr(grp, 'surplus') and 'accept' not in vals:
+                vals['accept'] = grp.surplus == 'TRUE'
+            return grp.full_name, vals
+
+        tree = cls((row(x) for x in root), root.name)
+        for col, val in row(root)[1].items():
+            getattr(tree, col)[0] = val
+        return tree
+
+    def __len__(self):
+        return len(self.names)
+
+    def full_name(self, i):
+        """ Dotted name of the group at position @i, except for <root> """
+        if i == 0:
+            return self.names[0]
+        parts = list()
+        while i > 0:
+            parts.append(self.names[i])
+            i = self.parent[i]
+        return '.'.join(reversed(parts))
+
+    def position(self, name):
+        """ Position of the group with full name @name, or None """
+        if self._index is None:
+            self._index = dict((self.full_name(i), i) for i in range(len(self)))
+        return self._index.get(name)
+
+    def children_of(self, i):
+        """ Positions of the direct children of @i, in name order """
+        c, stop = i + 1, self.end[i]
+        while c < stop:
+            yield c
+            c = self.end[c]
+
+    def is_leaf(self, i):
+        return self.end[i] == i + 1
+
+    # ---- Position iterators, same orders as the AbstractGroup ones ---------
+
+    def post_order(self, i=0):
+        """ Positions below @i (children before parent), @i last """
+        # Pre-order positions, each held back until its subtree has ended
+        end = self.end
+        open_ = [i]
+        for x in xrange(i + 1, end[i]):
+            while end[open_[-1]] <= x:
+                yield open_.pop()
+            open_.append(x)
+        while open_:
+            yield open_.pop()
+
+    def level_order(self, i=0):
+        q = deque([i])
+        while q:
+            pos = q.popleft()
+            yield pos
+            q.extend(self.children_of(pos))
+
+    # ---- The AbstractGroup traversal API, yielding node views --------------
+
+    def node(self, i):
+        return CompactNode(self, i)
+
+    def find(self, name):
+        i = self.position(name)
+        return None if i is None else CompactNode(self, i)
+
+    def walk(self, i=0):
+        return (CompactNode(self, x) for x in self.post_order(i) if x != i)
+
+    def all(self, i=0):
+        return (CompactNode(self, x) for x in self.post_order(i))
+
+    def breadth_first(self, i=0):
+        return (CompactNode(self, x) for x in self.level_order(i))
+
+    def leaf_nodes(self, i=0):
+        return (CompactNode(self, x) for x in range(i, self.end[i]) if self.is_leaf(x))
+
+    def __iter__(self):
+        return self.walk()
+
+    # ---- Whole-tree operations ---------------------------------------------
+
+    def values(self, col):
+        """ Column @col as a zero-copy NumPy view if available, else the array """
+        data = getattr(self, col)
+        if np is None:
+            return data
+        return np.frombuffer(data, dtype=np.dtype(data.typecode))
+
+    def levels(self):
+        """ Positions grouped by depth, as a list indexed by depth """
+        if self._levels is None:
+            by_depth = [list() for _ in range(max(self.depth) + 1)]
+            for i, d in enumerate(self.depth):
+                by_depth[d].append(i)
+            if np is not None:
+                by_depth = [np.array(x, dtype=np.intp) for x in by_depth]
+            self._levels = by_depth
+        return self._levels
+
+    def sum_children(self, col):
+        """ Set every non-leaf group's @col to the sum over its children,
+            bottom-up, so intermediate groups hold the total of their leaves
+        """
+        data = getattr(self, col)
+        n = len(self)
+
+        if np is None:
+            for i in range(n):
+                if not self.is_leaf(i):
+                    data[i] = 0
+            for i in range(n - 1, 0, -1):
+                data[self.parent[i]] += data[i]
+            return data
+
+        vals = self.values(col)
+        ends = np.frombuffer(self.end, dtype=np.dtype(self.end.typecode))
+        parents = np.frombuffer(self.parent, dtype=np.dtype(self.parent.typecode))
+        vals[ends != np.arange(1, n + 1)] = 0
+        for level in reversed(self.levels()[1:]):
+            np.add.at(vals, parents[level], vals[level])
+        return vals
+
+
+class CompactNode(object):
+    """ Light-weight view of one group in a CompactTree, with enough of the
+        AbstractGroup interface to be used in its place for reading. Nodes
+        are made on the fly by every traversal; code that visits the whole
+        tree should iterate positions and index the arrays (or values())
+        instead, at about a third of the cost.
+    """
+    __slots__ = ('tree', 'pos')
+
+    def __init__(self, tree, pos):
+        self.tree = tree
+        self.pos = pos
+
+    def __getattr__(self, attr):
+        try:
+            return getattr(self.tree, attr)[self.pos]
+        except (AttributeError, TypeError):
+            raise AttributeError(attr)
+
+    @property
+    def name(self):
+        return self.tree.names[self.pos]
+
+    @property
+    def full_name(self):
+        return self.tree.full_name(self.pos)
+
+    @property
+    def parent(self):
+        p = self.tree.parent[self.pos]
+        return None if p < 0 else CompactNode(self.tree, p)
+
+    @property
+    def is_leaf(self):
+        return self.tree.is_leaf(self.pos)
+
+    @property
+    def children(self):
+        return dict((self.tree.names[x], CompactNode(self.tree, x))
+                    for x in self.tree.children_of(self.pos))
+
+    def get_children(self):
+        return (CompactNode(self.tree, x) for x in self.tree.children_of(self.pos))
+
+    def walk(self):
+        return self.tree.walk(self.pos)
+
+    def all(self):
+        return self.tree.all(self.pos)
+
+    def breadth_first(self):
+        return self.tree.breadth_first(self.pos)
+
+    def leaf_nodes(self):
+        return self.tree.leaf_nodes(self.pos)
+
+    def __iter__(self):
+        return self.walk()
+
+    def __eq__(self, other):
+        return isinstance(other, CompactNode) and \
+            self.tree is other.tree and self.pos == other.pos
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((id(self.tree), self.pos))
+
+    def __repr__(self):
+        return '<compact %d> %s' % (self.pos, self.full_name)
+
+    def __str__(self):
+        return self.full_name
+
+
+def _column(col):
+    """ A read-only property for the column @col of a node's tree """
+    def getter(self):
+        return getattr(self.tree, col)[self.pos]
+    return property(getter)
+
+# The columns as plain properties: __getattr__ only runs after a failed
+# lookup, which costs an exception on every access
+for _col, _, _ in CompactTree.columns:
+    setattr(CompactNode, _col, _column(_col))
+del _col, _
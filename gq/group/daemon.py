@@ -0,0 +1,234 @@
+# *****************************************************************************
+# The collect -> balance -> write-config pipeline of the gqd daemon
+# *****************************************************************************
+#
+# Instead of three cron jobs each starting Python, connecting to the DB and
+# rebuilding the group tree, one long-running process runs the same three
+# steps (and optionally the retention of the idle-job history) as stages of
+# a pipeline, each on its own interval. The demand tree,
+# its IncrementalBalancer and the last quota file read stay in memory
+# between cycles, the DB connections in dbconn's pool. Every stage's run
+# times are logged and kept in a JSON status file.
+
+import os
+import json
+import time
+import logging
+import subprocess
+
+import db as gdb
+import diff as gdiff
+import file as gfile
+import balance
+import idlejobs
+
+log = logging.getLogger()
+
+__all__ = ['Stage', 'Pipeline', 'BalanceState', 'QuotaWriter']
+
+
+class Stage(object):
+    """ The step @func of the pipeline called @name, run every @interval
+        seconds, timing each run. A run failed if @func raises or returns
+        False.
+    """
+
+    def __init__(self, name, func, interval):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.next_run = 0
+        self.runs = self.failures = 0
+        self.last = self.total = self.worst = 0.0
+
+    def due(self, now):
+        return now >= self.next_run
+
+    def run(self, now=None):
+        now = now or time.time()
+        start = time.time()
+        try:
+            ok = self.func() is not False
+        except Exception:
+            log.exception("Stage %s failed", self.name)
+            ok = False
+        took = time.time() - start
+
+        self.runs += 1
+        self.failures += not ok
+        self.last = took
+        self.total += took
+        self.worst = max(self.worst, took)
+        self.next_run = now + self.interval
+        log.info("Stage %s %s in %.3fs", self.name, "done" if ok else "FAILED", took)
+        return ok
+
+    def timings(self):
+        return {'runs': self.runs, 'failures': self.failures, 'last': self.last,
+                'mean': self.total / self.runs if self.runs else 0.0,
+                'max': self.worst, 'next_run': self.next_run}
+
+
+class Pipeline(object):
+    """ The @stages run in order whenever due, the per-stage timings saved
+        to @status_file (if given) after each cycle
+    """
+
+    def __init__(self, stages, status_file=None):
+        self.stages = stages
+        self.status_file = status_file
+        self.cycles = 0
+        self.running = False
+
+    def cycle(self, now=None):
+        """ Run the stages that are due, returns their names """
+        now = now or time.time()
+        ran = [x for x in self.stages if x.due(now)]
+        start = time.time()
+        for stage in ran:
+            stage.run(now)
+        if ran:
+            self.cycles += 1
+            log.debug("Cycle %d took %.3fs", self.cycles, time.time() - start)
+            self.save_status()
+        return [x.name for x in ran]
+
+    def timings(self):
+        return dict((x.name, x.timings()) for x in self.stages)
+
+    def save_status(self):
+        if not self.status_file:
+            return
+        status = {'time': time.time(), 'cycles': self.cycles, 'stages': self.timings()}
+        tmp = self.status_file + '.tmp'
+        try:
+            with open(tmp, 'w') as fp:
+                json.dump(status, fp, indent=2, sort_keys=True)
+            os.rename(tmp, self.status_file)
+        except EnvironmentError as E:
+            log.error("Can't write status file %s: %s", self.status_file, E)
+
+    def run_forever(self):
+        """ Cycle until stop() is called, sleeping until the next stage is due """
+        self.running = True
+        while self.running:
+            self.cycle()
+            wait = min(x.next_run for x in self.stages) - time.time()
+            # Short naps so a stop() from a signal handler is seen soon
+            while self.running and wait > 0:
+                time.sleep(min(wait, 1.0))
+                wait -= 1.0
+
+    def stop(self):
+        self.running = False
+
+
+class BalanceState(object):
+    """ The demand tree and its IncrementalBalancer, kept between runs and
+        rebuilt from the DB when the tree version moved other than by our
+        own flag changes, every @reload_every runs (unless 0), after a
+        failure, or when reload() is called. Flag changes held back by
+        change_lookback are retried on the next runs.
+    """
+
+    def __init__(self, reload_every=12):
+        self.reload_every = reload_every
+        self.groups = self.balancer = None
+        self.pending = list()
+        self.runs = 0
+        # Tree version expected if nobody else changed the groups table
+        self.version = None
+
+    def reload(self):
+        self.balancer = None
+
+    def run(self):
+        try:
+            # Weights, thresholds, groups or flags changed by someone else
+            version = gdb.get_version()
+            if version is not None and version != self.version and \
+                    self.balancer is not None:
+                log.info("Tree version moved from %s to %d", self.version, version)
+                self.balancer = None
+
+            if self.balancer is None or \
+                    (self.reload_every and self.runs % self.reload_every == 0):
+                log.info("Reloading group tree from DB")
+                self.groups = gdb.build_demand_groups_db()
+                self.balancer = balance.IncrementalBalancer(self.groups)
+                self.pending = list()
+
+            idlejobs.populate_demand(self.groups)
+            changed = self.balancer.rebalance()
+            log.info("%d groups changed", len(changed))
+            for group in changed:
+                log.info(group.color_str())
+            todo = changed + [x for x in self.pending if x not in changed]
+            written, self.pending = gdb.update_surplus_flags(self.groups, todo)
+            log.info("%d flags written, %d held back", len(written), len(self.pending))
+            # Writing flags bumped the version once, more means other changes
+            self.version = version + 1 if version is not None and written else version
+        except Exception:
+            self.balancer = None
+            raise
+        finally:
+            self.runs += 1
+
+
+class QuotaWriter(object):
+    """ Keeps @quota_file in line with the quota groups in the DB, like
+        update_quotas.py, backing it up to @backup_file and running
+        @reconfig (a command) after each change. Nothing more than the tree
+        version is read while neither it nor the file changed, and the
+        file's tree is only read again when the file changes.
+    """
+
+    def __init__(self, quota_file, backup_file=None, reconfig=None):
+        self.quota_file = quota_file
+        self.backup_file = backup_file
+        self.reconfig = reconfig
+        self._stat = None
+        self._tree = None
+        # (tree version, file stat) when the two were last known to agree
+        self._synced = None
+
+    def _file_tree(self):
+        stat = gfile.file_stat(self.quota_file)
+        if self._tree is None or stat != self._stat:
+            self._tree = gfile.build_quota_groups_file(self.quota_file,
+                                                       gfile.QuotaFileGroup)
+            self._stat = stat
+        return self._tree
+
+    def run(self):
+        # Read before the groups, a change in between is seen next time
+        version = gdb.get_version()
+        if version is not None and \
+                self._synced == (version, gfile.file_stat(self.quota_file)):
+            log.debug('No Database Change (version %d)...', version)
+            return True
+
+        db_groups = gdb.build_quota_groups_db(gfile.QuotaFileGroup)
+        fp_groups = self._file_tree()
+        if db_groups.full_cmp(fp_groups):
+            log.debug('No Database Change...')
+            self._synced = (version, self._stat)
+            return True
+
+        gfile.overwrite_file(db_groups, self.quota_file, self.backup_file)
+        # What was just written and checked is the file's tree now
+        self._tree, self._stat = db_groups, gfile.file_stat(self.quota_file)
+        self._synced = (version, self._stat)
+
+        changes = gdiff.tree_diff(fp_groups, db_groups)
+        log.info('Changes made are:')
+        for line in gdiff.format_text(changes).split("\n"):
+            if line:
+                log.info(line)
+
+        if self.reconfig:
+            if subprocess.call(self.reconfig, shell=True) != 0:
+                log.error('Problem with %s, returned nonzero', self.reconfig)
+                return False
+            log.info('Reconfig successful...')
+        return True
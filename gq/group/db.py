@@ -1,8 +1,6 @@
 # Module to build group-tree from database
 
-import sys
 import logging
-import datetime
 import MySQLdb
 import MySQLdb.cursors
 
@@ -23,17 +21,9 @@ def _get_groups(fields):
 
     query = 'SELECT %s FROM groups ORDER BY group_name' % ", ".join(fields)
 
-    try:
-        con, cur = db.get(curclass=MySQLdb.cursors.DictCursor)
+    with db.transaction(curclass=MySQLdb.cursors.DictCursor) as cur:
         cur.execute(query)
-        data = cur.fetchall()
-        cur.close()
-        con.close()
-    except MySQLdb.Error as E:
-        log.error("Error connecting to database: %s" % E)
-        sys.exit(1)
-
-    return data
+        return cur.fetchall()
 
 
 def build_demand_groups_db(grpCLS=DemandGroup):
@@ -74,40 +64,89 @@ def _build_groups_db(grp_CLS, fields, group_builder=_get_groups, root='<root>'):
     return root_group
 
 
-def update_surplus_flags(root):
-    """ Compare the tree passed in @root to the database's accept_surplus flags
-        and make changes to the DB if it differs, constrained by the
-        last_surplus_update timestamp
+# Counter in the tree_version table, bumped in the same transaction as every
+# change to the groups table so readers can tell with one row whether their
+# copy of the tree is still current
+VERSION_BUMP = ("INSERT INTO tree_version (id, version) VALUES (1, 1) "
+                "ON DUPLICATE KEY UPDATE version=version + 1")
+
+
+def bump_version(cur):
+    """ Mark the groups table changed, in the transaction of cursor @cur.
+        Without a tree_version table this only warns: MySQL fails just the
+        statement, not the transaction, and get_version() returns None so
+        readers rebuild every time anyway.
+    """
+    try:
+        cur.execute(VERSION_BUMP)
+    except MySQLdb.ProgrammingError as E:
+        log.warning("Can't bump tree version: %s", E)
+
+
+def get_version():
+    """ Current version of the groups table, None if unknown (no tree_version
+        table or row yet), in which case readers must assume it changed
+    """
+    try:
+        with db.transaction() as cur:
+            cur.execute("SELECT version FROM tree_version WHERE id=1")
+            row = cur.fetchone()
+    except MySQLdb.ProgrammingError as E:
+        log.warning("Can't read tree version: %s", E)
+        return None
+    return row[0] if row else None
+
+
+def _placeholders(items):
+    return ", ".join(["%s"] * len(items))
+
+
+def update_surplus_flags(root, groups=None):
+    """ Write the accept-surplus flags of the tree passed in @root to the
+        database where they differ, constrained by the last_surplus_update
+        timestamp, checked against the DB's clock. Only the groups in @groups
+        are looked at if given. All changes are applied in one transaction,
+        only the differing rows are read. Returns two lists of groups: those
+        changed, and those that differ but were changed too recently.
     """
 
-    con, cur = db.get()
-    cur.execute("SELECT group_name, accept_surplus, last_surplus_update FROM groups")
-    db_surplus = dict((x, (bool(y), z)) for x, y, z in cur.fetchall())
-    year = (60 * 60) * 24 * 365
-    now = datetime.datetime.now()
-
-    # Since python <= 2.6 doesn't have a .total_seconds() method on timedeltas...
-    # See: https://docs.python.org/2/library/datetime.html#datetime.timedelta.total_seconds
-    seconds = lambda td: ((td.seconds + td.days * 24 * 3600) * 10**6) / 10**6
-
-    for group in root:
-        db_accept, ts = db_surplus[group.full_name]
-        if group.accept == db_accept:
-            continue
-
-        # last change ago in seconds or a year ago if not defined
-        last_change = seconds(now - ts) if ts else year
-
-        if last_change > c.change_lookback * 60:
-            log.info("Changing %s from %s->%s", group.full_name,
-                     not group.accept, group.accept)
-            cur.execute("UPDATE groups SET last_surplus_update=now(), "
-                        "accept_surplus=%s WHERE group_name=%s",
-                        (group.accept, group.full_name))
-        else:
-            log.info("Would change %s from %s->%s, but was changed %d minutes ago",
-                     group.full_name, not group.accept, group.accept, last_change / 60)
-
-    con.commit()
-    cur.close()
-    con.close()
+    groups = list(root if groups is None else groups)
+    by_name = dict((x.full_name, x) for x in groups)
+    on = [x.full_name for x in groups if x.accept]
+    off = [x.full_name for x in groups if not x.accept]
+    if not groups:
+        return [], []
+
+    differs = list()
+    if on:
+        differs.append("(group_name IN (%s) AND NOT accept_surplus)" % _placeholders(on))
+    if off:
+        differs.append("(group_name IN (%s) AND accept_surplus)" % _placeholders(off))
+
+    changed, deferred = list(), list()
+    with db.transaction() as cur:
+        # Rows to change get locked until the commit
+        cur.execute("SELECT group_name, last_surplus_update IS NULL OR "
+                    "last_surplus_update < NOW() - INTERVAL %s MINUTE, "
+                    "TIMESTAMPDIFF(MINUTE, last_surplus_update, NOW()) "
+                    "FROM groups WHERE " + " OR ".join(differs) + " FOR UPDATE",
+                    [c.change_lookback] + on + off)
+
+        for name, eligible, minutes in cur.fetchall():
+            group = by_name[name]
+            if eligible:
+                log.info("Changing %s from %s->%s", name, not group.accept, group.accept)
+                changed.append(group)
+            else:
+                log.info("Would change %s from %s->%s, but was changed %d minutes ago",
+                         name, not group.accept, group.accept, minutes)
+                deferred.append(group)
+
+        # Each locked row differs from the tree, so flipping it is the change
+        if changed:
+            cur.execute("UPDATE groups SET accept_surplus=NOT accept_surplus, "
+                        "last_surplus_update=NOW() WHERE group_name IN (%s)" %
+                        _placeholders(changed), [x.full_name for x in changed])
+            bump_version(cur)
+
+    return changed, deferred
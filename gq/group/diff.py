@@ -0,0 +1,156 @@
+# *****************************************************************************
+# Structured differences between two group-trees
+# *****************************************************************************
+#
+# Both trees are walked at once, children merged in name order, so a diff is
+# linear in the size of the trees. When groups carry a digest (QuotaGroup,
+# Snapshot) a subtree whose digest is already computed on both sides and
+# equal is skipped outright; digests are never computed just for the walk, as
+# hashing two whole trees costs more than comparing them. A cold diff (fresh
+# trees, as update_quotas builds them) thus compares every group once, and a
+# warm one (e.g. after full_cmp()) only descends where something changed.
+#
+# Renames: a removed subtree (a group with children) whose digest equals that
+# of an added sibling is reported as one rename instead of a removal plus
+# additions. Only identical subtrees pair up - a group renamed along with any
+# change below it is still a removal and additions - and only those removed
+# and added subtrees are hashed. Names are tracked during the walk, so any
+# nodes with .name, .children and the compared attributes will do, including
+# parent-less Snapshot trees whose shared subtrees are skipped too.
+
+import json
+from collections import namedtuple
+
+__all__ = ['Change', 'tree_diff', 'format_text', 'format_json', 'format_email']
+
+DIFF_ATTRS = ('quota', 'prio', 'surplus')
+
+# kind is one of 'added', 'removed', 'changed' or 'renamed'. For 'added' and
+# 'removed' @old/@new hold the group object (the other is None), for
+# 'renamed' the old and new full names, and for 'changed' the two values
+# of @attr
+Change = namedtuple('Change', ('kind', 'name', 'attr', 'old', 'new'))
+
+
+def _join(prefix, name):
+    return name if prefix is None else prefix + '.' + name
+
+
+def _pre_order(name, grp):
+    """ (full-name, group) for @grp and its subtree, parents first and
+        children in name order
+    """
+    stack = [(name, grp)]
+    while stack:
+        name, node = stack.pop()
+        yield name, node
+        stack.extend((_join(name, x), node.children[x])
+                     for x in sorted(node.children, reverse=True))
+
+
+def tree_diff(old, new, attrs=DIFF_ATTRS):
+    """ Return a list of Change records that turn the tree @old into @new,
+        comparing the attributes named in @attrs of groups in both
+    """
+
+    # On the types: hasattr() on the instances would compute the digests
+    digests = hasattr(type(old), 'digest') and hasattr(type(new), 'digest')
+    changes = list()
+
+    # The roots' own values aren't compared, their full name is None
+    stack = [(None, old, new)]
+    while stack:
+        name, mine, theirs = stack.pop()
+        if mine is theirs or (digests and mine._digest is not None
+                              and mine._digest == theirs._digest):
+            continue
+
+        if name is not None:
+            for attr in attrs:
+                a, b = getattr(mine, attr), getattr(theirs, attr)
+                if a != b:
+                    changes.append(Change('changed', name, attr, a, b))
+
+        names = sorted(set(mine.children) | set(theirs.children))
+        removed = [x for x in names if x not in theirs.children]
+        added = [x for x in names if x not in mine.children]
+
+        # Only subtrees with children are paired: the digest leaves out a
+        # group's own name, so a removed leaf and a new one with the same
+        # values are an unrelated removal and addition, not a rename
+        if digests and removed and added:
+            by_digest = dict((theirs.children[x].digest, x) for x in added
+                             if theirs.children[x].children)
+            for x in list(removed):
+                if not by_digest:
+                    break
+                if not mine.children[x].children:
+                    continue
+                match = by_digest.pop(mine.children[x].digest, None)
+                if match is not None:
+                    changes.append(Change('renamed', _join(name, x), 'name',
+                                          _join(name, x), _join(name, match)))
+                    removed.remove(x)
+                    added.remove(match)
+
+        for x in removed:
+            changes.extend(Change('removed', n, None, grp, None)
+                           for n, grp in _pre_order(_join(name, x), mine.children[x]))
+        for x in added:
+            changes.extend(Change('added', n, None, None, grp)
+                           for n, grp in _pre_order(_join(name, x), theirs.children[x]))
+
+        common = [x for x in names if x in mine.children and x in theirs.children]
+        stack.extend((_join(name, x), mine.children[x], theirs.children[x])
+                     for x in reversed(common))
+
+    return changes
+
+
+def _describe(name, grp):
+    """ repr() of a group, prefixed with its full name if it can't tell """
+    return repr(grp) if hasattr(grp, 'full_name') else "'%s' %r" % (name, grp)
+
+
+def format_text(changes):
+    """ One line per change, as logged and mailed by update_quotas """
+    lines = list()
+    for c in changes:
+        if c.kind == 'added':
+            lines.append("Added %s" % _describe(c.name, c.new))
+        elif c.kind == 'removed':
+            lines.append("Deleted %s" % _describe(c.name, c.old))
+        elif c.kind == 'renamed':
+            lines.append("Renamed '%s' to '%s' (with its subtree)" % (c.old, c.new))
+        else:
+            lines.append("Group '%s' - %s changed from %s to %s" %
+                         (c.name, c.attr, c.old, c.new))
+    return "\n".join(lines)
+
+
+def _as_dict(change, attrs):
+    d = {'kind': change.kind, 'group': change.name}
+    if change.kind in ('changed', 'renamed'):
+        d.update(attr=change.attr, old=change.old, new=change.new)
+    else:
+        grp = change.new if change.kind == 'added' else change.old
+        d['values'] = dict((x, getattr(grp, x)) for x in attrs)
+    return d
+
+
+def format_json(changes, attrs=DIFF_ATTRS, **kwargs):
+    """ The changes as a JSON list of objects, @kwargs go to json.dumps() """
+    return json.dumps([_as_dict(x, attrs) for x in changes], **kwargs)
+
+
+def format_email(changes):
+    """ Plain-text body summarizing the changes, grouped by kind """
+    titles = (('added', 'Groups added'), ('removed', 'Groups removed'),
+              ('renamed', 'Groups renamed'), ('changed', 'Values changed'))
+    sections = list()
+    for kind, title in titles:
+        these = [x for x in changes if x.kind == kind]
+        if these:
+            body = "\n".join("  " + x for x in format_text(these).split("\n"))
+            sections.append("%s (%d):\n%s" % (title, len(these), body))
+    return "\n\n".join(sections)
@@ -0,0 +1,318 @@
+# *****************************************************************************
+# Incrementally updated demand estimators, chosen per group
+# *****************************************************************************
+#
+# An estimator sees each idle-job sample once through update() and answers
+# demand() from its running state, which is saved between runs, so no run
+# has to read the whole lookback window again. The kinds are:
+#
+#   midpoint  populate_demand()'s midpoint average with the two-halves spike
+#             test, over the lookback window, with identical results
+#   ewma      exponentially weighted moving average with a half-life
+#   quantile  a percentile of the samples in the lookback window
+#   holt      Holt's linear trend, forecast to the time of the run
+#
+# The kind for a group is the first matching pattern in the config's
+# [estimators] groups list, else the default one.
+
+import os
+import json
+import logging
+from bisect import insort, bisect_left
+from collections import deque
+from fnmatch import fnmatch
+
+from .. import config as c
+
+from idlejobs import spike_from_averages
+
+log = logging.getLogger()
+
+__all__ = ['Estimator', 'Midpoint', 'EWMA', 'Quantile', 'Holt', 'EstimatorSet']
+
+
+class Estimator(object):
+    """ Base class: @lookback seconds of relevance and the @fewest samples
+        needed before the estimate counts as demand
+    """
+    kind = None
+    fields = ()
+
+    def __init__(self, lookback, fewest):
+        self.lookback = lookback
+        self.fewest = fewest
+        self.last = None
+
+    def update(self, when, value):
+        """ Take in the sample @value taken at @when (epoch seconds) """
+        raise NotImplementedError
+
+    def demand(self, now):
+        """ (demand, status) at time @now, status being None, 'spike' or
+            'insufficient' as in populate_demand()
+        """
+        raise NotImplementedError
+
+    def state(self):
+        return dict((x, getattr(self, x)) for x in ('last',) + self.fields)
+
+    def restore(self, state):
+        for k, v in state.items():
+            setattr(self, k, v)
+        return self
+
+
+class Midpoint(Estimator):
+    """ The window split into two deques, the first holding len // 2 samples
+        like spike_detected()'s halves, each with a running sum
+    """
+    kind = 'midpoint'
+
+    def __init__(self, lookback, fewest, pct_dec_spike=None):
+        super(Midpoint, self).__init__(lookback, fewest)
+        self.pct_dec_spike = pct_dec_spike
+        self.first, self.second = deque(), deque()
+        self.sums = [0, 0]
+
+    def update(self, when, value):
+        self.second.append((when, value))
+        self.sums[1] += value
+        self.last = when
+        self._balance()
+
+    def _balance(self):
+        target = (len(self.first) + len(self.second)) / 2
+        while len(self.first) < target:
+            sample = self.second.popleft()
+            self.first.append(sample)
+            self.sums[0] += sample[1]
+            self.sums[1] -= sample[1]
+        while len(self.first) > target:
+            sample = self.first.pop()
+            self.second.appendleft(sample)
+            self.sums[0] -= sample[1]
+            self.sums[1] += sample[1]
+
+    def _expire(self, since):
+        while True:
+            part = 0 if self.first else 1
+            samples = (self.first, self.second)[part]
+            if not samples or samples[0][0] >= since:
+                break
+            self.sums[part] -= samples.popleft()[1]
+        self._balance()
+
+    @staticmethod
+    def _average(total, count, first, last):
+        # get_average() from the sum and the two end samples
+        return (total - (first + last) / 2.0) / float(count - 1)
+
+    def demand(self, now):
+        self._expire(now - self.lookback)
+        first, second = self.first, self.second
+        count = len(first) + len(second)
+        if count < self.fewest:
+            return 0, 'insufficient'
+
+        whole = self._average(sum(self.sums), count, first[0][1], second[-1][1])
+        average = int(round(whole))
+        m = self._average(self.sums[0], len(first), first[0][1], first[-1][1])
+        n = self._average(self.sums[1], len(second), second[0][1], second[-1][1])
+        if average > 0 and spike_from_averages(m, n, self.pct_dec_spike):
+            return 0, 'spike'
+        return average, None
+
+    def state(self):
+        return {'last': self.last, 'first': list(self.first),
+                'second': list(self.second), 'sums': self.sums}
+
+    def restore(self, state):
+        self.last = state['last']
+        self.first = deque(tuple(x) for x in state['first'])
+        self.second = deque(tuple(x) for x in state['second'])
+        self.sums = state['sums']
+        return self
+
+
+class EWMA(Estimator):
+    """ Exponentially weighted average whose weights halve every @halflife
+        seconds, however irregular the samples are
+    """
+    kind = 'ewma'
+    fields = ('value', 'count')
+
+    def __init__(self, lookback, fewest, halflife):
+        super(EWMA, self).__init__(lookback, fewest)
+        self.halflife = halflife
+        self.value = None
+        self.count = 0
+
+    def update(self, when, value):
+        if self.value is None:
+            self.value = float(value)
+        else:
+            alpha = 1 - 0.5 ** (max(when - self.last, 0) / float(self.halflife))
+            self.value += alpha * (value - self.value)
+        self.last = when
+        self.count += 1
+
+    def demand(self, now):
+        # Warming up, or no samples within the lookback any more
+        if self.count < self.fewest or now - self.last > self.lookback:
+            return 0, 'insufficient'
+        return int(round(self.value)), None
+
+
+class Quantile(Estimator):
+    """ The @pct percentile (nearest rank) of the samples in the window, the
+        window also kept sorted. Inserts shift the sorted list, which stays
+        as short as the window.
+    """
+    kind = 'quantile'
+
+    def __init__(self, lookback, fewest, pct):
+        super(Quantile, self).__init__(lookback, fewest)
+        self.pct = pct
+        self.window = deque()
+        self._sorted = list()
+
+    def update(self, when, value):
+        self.window.append((when, value))
+        insort(self._sorted, value)
+        self.last = when
+
+    def demand(self, now):
+        since = now - self.lookback
+        while self.window and self.window[0][0] < since:
+            value = self.window.popleft()[1]
+            del self._sorted[bisect_left(self._sorted, value)]
+
+        count = len(self._sorted)
+        if count < self.fewest:
+            return 0, 'insufficient'
+        return self._sorted[int(round(self.pct / 100.0 * (count - 1)))], None
+
+    def state(self):
+        return {'last': self.last, 'window': list(self.window)}
+
+    def restore(self, state):
+        self.last = state['last']
+        self.window = deque(tuple(x) for x in state['window'])
+        self._sorted = sorted(x[1] for x in self.window)
+        return self
+
+
+class Holt(Estimator):
+    """ Holt's double exponential smoothing of level and trend (per second)
+        with smoothing factors @alpha and @beta, forecast to the run's time
+    """
+    kind = 'holt'
+    fields = ('level', 'trend', 'count')
+
+    def __init__(self, lookback, fewest, alpha, beta):
+        super(Holt, self).__init__(lookback, fewest)
+        self.alpha, self.beta = alpha, beta
+        self.level = self.trend = None
+        self.count = 0
+
+    def update(self, when, value):
+        if self.level is None:
+            self.level, self.trend = float(value), 0.0
+        elif when > self.last:
+            dt = when - self.last
+            level = self.alpha * value + (1 - self.alpha) * (self.level + self.trend * dt)
+            self.trend = self.beta * (level - self.level) / dt + (1 - self.beta) * self.trend
+            self.level = level
+        self.last = when
+        self.count += 1
+
+    def demand(self, now):
+        if self.count < self.fewest or now - self.last > self.lookback:
+            return 0, 'insufficient'
+        forecast = self.level + self.trend * (now - self.last)
+        return max(0, int(round(forecast))), None
+
+
+KINDS = dict((x.kind, x) for x in (Midpoint, EWMA, Quantile, Holt))
+
+
+def make(kind, fewest):
+    """ New estimator of @kind with its parameters from the config """
+    lookback = 60 * c.demand_lookback
+    if kind == 'midpoint':
+        return Midpoint(lookback, fewest, c.pct_dec_spike)
+    elif kind == 'ewma':
+        return EWMA(lookback, fewest, 60 * c.ewma_halflife)
+    elif kind == 'quantile':
+        return Quantile(lookback, fewest, c.quantile_pct)
+    elif kind == 'holt':
+        return Holt(lookback, fewest, c.holt_alpha, c.holt_beta)
+    raise ValueError("Unknown estimator '%s'" % kind)
+
+
+def kind_for(name):
+    """ Configured estimator kind of the group @name """
+    for pattern, kind in c.estimator_groups:
+        if fnmatch(name, pattern):
+            return kind
+    return c.estimator_default
+
+
+class EstimatorSet(object):
+    """ The estimators of all groups, with their state kept in the JSON file
+        @fname between runs
+    """
+
+    def __init__(self, fname, fewest):
+        self.fname = fname
+        self.fewest = fewest
+        self.estimators = dict()
+        try:
+            with open(fname) as fp:
+                saved = json.load(fp)
+        except (EnvironmentError, ValueError):
+            saved = dict()
+
+        for name, entry in saved.items():
+            if entry['kind'] == kind_for(name):
+                est = make(entry['kind'], fewest).restore(entry['state'])
+                self.estimators[name] = est
+
+    def get(self, name):
+        if name not in self.estimators:
+            self.estimators[name] = make(kind_for(name), self.fewest)
+        return self.estimators[name]
+
+    def since(self, names, oldest):
+        """ Time after which samples are needed to bring all of @names up to
+            date, but no earlier than @oldest
+        """
+        last = [self.get(x).last for x in names]
+        if not last or None in last:
+            return oldest
+        return max(min(last), oldest)
+
+    def feed(self, rows):
+        """ Update with (group_name, time, amount) @rows in time order per
+            group, skipping samples an estimator has seen already
+        """
+        for name, when, value in rows:
+            est = self.get(name)
+            if est.last is None or when > est.last:
+                est.update(when, value)
+
+    def demand(self, names, now):
+        """ name -> (demand, status) at time @now for each of @names """
+        return dict((x, self.get(x).demand(now)) for x in names)
+
+    def save(self, names=None):
+        """ Write the state of the estimators of @names (all if not given) to
+            the file, dropping any others
+        """
+        keep = self.estimators if names is None else set(names)
+        saved = dict((name, {'kind': est.kind, 'state': est.state()})
+                     for name, est in self.estimators.items() if name in keep)
+        tmp = self.fname + '.tmp'
+        with open(tmp, 'w') as fp:
+            json.dump(saved, fp)
+        os.rename(tmp, self.fname)
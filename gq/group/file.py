@@ -1,110 +1,413 @@
 import logging
-import sys
+import tempfile
+import hashlib
+import gc
+import marshal
+import shutil
+import struct
+import time
+import os
 import re
+from cStringIO import StringIO
+
+from .. import config as c
 
 import group
 
 log = logging.getLogger()
 
+# Bytes read from the quota file at a time
+CHUNK_SIZE = 1 << 20
+
+# Header of the parsed-tree cache: magic, format version, and the inode,
+# mtime, size and SHA-1 of the quota file it was made from. The groups
+# follow, marshalled as sorted (full_name, quota, prio, surplus) rows.
+CACHE_HEADER = struct.Struct('<4sHQdQ20s')
+CACHE_MAGIC = 'GQTC'
+CACHE_FORMAT = 1
+
 
 class NoQuotaFile(Exception):
     pass
 
 
-def build_quota_groups_file(fname, grpCLS=group.QuotaGroup):
+class CorruptQuotaFile(Exception):
+    pass
+
+
+class QuotaFileError(ValueError):
+    """ Malformed quota file @fname, the problem found at line @lineno """
+
+    def __init__(self, fname, lineno, msg):
+        where = "%s:%d" % (fname, lineno) if lineno else fname
+        super(QuotaFileError, self).__init__("%s: %s" % (where, msg))
+        self.fname = fname
+        self.lineno = lineno
+
+
+class QuotaFileGroup(group.QuotaGroup):
+    """ Quota group that prints as an HTCondor config file of its tree """
+
+    file_template = """\
+# /-----------------------------------------------------\\
+# | This file is automatically generated -- DO NOT EDIT |
+# | Last updated:     %s          |
+# \\-----------------------------------------------------/
+{0}
+"""
 
+    def __str__(self):
+
+        msg = "GROUP_NAMES = %s\n" % ', \\\n'.join(x.full_name for x in self)
+        for g in reversed(list(self)):
+            msg += '\n'
+            msg += 'GROUP_QUOTA_%s = %d\n' % (g.full_name, g.quota)
+            msg += 'GROUP_PRIO_FACTOR_%s = %.1f\n' % (g.full_name, g.prio)
+            msg += 'GROUP_ACCEPT_SURPLUS_%s = %s\n' % (g.full_name, g.surplus)
+        return msg
+
+    def render(self):
+        """ The config file's contents """
+        return (self.file_template % time.ctime()).format(self)
+
+    def write_file(self, fobj):
+        fobj.write(self.render())
+
+
+def sidecar(fname, kind):
+    """ Hidden file next to @fname for our own bookkeeping of @kind, named
+        so that condor skips it when reading a config directory
+    """
+    head, tail = os.path.split(fname)
+    return os.path.join(head, '.%s.%s' % (tail, kind))
+
+
+def overwrite_file(groups, quota_file, backup_file=None):
+    """ Safely replace @quota_file with the tree @groups (a QuotaFileGroup),
+        copying the current one to @backup_file first if given. Raises
+        CorruptQuotaFile or EnvironmentError, leaving the old file in place.
+    """
+    # 1. Render the file in memory, parse that text and check the groups
+    #    read have the digest of @groups --> Write it to temp file
+    # 2. Check all of it made it to disk, by size after an fsync
+    # 3. Overwrite backup file with copy of current file
+    # 4. Replace current file with temp copy, record the groups parsed in
+    #    the cache under the digest of the text written
+
+    text = groups.render()
+    digest = hashlib.sha1(text).digest()
+
+    try:
+        rows = _rows(quota_file, *_parse_quotas(StringIO(text), quota_file))
+    except QuotaFileError as E:
+        raise CorruptQuotaFile("New quota file doesn't parse: %s" % E)
+    written = _build_tree(group.QuotaGroup('<root>'), rows)
+    if written.digest != groups.digest:
+        differ = sorted(groups.changed_subtrees(written))
+        raise CorruptQuotaFile("New quota file doesn't hold the groups given, %d differ "
+                               "(e.g. %s)" % (len(differ), ", ".join(differ[:3])))
+
+    # Needs to be on same fs to allow os.rename() to work, hence dir=*
+    tmpf = tempfile.NamedTemporaryFile(delete=False, prefix='gq_', suffix='_QU',
+                                       dir=os.path.dirname(quota_file))
+    tempname = tmpf.name
+    log.debug("Writing temporary file: %s", tempname)
+    try:
+        try:
+            tmpf.write(text)
+            tmpf.flush()
+            os.fsync(tmpf.fileno())
+            st = os.fstat(tmpf.fileno())
+        finally:
+            tmpf.close()
+
+        if st.st_size != len(text):
+            raise CorruptQuotaFile("Very strange, new file %s has %d of %d bytes" %
+                                   (tempname, st.st_size, len(text)))
+
+        # Overwrite the backup with a simple copy operation
+        if backup_file and os.path.exists(quota_file):
+            log.info("Backing up %s -> %s", quota_file, backup_file)
+            shutil.copy2(quota_file, backup_file)
+    except:
+        os.unlink(tempname)
+        raise
+
+    # Replace (atomically) the actual file with the new version
+    os.rename(tempname, quota_file)
+
+    # The rename keeps inode and mtime, so this is the new file's key
+    if c.quota_cache:
+        _save_cache(quota_file, (st.st_ino, st.st_mtime, st.st_size, digest), rows)
+
+    log.info('Quota file updated with new values')
+
+
+def file_stat(fname):
+    """ (inode, mtime, size) of @fname, enough to tell it was rewritten, or
+        None if it doesn't exist
+    """
+    try:
+        st = os.stat(fname)
+    except EnvironmentError:
+        return None
+    return st.st_ino, st.st_mtime, st.st_size
+
+
+def build_quota_groups_file(fname, grpCLS=group.QuotaGroup, cache=None):
+    """ Group tree of the condor quota config @fname, empty if it doesn't
+        exist. Raises QuotaFileError if it's malformed. With @cache (the
+        config's quota_cache by default) the parsed groups are kept in a
+        sidecar file and taken from there while @fname is unchanged.
+    """
+
+    cache = c.quota_cache if cache is None else cache
     root = grpCLS('<root>')
 
+    rows = _load_cache(fname) if cache else None
+    if rows is None:
+        try:
+            rows, key = _read_rows(fname)
+        except NoQuotaFile:
+            log.info("Quota file %s not found, return blank group-tree", fname)
+            return root
+        if cache:
+            _save_cache(fname, key, rows)
+
+    return _build_tree(root, rows)
+
+
+def _build_tree(root, rows):
+    """ Add the groups of @rows, sorted (full_name, quota, prio, surplus), to
+        @root and return it
+    """
+
+    # Sorted by name, so parents come before their children. The groups
+    # are all kept, so the garbage collector's passes over them are wasted
+    by_name = {'': root}
+    enabled = gc.isenabled()
+    gc.disable()
     try:
-        group_names, grps = _read_quotas(fname)
-    except NoQuotaFile:
-        log.info("Quota file %s not found, return blank group-tree", fname)
-        return root
+        for grp, quota, prio, surplus in rows:
+            parent_name, _, my_name = grp.rpartition('.')
+            new = group.QuotaGroup(my_name, quota, prio, surplus)
+            by_name[parent_name].add_child(new)
+            by_name[grp] = new
+    finally:
+        if enabled:
+            gc.enable()
+
+    return root
 
-    for grp in sorted(group_names):
+
+def _read_rows(fname):
+    """ Sorted (full_name, quota, prio, surplus) rows of the groups in the
+        quota file @fname and its cache key, checked to form a tree
+    """
+
+    group_names, grps, names_line, key = _read_quotas(fname)
+    return _rows(fname, group_names, grps, names_line), key
+
+
+def _rows(fname, group_names, grps, names_line):
+    """ The rows of _read_rows() from what _parse_quotas() found in @fname """
+
+    names = set(group_names)
+    rows = list()
+    for grp in sorted(names):
 
         p = grps.get(grp, None)
         if p is None or not ("quota" in p and "prio" in p and "surplus" in p):
-            log.error("Invalid incomplete file-group found: %s", grp)
-            sys.exit(1)
+            raise QuotaFileError(fname, names_line,
+                                 "Invalid incomplete file-group found: %s" % grp)
 
-        parts = grp.split('.')
-        my_name = parts[-1]
+        parent = grp.rpartition('.')[0]
+        if parent and parent not in names:
+            raise QuotaFileError(fname, names_line,
+                                 "%s without parent found in file" % grp)
 
-        # Find appropriate parent from string of full group-name
-        parent = root
-        for x in parts[:-1]:
-            try:
-                parent = parent[x]
-            except KeyError:
-                log.error("%s without parent found in DB", grp)
-                sys.exit(1)
+        rows.append((grp, p["quota"], p["prio"], p["surplus"]))
 
-        new = group.QuotaGroup(my_name, p["quota"], p["prio"], p["surplus"])
-        parent.add_child(new)
+    return rows
 
-    return root
 
+def _file_digest(fname):
+    h = hashlib.sha1()
+    with open(fname, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(CHUNK_SIZE), ''):
+            h.update(chunk)
+    return h.digest()
 
-def read_lines_continue(fobj):
-    """ Continue lines that end in backslash """
 
-    in_line = False
-    tmp = ''
-    for line in (x.strip() for x in fobj if x):
-        if re.match('^\s*#', line):
-            continue
+def _load_cache(fname):
+    """ The rows of @fname from its cache, None if there's none for the file
+        as it is now. A file with another inode, mtime or size is still the
+        same if its content hashes the same (e.g. rewritten identically).
+    """
+    try:
+        with open(sidecar(fname, 'cache'), 'rb') as fp:
+            magic, fmt, ino, mtime, size, digest = \
+                CACHE_HEADER.unpack(fp.read(CACHE_HEADER.size))
+            if magic != CACHE_MAGIC or fmt != CACHE_FORMAT:
+                return None
 
-        if line.endswith('\\'):
-            tmp += line.rstrip('\\')
-            in_line = True
-            continue
-        elif in_line:
-            in_line = False
-            line = tmp + line.rstrip('\\')
-            tmp = ''
+            stat = file_stat(fname)
+            if stat is None or stat[2] != size:
+                return None
+            if stat != (ino, mtime, size) and _file_digest(fname) != digest:
+                return None
+
+            log.debug("Quota groups of %s taken from its cache", fname)
+            return marshal.load(fp)
+    except (EnvironmentError, struct.error, ValueError, EOFError, TypeError):
+        return None
+
+
+def _save_cache(fname, key, rows):
+    """ Keep @rows as the parsed content of @fname, whose (inode, mtime,
+        size, sha1) are @key
+    """
+    cname = sidecar(fname, 'cache')
+    tmp = cname + '.tmp'
+    try:
+        with open(tmp, 'wb') as fp:
+            fp.write(CACHE_HEADER.pack(CACHE_MAGIC, CACHE_FORMAT, *key))
+            marshal.dump(rows, fp)
+        os.rename(tmp, cname)
+    except EnvironmentError as E:
+        log.warning("Can't write quota file cache %s: %s", cname, E)
+
+
+def _logical_lines(fp, size=CHUNK_SIZE, digest=None):
+    """ Yield (line number, line) for the stripped lines of @fp, read @size
+        bytes at a time and fed to the hash object @digest if given. Lines
+        ending in a backslash are joined with the next (numbered as the
+        first), comments and blank lines dropped.
+    """
+
+    lineno = start = 0
+    parts = []
+    tail = ''
+    while True:
+        chunk = fp.read(size)
+        if digest is not None:
+            digest.update(chunk)
+        lines = (tail + chunk).split('\n')
+        tail = lines.pop() if chunk else ''
+
+        for line in lines:
+            lineno += 1
+            line = line.strip()
+            if line[:1] == '#':
+                continue
+
+            if line.endswith('\\'):
+                if not parts:
+                    start = lineno
+                parts.append(line.rstrip('\\'))
+                continue
+            elif parts:
+                parts.append(line)
+                line = ''.join(parts)
+                parts = []
+            else:
+                start = lineno
+
+            if line:
+                yield start, line
+
+        if not chunk:
+            break
+
+    if parts:
+        yield start, ''.join(parts)
 
-        yield line
+
+# Knobs read, by their first 9 characters; others (GROUP_SORT_EXPR, ...) are
+# skipped, so are per-group ones whose group isn't in GROUP_NAMES, like
+# GROUP_QUOTA_DYNAMIC_* or GROUP_QUOTA_ROUND_ROBIN_RATE
+_KNOBS = dict((x[:9], (x, kind)) for x, kind in (
+    ('GROUP_NAMES', 'names'),
+    ('GROUP_QUOTA_', 'quota'),
+    ('GROUP_PRIO_FACTOR_', 'prio'),
+    ('GROUP_ACCEPT_SURPLUS_', 'surplus'),
+))
+
+
+def _parse_value(kind, value):
+    """ The @value of a per-group knob of @kind, None if invalid """
+    if kind == 'quota':
+        return int(value) if value.isdigit() else None
+    elif kind == 'prio':
+        if value.replace('.', '', 1).isdigit():
+            return float(value)
+        return None
+    upper = value.upper()
+    if upper == 'TRUE':
+        return True
+    elif upper == 'FALSE':
+        return False
+    return None
 
 
 def _read_quotas(fname):
+    """ (group names, {group: {kind: value}}, line of GROUP_NAMES, cache key)
+        from the quota file @fname
+    """
     try:
-        fp = open(fname, "r")
+        fp = open(fname, "rb")
     except EnvironmentError, e:
         if e.errno == 2:
             raise NoQuotaFile
-        log.error("Error opening %s: %s", fname, e)
-        sys.exit(1)
+        raise
+
+    # Taken before reading, so a change while reading makes the key stale
+    st = os.fstat(fp.fileno())
+    digest = hashlib.sha1()
+    with fp:
+        group_names, grps, names_line = _parse_quotas(fp, fname, digest)
+
+    key = (st.st_ino, st.st_mtime, st.st_size, digest.digest())
+    return group_names, grps, names_line, key
 
-    regexes = {
-        "names":   re.compile('^GROUP_NAMES\s*=\s*(.*)$'),
-        "quota":   re.compile('^GROUP_QUOTA_([\w\.]+)\s*=\s*(\d+)$'),
-        "prio":    re.compile('^GROUP_PRIO_FACTOR_([\w\.]+)\s*=\s*([\d\.]+)$'),
-        "surplus": re.compile('^GROUP_ACCEPT_SURPLUS_([\w\.]+)\s*=\s*(\w+)$'),
-    }
 
+def _parse_quotas(fp, fname, digest=None):
+    """ (group names, {group: {kind: value}}, line of GROUP_NAMES) from the
+        quota file open as @fp (named @fname in errors), each line looked at
+        once by its prefix, its contents fed to the hash object @digest
+    """
     grps = {}
     group_names = []
-    for line in read_lines_continue(fp):
+    names_line = None
+    # Group -> (line, message) of values that don't parse, only an error if
+    # the group is one of ours
+    invalid = {}
+    for lineno, line in _logical_lines(fp, digest=digest):
+        knob = _KNOBS.get(line[:9])
+        if knob is None or not line.startswith(knob[0]):
+            continue
+        prefix, kind = knob
 
-        for kind, regex in regexes.items():
-            if not regex.match(line):
-                continue
-            if kind == "names":
-                group_names = regex.match(line).group(1).replace(' ', '').split(',')
-            else:
-                grp, val = regex.match(line).groups()
-                if not grps.get(grp):
-                    grps[grp] = {}
-                if kind == "surplus":
-                    if val.upper() == "TRUE":
-                        val = True
-                    elif val.upper() == "FALSE":
-                        val = False
-                    else:
-                        log.error("Invalid true/false value found: %s", val)
-                        sys.exit(1)
-                grps[grp][kind] = val
-    fp.close()
-
-    return group_names, grps
+        key, sep, value = line.partition('=')
+        if not sep:
+            raise QuotaFileError(fname, lineno, "No '=' in %s" % key)
+        value = value.strip()
+
+        if kind == 'names':
+            if key.rstrip() == prefix:
+                group_names = [x.strip() for x in value.split(',') if x.strip()]
+                names_line = lineno
+            continue
+
+        grp = key[len(prefix):].rstrip()
+        val = _parse_value(kind, value)
+        if val is None:
+            invalid[grp] = (lineno, "Invalid %s value for %s: %s" % (kind, grp, value))
+            continue
+        grps.setdefault(grp, {})[kind] = val
+
+    for grp in group_names:
+        if grp in invalid:
+            raise QuotaFileError(fname, *invalid[grp])
+
+    return group_names, grps, names_line
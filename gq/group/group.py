@@ -3,6 +3,7 @@
 # *****************************************************************************
 
 import logging
+import hashlib
 from collections import deque
 
 log = logging.getLogger()
@@ -21,26 +22,141 @@ class AbstractGroup(object):
         self.parent = None
         self.children = {}
 
+        # Only the root of a tree keeps the full_name -> node index
+        self._index = {name: self}
+
+        # Memoized by full_name / depth, reset for a subtree when it moves
+        self._full_name = None
+        self._depth = None
+
+    @property
+    def root(self):
+        """ The top-most node of the tree this node belongs to """
+        node = self
+        while node.parent is not None:
+            node = node.parent
+        return node
+
     def add_child(self, new_grp):
-        """ Add a child node to this one, setting it's parent pointer """
+        """ Add a child node to this one, setting it's parent pointer. If
+            @new_grp is already in a tree it is moved (with its subtree) here
+        """
+
+        if new_grp.parent is not None:
+            new_grp.parent.remove_child(new_grp.name)
+
+        old = self.children.get(new_grp.name)
+        if old is not None and old is not new_grp:
+            self.remove_child(old.name)
 
         new_grp.parent = self
         self.children[new_grp.name] = new_grp
 
+        nodes = list(new_grp.all())
+        _reset_cache(nodes)
+
+        index = self.root._index
+        for node in nodes:
+            node._index = None
+            index[node.full_name] = node
+
+        self._children_changed()
+
+    def remove_child(self, name):
+        """ Detach the child named @name (and its subtree), returning it as
+            the root of its own tree
+        """
+
+        child = self.children.pop(name)
+        index = self.root._index
+        nodes = list(child.all())
+        for node in nodes:
+            index.pop(node.full_name, None)
+
+        child.parent = None
+        _reset_cache(nodes)
+        child._index = dict((x.full_name, x) for x in nodes)
+
+        self._children_changed()
+        return child
+
+    def rename(self, new):
+        """ Change this group's (short) name, keeping the parent's children
+            and the root's index in sync for the whole subtree
+        """
+
+        if new == self.name:
+            return
+        parent = self.parent
+        if parent is not None and new in parent.children:
+            raise ValueError("Group %s already exists under %s" % (new, parent.full_name))
+
+        index = self.root._index
+        nodes = list(self.all())
+        for node in nodes:
+            index.pop(node.full_name, None)
+
+        if parent is not None:
+            del parent.children[self.name]
+            parent.children[new] = self
+        self.name = new
+        _reset_cache(nodes)
+
+        for node in nodes:
+            index[node.full_name] = node
+
+        if parent is not None:
+            parent._children_changed()
+
+    def _children_changed(self):
+        """ Called after a child of this group is added, removed or renamed,
+            for subclasses that cache values derived from the subtree
+        """
+        pass
+
     def walk(self):
-        """ Recursively iterate through all lower nodes in the tree DFS order """
-        for x in self.get_children():
-            for y in x.walk():
-                yield y
-            yield x
+        """ Iterate through all lower nodes in the tree DFS order, children
+            before their parent (post-order)
+        """
+        return self._post_order(False)
 
     def all(self):
         """ Like walk() but include self in list returned """
-        for x in self.get_children():
-            for y in x.walk():
-                yield y
-            yield x
-        yield self
+        return self._post_order(True)
+
+    def _post_order(self, include_self):
+        # Explicit stack of (node, iterator over its children) so each yield
+        # costs the same no matter how deep the node is
+        stack = [(self, iter(self.get_children()))]
+        while stack:
+            node, children = stack[-1]
+            child = next(children, None)
+            if child is not None:
+                stack.append((child, iter(child.get_children())))
+                continue
+            stack.pop()
+            if stack or include_self:
+                yield node
+
+    def pre_order(self):
+        """ Iterate through self and all lower nodes DFS order, each parent
+            before its children, yielding (depth-below-self, group) pairs
+        """
+        stack = [(0, self)]
+        while stack:
+            depth, node = stack.pop()
+            yield depth, node
+            children = list(node.get_children())
+            children.reverse()
+            stack.extend((depth + 1, x) for x in children)
+
+    def levels(self):
+        """ Like breadth_first() but yield (depth-below-self, group) pairs """
+        q = deque([(0, self)])
+        while q:
+            depth, node = q.popleft()
+            yield depth, node
+            q.extend((depth + 1, x) for x in node.get_children())
 
     def siblings(self):
         """ Siblings are *all* your parent's children, self included """
@@ -63,16 +179,41 @@ class AbstractGroup(object):
 
     @property
     def full_name(self):
-        """ Walk up tree to form fqdn for group, except for implicit <root> """
-        if not self.parent:
-            return self.name
+        """ Dotted name from the top of the tree, except for implicit <root> """
+        if self._full_name is None:
+            # Fill in from the nearest ancestor that has its name cached
+            pending = list()
+            node = self
+            while node._full_name is None:
+                pending.append(node)
+                if node.parent is None:
+                    break
+                node = node.parent
+
+            for node in reversed(pending):
+                parent = node.parent
+                if parent is None or parent.parent is None:
+                    node._full_name = node.name
+                else:
+                    node._full_name = parent._full_name + '.' + node.name
+        return self._full_name
 
-        names = list()
-        parent = self
-        while parent is not None:
-            names.append(parent.name)
-            parent = parent.parent
-        return ".".join(reversed(names[:-1]))
+    @property
+    def depth(self):
+        """ Number of levels below the root (which is at depth 0) """
+        if self._depth is None:
+            pending = list()
+            node = self
+            while node._depth is None:
+                pending.append(node)
+                if node.parent is None:
+                    break
+                node = node.parent
+
+            for node in reversed(pending):
+                parent = node.parent
+                node._depth = 0 if parent is None else parent._depth + 1
+        return self._depth
 
     @property
     def is_leaf(self):
@@ -83,22 +224,42 @@ class AbstractGroup(object):
         return self.children.itervalues()
 
     def find(self, name):
-        """ Find a group named @name below self """
-        for x in self.all():
-            if name == x.full_name:
-                return x
+        """ Find a group named @name below self (or self), None if absent """
+        node = self.root._index.get(name)
+        if node is not None and (node is self or node.is_descendant_of(self)):
+            return node
         return None
 
+    def is_descendant_of(self, other):
+        """ True if @other is a strict ancestor of self """
+        node = self.parent
+        while node is not None:
+            if node is other:
+                return True
+            node = node.parent
+        return False
+
     def leaf_nodes(self):
         return (x for x in self if x.is_leaf)
 
     def print_tree(self, n=0):
-        print '|' + '--' * (n) + str(self)
-        for child in sorted(self.get_children(), key=lambda x: x.name):
-            child.print_tree(n + 1)
+        stack = [(n, self)]
+        while stack:
+            depth, node = stack.pop()
+            print '|' + '--' * depth + str(node)
+            children = sorted(node.get_children(), key=lambda x: x.name, reverse=True)
+            stack.extend((depth + 1, x) for x in children)
 
     def __getitem__(self, key):
-        return self.children[key]
+        """ Child named @key, or a dotted path of names relative to self """
+        if '.' not in key:
+            return self.children[key]
+
+        name = key if self.parent is None else self.full_name + '.' + key
+        node = self.root._index.get(name)
+        if node is None or not node.is_descendant_of(self):
+            raise KeyError(key)
+        return node
 
     def __repr__(self):
         return '<0x%x> %s' % (id(self), self.full_name)
@@ -107,12 +268,20 @@ class AbstractGroup(object):
         return iter(self.walk())
 
     def __contains__(self, key):
-        return (len([x.full_name for x in self if x.full_name == key]) > 0)
+        node = self.root._index.get(key)
+        return node is not None and node.is_descendant_of(self)
 
     def __str__(self):
         return self.full_name
 
 
+def _reset_cache(nodes):
+    """ Forget memoized names/depths, needed when @nodes move or are renamed """
+    for node in nodes:
+        node._full_name = None
+        node._depth = None
+
+
 class DemandGroup(AbstractGroup):
 
     def __init__(self, name, weight=1.0, accept_surplus=False, surplus_threshold=0):
@@ -122,19 +291,60 @@ class DemandGroup(AbstractGroup):
         self.threshold = surplus_threshold
         self.weight = weight
 
-        self.demand = 0
+        # Cached (has_demand, has_slack), see aggregate_demand()
+        self._flags = None
+        self._demand = 0
+
+    @property
+    def demand(self):
+        return self._demand
+
+    @demand.setter
+    def demand(self, value):
+        self._demand = value
+        self.invalidate_demand()
+
+    def _children_changed(self):
+        self.invalidate_demand()
+
+    def invalidate_demand(self):
+        """ Forget the cached demand/slack of this group and its ancestors.
+            Setting .demand does this, call it after changing the weight or
+            threshold of a group directly.
+        """
+        node = self
+        while node is not None:
+            node._flags = None
+            node = node.parent
+
+    def aggregate_demand(self):
+        """ Compute and cache demand/slack for every group in this subtree in
+            one bottom-up pass, so later has_demand()/has_slack() are O(1).
+            Returns the groups in the order of all().
+        """
+        nodes = list(self.all())
+        for node in nodes:
+            node._flags = None
+            node._get_flags()
+        return nodes
+
+    def _get_flags(self):
+        if self._flags is None:
+            if self.is_leaf:
+                demand = self.weight > 0 and self.demand > self.threshold
+                slack = self.weight == 0 or self.demand <= self.threshold
+            else:
+                flags = [x._get_flags() for x in self.get_children()]
+                demand = self.weight > 0 and any(d for d, _ in flags)
+                slack = self.weight > 0 and all(s for _, s in flags)
+            self._flags = (demand, slack)
+        return self._flags
 
     def has_demand(self):
-        if self.is_leaf:
-            return self.weight > 0 and self.demand > self.threshold
-        else:
-            return self.weight > 0 and any(x.has_demand() for x in self.get_children())
+        return self._get_flags()[0]
 
     def has_slack(self):
-        if self.is_leaf:
-            return self.weight == 0 or self.demand <= self.threshold
-        else:
-            return self.weight > 0 and all(x.has_slack() for x in self.get_children())
+        return self._get_flags()[1]
 
     def __str__(self):
         n = 'D' if self.has_demand() else '' + 'S' if self.has_slack() else ''
@@ -145,12 +355,7 @@ class DemandGroup(AbstractGroup):
                 self.threshold, self.demand)
 
     def color_str(self):
-        p = self
-        depth = -1
-        while p.parent:
-            p = p.parent
-            depth += 1
-        return '+' + '--' * depth + str(self)
+        return '+' + '--' * (self.depth - 1) + str(self)
 
 
 class QuotaGroup(AbstractGroup):
@@ -158,10 +363,83 @@ class QuotaGroup(AbstractGroup):
     def __init__(self, name, quota=0, priority=10.0, accept_surplus=False):
         super(QuotaGroup, self).__init__(name)
 
+        # Cached hash of this subtree's contents, see digest
+        self._digest = None
+
         self.quota = int(quota)
         self.prio = float(priority)
         self.surplus = str(bool(accept_surplus)).upper()
 
+    def _digest_attr(attr):
+        """ A property that resets the cached digests when it changes """
+        def getter(self):
+            return getattr(self, attr)
+
+        def setter(self, value):
+            setattr(self, attr, value)
+            self.invalidate_digest()
+        return property(getter, setter)
+
+    quota = _digest_attr('_quota')
+    prio = _digest_attr('_prio')
+    surplus = _digest_attr('_surplus')
+    del _digest_attr
+
+    @property
+    def digest(self):
+        """ Hex hash over quota, prio and surplus of this group and the names
+            and digests of its children (in name order), so two subtrees with
+            equal digests have the same groups and values, whatever order
+            their children were added in
+        """
+        # Bottom-up, only through the subtrees that aren't cached already
+        stack = [(self, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if node._digest is not None:
+                continue
+            if expanded:
+                h = hashlib.sha1('%d\0%r\0%s' % (node.quota, node.prio, node.surplus))
+                for child in sorted(node.get_children(), key=lambda x: x.name):
+                    h.update('\0%s\0%s' % (child.name, child._digest))
+                node._digest = h.hexdigest()
+            else:
+                stack.append((node, True))
+                stack.extend((x, False) for x in node.get_children())
+        return self._digest
+
+    def invalidate_digest(self):
+        """ Forget the cached digest of this group and its ancestors """
+        node = self
+        # An ancestor is never cached when a descendant isn't, stop there
+        while node is not None and node._digest is not None:
+            node._digest = None
+            node = node.parent
+
+    def _children_changed(self):
+        self.invalidate_digest()
+
+    def changed_subtrees(self, other):
+        """ Yield the full names of groups that differ between this tree and
+            @other (added, removed or with different values), only descending
+            into subtrees whose digests differ. An added or removed group's
+            own subtree isn't listed.
+        """
+        stack = [(self, other)]
+        while stack:
+            mine, theirs = stack.pop()
+            if mine.digest == theirs.digest:
+                continue
+            if (mine.quota, mine.prio, mine.surplus) != \
+               (theirs.quota, theirs.prio, theirs.surplus):
+                yield mine.full_name
+
+            for name in set(mine.children) ^ set(theirs.children):
+                grp = mine.children.get(name) or theirs.children[name]
+                yield grp.full_name
+            for name in set(mine.children) & set(theirs.children):
+                stack.append((mine.children[name], theirs.children[name]))
+
     def __str__(self):
         return repr(self)
 
@@ -177,13 +455,10 @@ class QuotaGroup(AbstractGroup):
         return diffs
 
     def full_cmp(self, other):
-        my_names = set([x.full_name for x in self.all()])
-        other_names = set([x.full_name for x in other.all()])
-
-        if set(my_names) ^ set(other_names):
-            return False
-
-        return all([x == y for x, y in zip(self.all(), other.all())])
+        """ True if the trees below self and @other have the same groups and
+            values, by comparing their digests
+        """
+        return self.digest == other.digest
 
     def __eq__(self, other):
         return not self.diff(other)
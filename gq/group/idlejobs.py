@@ -3,49 +3,190 @@
 # Module to give a count of the idle jobs with a simple moving average of
 # the last hour.
 
+import time
 import logging
+from itertools import groupby
+from operator import itemgetter
+
 from ..config import dbconn as db
 from .. import config as c
 
 import MySQLdb
 
+from collectors import collect
+
+try:
+    from batchdemand import ragged, DemandBatch
+    from ringbuf import RingStore
+except ImportError:
+    DemandBatch = RingStore = None
+
 log = logging.getLogger()
 
+# Fewer samples than this in the lookback window mean no demand is considered
+FEWEST_DATAPOINTS = 8
+
 
 def get_db_demand(con, name, window=c.demand_lookback):
     """ Return list of demand-values in last hour unless there are too few then
         return None and warn about it
     """
 
-    fewest_datapoints = 8
-
-    where = 'query_time >= DATE_SUB(NOW(), INTERVAL %d MINUTE) AND group_name="%s"' % \
-            (window, name)
-
-    query = "SELECT amount_in_queue FROM queue_log NATURAL JOIN " + \
-            "groups WHERE %s" % where
+    query = "SELECT amount_in_queue FROM queue_log NATURAL JOIN groups " \
+            "WHERE query_time >= DATE_SUB(NOW(), INTERVAL %s MINUTE) " \
+            "AND group_name=%s ORDER BY query_time"
     cur = con.cursor()
-    count = cur.execute(query)
+    count = cur.execute(query, (window, name))
     data = cur.fetchall()
     cur.close()
 
-    if count < fewest_datapoints:
+    if count < FEWEST_DATAPOINTS:
         log.warning('%d datapoints for %s (< %d), not considering for demand',
-                    count, name, fewest_datapoints)
+                    count, name, FEWEST_DATAPOINTS)
         return None
 
     return [x[0] for x in data]
 
 
+def get_db_demand_all(con, names, window=c.demand_lookback):
+    """ get_db_demand() for all the groups in @names with a single query,
+        returned as a dict of name -> values (or None if too few)
+    """
+
+    query = "SELECT group_name, amount_in_queue FROM queue_log NATURAL JOIN groups " \
+            "WHERE query_time >= DATE_SUB(NOW(), INTERVAL %s MINUTE) " \
+            "ORDER BY group_name, query_time"
+    cur = con.cursor()
+    cur.execute(query, (window,))
+
+    # Rows arrive grouped by name, partition them as they stream in
+    wanted = set(names)
+    demand = dict.fromkeys(wanted)
+    for name, rows in groupby(cur, key=itemgetter(0)):
+        if name in wanted:
+            demand[name] = [x[1] for x in rows]
+    cur.close()
+
+    for name in names:
+        count = len(demand[name] or ())
+        if count < FEWEST_DATAPOINTS:
+            log.warning('%d datapoints for %s (< %d), not considering for demand',
+                        count, name, FEWEST_DATAPOINTS)
+            demand[name] = None
+
+    return demand
+
+
+def get_rollup_demand_all(con, names, window=c.demand_lookback, bucket=c.rollup_bucket):
+    """ Like get_db_demand_all() but read from the queue_rollup table, each
+        name mapped to its (samples, total, first, last) rows for the
+        @bucket-minute buckets starting within the window, in time order
+    """
+
+    size = bucket * 60
+    query = "SELECT group_name, samples, total, first_amount, last_amount " \
+            "FROM queue_rollup JOIN groups USING (id) " \
+            "WHERE bucket >= FROM_UNIXTIME((UNIX_TIMESTAMP() - %s + %s - 1) DIV %s * %s) " \
+            "ORDER BY group_name, bucket"
+    cur = con.cursor()
+    cur.execute(query, (window * 60, size, size, size))
+
+    wanted = set(names)
+    demand = dict.fromkeys(wanted)
+    for name, rows in groupby(cur, key=itemgetter(0)):
+        if name in wanted:
+            demand[name] = [x[1:] for x in rows]
+    cur.close()
+
+    for name in names:
+        count = sum(x[0] for x in demand[name] or ())
+        if count < FEWEST_DATAPOINTS:
+            log.warning('%d datapoints for %s (< %d), not considering for demand',
+                        count, name, FEWEST_DATAPOINTS)
+            demand[name] = None
+
+    return demand
+
+
+def get_db_time(con):
+    """ The DB's current time in epoch seconds, which queue_log samples are
+        stamped with
+    """
+
+    cur = con.cursor()
+    cur.execute("SELECT UNIX_TIMESTAMP()")
+    now = float(cur.fetchone()[0])
+    cur.close()
+    return now
+
+
+def get_db_samples_since(con, since):
+    """ (group_name, epoch-seconds, amount) of every queue_log sample newer
+        than @since (epoch seconds, DB time) ordered by group and time
+    """
+
+    cur = con.cursor()
+    cur.execute("SELECT group_name, UNIX_TIMESTAMP(query_time), amount_in_queue "
+                "FROM queue_log NATURAL JOIN groups "
+                "WHERE query_time > FROM_UNIXTIME(%s) "
+                "ORDER BY group_name, query_time", (since,))
+    rows = [(name, float(when), amount) for name, when, amount in cur]
+    cur.close()
+    return rows
+
+
+def sample_averages(data):
+    """ get_average() of @data and of its two halves, as (whole, first, second) """
+    first, second = data[:len(data)/2], data[len(data)/2:]
+    return get_average(data), get_average(first), get_average(second)
+
+
+def rollup_averages(buckets):
+    """ sample_averages() of the samples summarized by @buckets, a list of
+        (samples, total, first, last) in time order. The halves are split
+        at the bucket boundary nearest the middle sample, so this is exact
+        only when each bucket holds a single sample.
+    """
+
+    def average(part):
+        n = sum(x[0] for x in part)
+        total = sum(x[1] for x in part)
+        if n < 2:
+            return float(total)
+        return (total - (part[0][2] + part[-1][3]) / 2.0) / float(n - 1)
+
+    whole = average(buckets)
+    if len(buckets) < 2:
+        return whole, whole, whole
+
+    half = sum(x[0] for x in buckets) / 2
+    split, best, seen = 1, None, 0
+    for i in range(1, len(buckets)):
+        seen += buckets[i - 1][0]
+        if best is None or abs(seen - half) < best:
+            split, best = i, abs(seen - half)
+
+    return whole, average(buckets[:split]), average(buckets[split:])
+
+
 # XXX: This is poorly named
-def spike_detected(data):
+def spike_detected(data, pct_dec_spike=None):
     """ Look for rapid-decrease between halves of dataset or if second-half is
         a flat zero. If so return True so there is no demand considered.
     """
 
     # Half the data and look at the averages separately
-    first, second = data[:len(data)/2], data[len(data)/2:]
-    m, n = get_average(first), get_average(second)
+    _, m, n = sample_averages(data)
+    return spike_from_averages(m, n, pct_dec_spike)
+
+
+def spike_from_averages(m, n, pct_dec_spike=None):
+    """ The spike_detected() decision from the averages of the first (@m) and
+        second (@n) halves, @pct_dec_spike defaults to the configured one
+    """
+
+    if pct_dec_spike is None:
+        pct_dec_spike = c.pct_dec_spike
 
     # If the entire second half is zero, consider it exhausted and return True
     if m > 0 and n == 0:
@@ -60,7 +201,7 @@ def spike_detected(data):
     d = 100 * (n - m) / m
     log.debug("First avg: %d, second avg: %d, change: %.2f%%", m, n, d)
 
-    if d < -c.pct_dec_spike:
+    if d < -pct_dec_spike:
         log.debug("Decrease sufficient between halves, spike to true")
         return True
 
@@ -77,38 +218,151 @@ def get_average(data):
     return avg / float(len(data) - 1)
 
 
-def populate_demand(root):
+def _demand_of(history, averages):
+    """ name -> (demand, status) for the @history of each group, @averages
+        giving the (whole, first-half, second-half) averages of one
+    """
+    demand = dict()
+    for name, last_hour in history.iteritems():
+        if last_hour is None:
+            demand[name] = 0, 'insufficient'
+            continue
+        whole, m, n = averages(last_hour)
+        average = int(round(whole))
+        if average > 0 and spike_from_averages(m, n):
+            demand[name] = 0, 'spike'
+        else:
+            demand[name] = average, None
+    return demand
 
-    con = db.get()[0]
-    for node in root.leaf_nodes():
-        name = node.full_name
-        last_hour = get_db_demand(con, node.full_name)
-        average = int(round(get_average(last_hour))) if last_hour is not None else 0
 
-        if last_hour is None:
+def _batch_demand_of(history):
+    """ _demand_of() raw samples for all groups in one vectorized pass """
+    names = list(history)
+    offsets, values = ragged([history[x] for x in names])
+    batch = DemandBatch(offsets, values, FEWEST_DATAPOINTS)
+
+    demand = dict()
+    for i, name in enumerate(names):
+        if not batch.enough[i]:
+            demand[name] = 0, 'insufficient'
+        else:
+            demand[name] = int(batch.demand[i]), 'spike' if batch.spike[i] else None
+    return demand
+
+
+def _estimated_demand(con, names):
+    """ _demand_of() from the per-group incremental estimators, feeding them
+        only the samples that are new since their last run
+    """
+    from estimators import EstimatorSet
+
+    estimators = EstimatorSet(c.estimator_state, FEWEST_DATAPOINTS)
+
+    # The clock the samples were stamped with: the collector's for the ring
+    # buffers, the DB's for queue_log
+    now = time.time() if con is None else get_db_time(con)
+    since = estimators.since(names, now - 60 * c.demand_lookback)
+    if con is None:
+        store = RingStore(c.ring_dir, c.ring_capacity)
+        rows = list(store.rows(names, since))
+        store.close()
+    else:
+        rows = get_db_samples_since(con, since)
+
+    estimators.feed(rows)
+    demand = estimators.demand(names, now)
+    # Groups gone from the tree would otherwise stay in the file for good
+    estimators.save(names)
+    return demand
+
+
+def populate_demand(root, con=None):
+    """ Set the demand of every leaf in @root from the last demand_lookback
+        minutes of samples: from the local ring buffers if configured, else
+        from queue_log (or queue_rollup if rollup_bucket is set) with one
+        query over connection @con (a new one if not given)
+    """
+
+    leaves = list(root.leaf_nodes())
+    names = [x.full_name for x in leaves]
+
+    use_ring = c.ring_dir and RingStore is not None
+    if c.ring_dir and not use_ring:
+        log.error("Ring buffer needs NumPy, reading demand from the DB")
+
+    own = con is None and not use_ring
+    if own:
+        con = db.get()[0]
+
+    if c.estimator_state:
+        demand = _estimated_demand(None if use_ring else con, names)
+    elif use_ring:
+        store = RingStore(c.ring_dir, c.ring_capacity)
+        history = store.history(names, 60 * c.demand_lookback, FEWEST_DATAPOINTS)
+        demand = _batch_demand_of(history)
+        store.close()
+    elif c.rollup_bucket:
+        demand = _demand_of(get_rollup_demand_all(con, names), rollup_averages)
+    elif DemandBatch is not None:
+        demand = _batch_demand_of(get_db_demand_all(con, names))
+    else:
+        demand = _demand_of(get_db_demand_all(con, names), sample_averages)
+
+    for node in leaves:
+        name = node.full_name
+        value, status = demand[name]
+        if status == 'insufficient':
             log.warning("Queue %s has insufficient data for demand calc", name)
-            demand = 0
-        elif average > 0 and spike_detected(last_hour):
+        elif status == 'spike':
             log.info("Queue %s -- spike detected", name)
-            demand = 0
-        else:
-            demand = average
 
-        log.debug('real-demand for %s set -> %d', name, demand)
-        node.demand = demand
+        log.debug('real-demand for %s set -> %d', name, value)
+        node.demand = value
+
+    if own:
+        con.close()
+
 
-    con.close()
+def _update_rollup(cur, rows):
+    """ Add the (amount, group_name) @rows to the current queue_rollup bucket """
+    size = c.rollup_bucket * 60
+    cur.executemany('INSERT INTO queue_rollup (`id`, `bucket`, `samples`, `total`, '
+                    '`first_amount`, `last_amount`) '
+                    'SELECT id, FROM_UNIXTIME(UNIX_TIMESTAMP() DIV %s * %s), 1, %s, %s, %s '
+                    'FROM groups WHERE group_name=%s '
+                    'ON DUPLICATE KEY UPDATE samples=samples + 1, '
+                    'total=total + VALUES(total), last_amount=VALUES(last_amount)',
+                    [(size, size, n, n, n, name) for n, name in rows])
 
 
-def _insert_to_db(data, keep_days):
+def _buffer_samples(data):
+    """ Write the group_name -> #idle @data through to the local ring
+        buffers, learning the ids of groups new to them from the DB
+    """
+    try:
+        store = RingStore(c.ring_dir, c.ring_capacity)
+        if any(x not in store.index for x in data):
+            try:
+                with db.transaction() as cur:
+                    cur.execute("SELECT group_name, id FROM groups")
+                    store.update_index(cur.fetchall())
+            except MySQLdb.Error as E:
+                log.error("Can't look up new group ids: %s", E)
+        store.append(data)
+        store.close()
+    except EnvironmentError as E:
+        log.error("Error writing ring buffers in %s: %s", c.ring_dir, E)
+
+
+def _insert_to_db(data):
     try:
-        con, cur = c.dbconn.get()
-        cur.executemany('INSERT INTO queue_log (`id`, `amount_in_queue`) '
-                        'SELECT id, %s FROM groups WHERE group_name=%s',
-                        [tuple(reversed(x)) for x in data])
-        cur.execute('DELETE FROM queue_log WHERE '
-                    'query_time < DATE_SUB(NOW(), INTERVAL %d DAY)' % keep_days)
-        con.commit()
+        with db.transaction() as cur:
+            rows = [tuple(reversed(x)) for x in data]
+            cur.executemany('INSERT INTO queue_log (`id`, `amount_in_queue`) '
+                            'SELECT id, %s FROM groups WHERE group_name=%s', rows)
+            if c.rollup_bucket:
+                _update_rollup(cur, rows)
     except MySQLdb.Error as E:
         log.error("Error connecting to database: %s" % E)
         return False
@@ -116,20 +370,24 @@ def _insert_to_db(data, keep_days):
         return True
 
 
-def insert_data(modules, window):
+def insert_data(modules):
     """ Take a list of modules from the get_idle script and update the database
-        with the output of *.get_jobs() from each. Keep @windows #days of data
+        with the output of *.get_jobs() from each, run concurrently. Modules
+        that fail or time out contribute their last good output if recent
+        enough, the rest is written regardless. Old data is removed on its
+        own schedule by gq.group.retention.
     """
-    data = {}
 
-    for mod in modules:
-        nums = mod.get_jobs()
-        for k in nums:
-            log.info("%s: %d idle jobs", k, nums[k])
+    data = collect(modules)
+    if data is None:
+        log.error("No module returned data, exit!")
+        return False
+
+    for k in sorted(data):
+        log.info("%s: %d idle jobs", k, data[k])
 
-        if nums is None:
-            log.error("Module %s returned None, exit!", mod)
-            return False
-        data.update(nums)
+    # Buffered first, so the balancer has the samples even if the DB is slow
+    if c.ring_dir and RingStore is not None:
+        _buffer_samples(data)
 
-    return _insert_to_db(data.iteritems(), window)
+    return _insert_to_db(data.iteritems())
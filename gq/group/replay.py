@@ -0,0 +1,253 @@
+# *****************************************************************************
+# Replay recorded queue_log history through the balancer at simulated ticks
+# *****************************************************************************
+#
+# For each tick the demand of every leaf is worked out from the samples in
+# its lookback window the way populate_demand() does, calculate_surplus()
+# picks the flags and update_surplus_flags()'s change_lookback hysteresis
+# decides which of them would actually have been written. A leaf's demand
+# only depends on its own samples, so it is computed for all ticks at once,
+# the windows being overlapping slices of its samples for DemandBatch. The
+# ticks then only look at the leaves that crossed their thresholds, the
+# sibling sets above them (see IncrementalBalancer) and the flags not written
+# yet, so quiet ticks are cheap no matter how many groups there are.
+
+import re
+import math
+import time
+import logging
+import calendar
+from itertools import islice
+from collections import defaultdict
+
+import numpy as np
+
+import MySQLdb.cursors
+
+from ..config import dbconn as db
+from .. import config as c
+
+from balance import IncrementalBalancer
+from batchdemand import DemandBatch
+from snapshot import Snapshot
+from idlejobs import FEWEST_DATAPOINTS
+
+log = logging.getLogger()
+
+__all__ = ['read_history_file', 'read_history_db', 'window_demand', 'Replay', 'ReplayReport']
+
+_separator = re.compile(r'[,\t]')
+
+# History rows read at once when replaying
+CHUNK_ROWS = 1 << 16
+
+
+def read_history_file(fname):
+    """ Yield (epoch-seconds, group_name, amount) from an exported queue_log
+        file, one "query_time,group_name,amount_in_queue" row per line (comma
+        or tab separated) in time order. query_time is either epoch seconds
+        or a "YYYY-MM-DD HH:MM:SS" UTC timestamp, header lines are skipped.
+    """
+    seen = dict()   # Rows from one collector run share the same timestamp
+    with open(fname) as fp:
+        for line in fp:
+            fields = _separator.split(line.strip())
+            if len(fields) != 3 or not fields[0][:1].isdigit():
+                continue
+            ts, name, amount = fields
+            when = seen.get(ts)
+            if when is None:
+                try:
+                    when = float(ts)
+                except ValueError:
+                    when = calendar.timegm(time.strptime(ts, '%Y-%m-%d %H:%M:%S'))
+                seen[ts] = when
+            yield when, name, int(amount)
+
+
+def read_history_db(start, end):
+    """ Yield (epoch-seconds, group_name, amount) from queue_log between the
+        datetimes @start and @end, streamed in time order
+    """
+    con, cur = db.get(curclass=MySQLdb.cursors.SSCursor)
+    try:
+        cur.execute("SELECT UNIX_TIMESTAMP(query_time), group_name, amount_in_queue "
+                    "FROM queue_log NATURAL JOIN groups "
+                    "WHERE query_time >= %s AND query_time < %s "
+                    "ORDER BY query_time", (start, end))
+        for when, name, amount in cur:
+            yield float(when), name, amount
+    finally:
+        cur.close()
+        con.close()
+
+
+def window_demand(times, values, ticks, window, pct_dec_spike=None):
+    """ Array of what populate_demand() would set at each of the @ticks from
+        the samples (@times, @values) of a group, in time order, taken in the
+        @window seconds up to a tick
+    """
+    if not len(times):
+        return np.zeros(len(ticks), dtype=np.int64)
+    times, ticks = np.asarray(times, dtype=float), np.asarray(ticks, dtype=float)
+    end = np.searchsorted(times, ticks, 'right')
+    start = np.searchsorted(times, ticks - window, 'left')
+    return DemandBatch(start, values, FEWEST_DATAPOINTS, pct_dec_spike, ends=end).demand
+
+
+class ReplayReport(object):
+    """ Outcome of a replay: per-group toggles and seconds with surplus, plus
+        the wall-clock time each tick took
+    """
+
+    def __init__(self, groups):
+        self.toggles = dict((x, 0) for x in groups)
+        self.surplus_seconds = dict((x, 0) for x in groups)
+        self.tick_times = list()
+        self.demand_time = 0.0
+        self.seconds = 0
+
+    @property
+    def total_toggles(self):
+        return sum(self.toggles.values())
+
+    def surplus_fraction(self, name):
+        return self.surplus_seconds[name] / float(self.seconds) if self.seconds else 0.0
+
+    def tick_stats(self):
+        """ (mean, median, 95th percentile, max) tick time in seconds """
+        t = sorted(self.tick_times)
+        if not t:
+            return 0, 0, 0, 0
+        return sum(t) / len(t), t[len(t) / 2], t[int(len(t) * 0.95)], t[-1]
+
+    def format(self):
+        lines = ["%d ticks over %.1f days, %d flag toggles" %
+                 (len(self.tick_times), self.seconds / 86400.0, self.total_toggles),
+                 "demand at all ticks: %.2f s, then tick time: mean %.2f ms, "
+                 "median %.2f ms, p95 %.2f ms, max %.2f ms" %
+                 ((self.demand_time,) + tuple(1000 * x for x in self.tick_stats())),
+                 "%-40s %8s %9s" % ("group", "toggles", "surplus%")]
+        for name in sorted(self.toggles):
+            lines.append("%-40s %8d %8.1f%%" % (name, self.toggles[name],
+                                                100 * self.surplus_fraction(name)))
+        return "\n".join(lines)
+
+
+class Replay(object):
+    """ Replays history through the balancer for the DemandGroup tree @root,
+        starting from its weights, thresholds, demand and flags. @root isn't
+        changed, the replay sets demand and flags on a copy of it (self.root).
+        Parameters default to the configured ones, all in minutes except
+        @pct_dec_spike (percent) and @tick (seconds).
+    """
+
+    # What the replay needs of each group, and copies
+    ATTRS = ('weight', 'threshold', 'accept', 'demand')
+
+    def __init__(self, root, tick=300, demand_lookback=None, pct_dec_spike=None,
+                 change_lookback=None):
+        self.root = Snapshot.freeze(root, self.ATTRS).thaw(type(root))
+        self.tick = tick
+        self.window = 60 * (demand_lookback or c.demand_lookback)
+        self.pct_dec_spike = pct_dec_spike if pct_dec_spike is not None else c.pct_dec_spike
+        self.change_lookback = 60 * (change_lookback or c.change_lookback)
+
+        self.groups = list(self.root)
+        self.leaves = list(self.root.leaf_nodes())
+
+    def demand(self, history, report):
+        """ (ticks, crossings) for @history: crossings[k] lists the (leaf,
+            demand) of the leaves to update at tick k, all of them at the
+            first tick and then those that crossed their threshold
+        """
+        start = time.time()
+        index = dict((x.full_name, i) for i, x in enumerate(self.leaves))
+
+        # Read in chunks, each split into columns
+        leaf, times, values = [], [], []
+        history = iter(history)
+        while True:
+            chunk = list(islice(history, CHUNK_ROWS))
+            if not chunk:
+                break
+            leaf.append(np.array([index.get(x[1], -1) for x in chunk], dtype=np.intp))
+            times.append(np.array([x[0] for x in chunk], dtype=float))
+            values.append(np.array([x[2] for x in chunk], dtype=np.int64))
+        if not times:
+            return [], None
+        leaf, times, values = [np.concatenate(x) for x in (leaf, times, values)]
+
+        now = times[0] - times[0] % self.tick + self.tick
+        count = max(0, int(math.ceil((times[-1] - now) / float(self.tick)))) + 1
+        ticks = now + self.tick * np.arange(count, dtype=float)
+
+        # Samples grouped by leaf, each group's still in time order;
+        # those of other groups don't count
+        order = np.argsort(leaf, kind='mergesort')
+        leaf, times, values = leaf[order], times[order], values[order]
+        bounds = np.searchsorted(leaf, np.arange(len(self.leaves) + 1))
+
+        crossings = defaultdict(list)
+        for i, grp in enumerate(self.leaves):
+            a, b = bounds[i], bounds[i + 1]
+            demand = window_demand(times[a:b], values[a:b], ticks, self.window,
+                                   self.pct_dec_spike)
+            over = demand > grp.threshold
+            crossings[0].append((grp, int(demand[0])))
+            for k in np.flatnonzero(over[1:] != over[:-1]) + 1:
+                crossings[k].append((grp, int(demand[k])))
+
+        report.demand_time = time.time() - start
+        return ticks.tolist(), crossings
+
+    def run(self, history):
+        """ Replay @history, an iterable of (epoch-seconds, group, amount) in
+            time order, returning a ReplayReport
+        """
+        report = ReplayReport([x.full_name for x in self.groups])
+        ticks, crossings = self.demand(history, report)
+        if not ticks:
+            return report
+        balancer = IncrementalBalancer(self.root)
+
+        # The DB flags, the time of their last change and since when the set
+        # ones are set; the groups whose wanted flag differs from the DB one
+        flags = dict((x.full_name, x.accept) for x in self.groups)
+        changed = dict((x.full_name, None) for x in self.groups)
+        since = dict((x, ticks[0]) for x in flags if flags[x])
+        differ = dict()
+
+        for k, now in enumerate(ticks):
+            start = time.time()
+
+            # Flags only depend on which leaves are over their thresholds
+            crossed = crossings.pop(k, ())
+            for leaf, demand in crossed:
+                leaf.demand = demand
+            for group in balancer.rebalance([x for x, _ in crossed]):
+                name = group.full_name
+                if group.accept != flags[name]:
+                    differ[name] = group.accept
+                else:
+                    differ.pop(name, None)
+
+            for name, accept in differ.items():
+                last = changed[name]
+                if last is None or now - last > self.change_lookback:
+                    flags[name] = accept
+                    changed[name] = now
+                    report.toggles[name] += 1
+                    del differ[name]
+                    if accept:
+                        since[name] = now
+                    else:
+                        report.surplus_seconds[name] += now - since.pop(name)
+
+            report.tick_times.append(time.time() - start)
+            report.seconds += self.tick
+
+        end = ticks[-1] + self.tick
+        for name, when in since.items():
+            report.surplus_seconds[name] += end - when
+        return report
@@ -0,0 +1,196 @@
+# *****************************************************************************
+# Retention of the idle-job history, run on its own schedule
+# *****************************************************************************
+#
+# Old queue_log samples are removed either with small DELETE ... LIMIT
+# chunks, each its own transaction with a pause in between so the
+# collector's inserts never wait long on locks, or by dropping whole days
+# of a queue_log partitioned by day. Before they go, samples can be folded
+# into hourly min/avg/max rows of queue_hourly, one hour per transaction so
+# an interrupted run never counts an hour twice.
+
+import time
+import logging
+import datetime
+
+from ..config import dbconn as db
+from .. import config as c
+
+log = logging.getLogger()
+
+__all__ = ['prune', 'chunked_delete', 'downsample', 'add_partitions', 'drop_partitions']
+
+HOUR = datetime.timedelta(hours=1)
+
+
+def chunked_delete(con, table, column, keep_days, chunk=None, pause=None):
+    """ Delete rows of @table whose @column is more than @keep_days old,
+        @chunk rows per transaction with @pause seconds between them.
+        Returns the number of rows deleted.
+    """
+
+    chunk = chunk or c.chunk_rows
+    pause = c.chunk_pause if pause is None else pause
+
+    query = "DELETE FROM %s WHERE %s < DATE_SUB(NOW(), INTERVAL %%s DAY) LIMIT %%s" % \
+            (table, column)
+    cur = con.cursor()
+    deleted = 0
+    while True:
+        count = cur.execute(query, (keep_days, chunk))
+        con.commit()
+        deleted += count
+        if count < chunk:
+            break
+        time.sleep(pause)
+    cur.close()
+
+    log.info("Deleted %d rows older than %d days from %s", deleted, keep_days, table)
+    return deleted
+
+
+def downsample(con, keep_days, delete=True, pause=None):
+    """ Fold the queue_log samples more than @keep_days old into queue_hourly,
+        hour by hour, deleting each hour's samples in the same transaction if
+        @delete. Returns the number of hours folded.
+    """
+
+    pause = c.chunk_pause if pause is None else pause
+    cur = con.cursor()
+
+    cur.execute("SELECT NOW()")
+    cutoff = cur.fetchone()[0] - datetime.timedelta(days=keep_days)
+    cutoff = cutoff.replace(minute=0, second=0, microsecond=0)
+    cur.execute("SELECT MIN(query_time) FROM queue_log")
+    oldest = cur.fetchone()[0]
+    if oldest is None:
+        cur.close()
+        return 0
+
+    hour = oldest.replace(minute=0, second=0, microsecond=0)
+    if not delete:
+        # The samples stay until their partition is dropped, skip what's done
+        cur.execute("SELECT MAX(hour) FROM queue_hourly")
+        done = cur.fetchone()[0]
+        if done is not None and done + HOUR > hour:
+            hour = done + HOUR
+
+    folded = 0
+    while hour < cutoff:
+        cur.execute("INSERT INTO queue_hourly (`id`, `hour`, `samples`, `total`, "
+                    "`min_amount`, `max_amount`, `avg_amount`) "
+                    "SELECT id, %s, COUNT(*), SUM(amount_in_queue), MIN(amount_in_queue), "
+                    "MAX(amount_in_queue), AVG(amount_in_queue) FROM queue_log "
+                    "WHERE query_time >= %s AND query_time < %s AND id IS NOT NULL "
+                    "GROUP BY id ON DUPLICATE KEY UPDATE "
+                    "samples=samples + VALUES(samples), total=total + VALUES(total), "
+                    "min_amount=LEAST(min_amount, VALUES(min_amount)), "
+                    "max_amount=GREATEST(max_amount, VALUES(max_amount)), "
+                    "avg_amount=total / samples", (hour, hour, hour + HOUR))
+        if delete:
+            cur.execute("DELETE FROM queue_log WHERE query_time >= %s AND query_time < %s",
+                        (hour, hour + HOUR))
+        con.commit()
+        folded += 1
+        hour += HOUR
+        time.sleep(pause)
+    cur.close()
+
+    log.info("Folded %d hours of samples into queue_hourly", folded)
+    return folded
+
+
+def _partitions(cur):
+    """ {day: partition-name} of queue_log's daily pYYYYMMDD partitions """
+    cur.execute("SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+                "WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME='queue_log' "
+                "AND PARTITION_NAME LIKE 'p________'")
+    days = dict()
+    for name, in cur.fetchall():
+        try:
+            days[datetime.datetime.strptime(name[1:], '%Y%m%d').date()] = name
+        except ValueError:
+            continue
+    return days
+
+
+def add_partitions(con, days_ahead=3):
+    """ Split daily partitions up to @days_ahead days from now off the
+        catch-all pmax partition, starting the day after the last one. The
+        first time, when pmax holds all of the history, they start at the
+        oldest sample so the existing days can be dropped one by one too;
+        that first run copies the whole table once.
+    """
+
+    cur = con.cursor()
+    existing = _partitions(cur)
+    today = datetime.date.today()
+    if existing:
+        # Also any days missed since, their samples are still in pmax
+        day = max(existing) + datetime.timedelta(days=1)
+    else:
+        cur.execute("SELECT MIN(query_time) FROM queue_log")
+        oldest = cur.fetchone()[0]
+        day = oldest.date() if oldest is not None else today
+
+    new = list()
+    while day <= today + datetime.timedelta(days=days_ahead):
+        end = day + datetime.timedelta(days=1)
+        new.append("PARTITION p%s VALUES LESS THAN (UNIX_TIMESTAMP('%s 00:00:00'))" %
+                   (day.strftime('%Y%m%d'), end.isoformat()))
+        day = end
+
+    if new:
+        cur.execute("ALTER TABLE queue_log REORGANIZE PARTITION pmax INTO (%s, "
+                    "PARTITION pmax VALUES LESS THAN MAXVALUE)" % ", ".join(new))
+        log.info("Added %d daily partitions to queue_log", len(new))
+    cur.close()
+    return len(new)
+
+
+def drop_partitions(con, keep_days):
+    """ Drop the daily partitions of queue_log holding only samples more
+        than @keep_days old. Returns the names of those dropped.
+    """
+
+    cur = con.cursor()
+    cutoff = datetime.date.today() - datetime.timedelta(days=keep_days)
+    old = sorted(name for day, name in _partitions(cur).items() if day < cutoff)
+    if old:
+        cur.execute("ALTER TABLE queue_log DROP PARTITION %s" % ", ".join(old))
+        log.info("Dropped queue_log partitions %s", ", ".join(old))
+    cur.close()
+    return old
+
+
+def prune(keep_days=None, method=None, fold=None):
+    """ Apply the configured retention to queue_log, queue_rollup and
+        queue_hourly; the arguments override keep_days, method and
+        downsample from the config
+    """
+
+    keep_days = c.keep_days if keep_days is None else keep_days
+    method = method or c.retention_method
+    fold = c.downsample if fold is None else fold
+    if method not in ('delete', 'partitions'):
+        raise ValueError("Unknown retention method '%s'" % method)
+
+    con = db.get()[0]
+    try:
+        if fold:
+            downsample(con, keep_days, delete=(method == 'delete'))
+            chunked_delete(con, 'queue_hourly', 'hour', c.hourly_keep_days)
+
+        if method == 'partitions':
+            add_partitions(con)
+            drop_partitions(con, keep_days)
+        elif not fold:
+            # When folding, downsample() already deleted what it folded; the
+            # samples up to NOW() - keep_days past its whole-hour cutoff
+            # must wait until their hour is folded too
+            chunked_delete(con, 'queue_log', 'query_time', keep_days)
+
+        if c.rollup_bucket:
+            chunked_delete(con, 'queue_rollup', 'bucket', keep_days)
+    finally:
+        con.close()
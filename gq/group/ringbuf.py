@@ -0,0 +1,204 @@
+# *****************************************************************************
+# Local on-disk ring buffers of idle-job samples, one per group id
+# *****************************************************************************
+#
+# Each group's file is a small header followed by fixed-size arrays of
+# sample times and amounts, memory-mapped so NumPy reads them in place. The
+# collector appends through RingStore.append() as it inserts into the DB and
+# the balancer reads its lookback window from here instead of the DB, which
+# stays the only long-term history.
+#
+# Writers bump a sequence number before and after touching a slot (odd while
+# writing), readers retry if it moved under them, so the two processes
+# never need a lock.
+
+import os
+import json
+import mmap
+import time
+import struct
+import logging
+
+import numpy as np
+
+log = logging.getLogger()
+
+__all__ = ['Ring', 'RingStore']
+
+MAGIC = 'GQRB'
+
+
+class Ring(object):
+    """ The ring buffer of one group in the file @fname, created with room
+        for @capacity samples if it doesn't exist yet
+    """
+
+    # magic, capacity, sequence number, samples written ever
+    header = struct.Struct('<4sIQQ')
+
+    def __init__(self, fname, capacity=2048):
+        if not os.path.exists(fname):
+            self._create(fname, capacity)
+
+        self._fp = open(fname, 'r+b')
+        self._mm = mmap.mmap(self._fp.fileno(), 0)
+        magic, self.capacity, _, _ = self.header.unpack_from(self._mm)
+        if magic != MAGIC:
+            raise ValueError("%s is not a ring buffer file" % fname)
+
+        offset = self.header.size
+        self.times = np.frombuffer(self._mm, dtype='<f8', count=self.capacity,
+                                   offset=offset)
+        self.values = np.frombuffer(self._mm, dtype='<i8', count=self.capacity,
+                                    offset=offset + 8 * self.capacity)
+
+    def _create(self, fname, capacity):
+        tmp = fname + '.tmp'
+        with open(tmp, 'wb') as fp:
+            fp.write(self.header.pack(MAGIC, capacity, 0, 0))
+            fp.write('\0' * (16 * capacity))
+        os.rename(tmp, fname)
+
+    def _state(self):
+        return self.header.unpack_from(self._mm)[2:]
+
+    def _set_state(self, seq, count):
+        struct.pack_into('<QQ', self._mm, 8, seq, count)
+
+    def append(self, when, value):
+        seq, count = self._state()
+        self._set_state(seq + 1, count)
+        slot = count % self.capacity
+        self.times[slot] = when
+        self.values[slot] = value
+        self._set_state(seq + 2, count + 1)
+
+    def __len__(self):
+        return min(self._state()[1], self.capacity)
+
+    def window(self, since, with_times=False):
+        """ Amounts of the samples taken at or after @since, oldest first, as
+            a copy: nothing returned refers to the file, so it stays valid
+            after later appends and close(). With @with_times, a (times,
+            amounts) pair.
+        """
+        def join(column, slices):
+            if not slices:
+                return column[:0].copy()
+            # concatenate() copies, even a single piece
+            return np.concatenate([column[x] for x in slices])
+
+        while True:
+            seq, count = self._state()
+            if seq % 2:
+                time.sleep(0.001)
+                continue
+
+            head = count % self.capacity
+            # Oldest samples from head to the end, then the newer ones from 0
+            if count > self.capacity:
+                parts = [(head, self.capacity), (0, head)]
+            else:
+                parts = [(0, count)]
+
+            slices = list()
+            for lo, hi in parts:
+                start = lo + np.searchsorted(self.times[lo:hi], since)
+                if start < hi:
+                    slices.append(slice(start, hi))
+
+            # Copied before the check, so a writer can't change them after
+            values = join(self.values, slices)
+            times = join(self.times, slices) if with_times else None
+            if self._state()[0] == seq:
+                break
+
+        if with_times:
+            return times, values
+        return values
+
+    def close(self):
+        self._mm.close()
+        self._fp.close()
+
+
+class RingStore(object):
+    """ The ring buffers of all groups in directory @path, found by group id
+        through a name -> id index kept next to them
+    """
+
+    def __init__(self, path, capacity=2048):
+        self.path = path
+        self.capacity = capacity
+        self._rings = dict()
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._index_file = os.path.join(path, 'index.json')
+        try:
+            with open(self._index_file) as fp:
+                self.index = json.load(fp)
+        except (EnvironmentError, ValueError):
+            self.index = dict()
+
+    def update_index(self, pairs):
+        """ Add (group_name, id) @pairs to the index and save it """
+        self.index.update(pairs)
+        tmp = self._index_file + '.tmp'
+        with open(tmp, 'w') as fp:
+            json.dump(self.index, fp)
+        os.rename(tmp, self._index_file)
+
+    def ring(self, gid):
+        if gid not in self._rings:
+            fname = os.path.join(self.path, '%d.ring' % gid)
+            self._rings[gid] = Ring(fname, self.capacity)
+        return self._rings[gid]
+
+    def append(self, data, when=None):
+        """ Add a sample for each group_name -> amount in @data, taken at
+            @when (now by default), skipping names not in the index
+        """
+        when = when or time.time()
+        for name, amount in data.iteritems():
+            gid = self.index.get(name)
+            if gid is None:
+                log.warning("No group id known for %s, not buffered", name)
+                continue
+            self.ring(gid).append(when, amount)
+
+    def history(self, names, lookback, fewest, now=None):
+        """ name -> amounts of the last @lookback seconds for each of @names,
+            or None for those with fewer than @fewest samples. The arrays
+            are copies (see Ring.window()), they outlive close().
+        """
+        since = (now or time.time()) - lookback
+        history = dict()
+        for name in names:
+            gid = self.index.get(name)
+            data = self.ring(gid).window(since) if gid is not None else None
+            count = len(data) if data is not None else 0
+            if count < fewest:
+                log.warning('%d datapoints for %s (< %d), not considering for demand',
+                            count, name, fewest)
+                data = None
+            history[name] = data
+        return history
+
+    def rows(self, names, since):
+        """ (name, time, amount) of the samples of @names after @since, in
+            time order per group
+        """
+        for name in names:
+            gid = self.index.get(name)
+            if gid is None:
+                continue
+            times, values = self.ring(gid).window(since, with_times=True)
+            for when, value in zip(times.tolist(), values.tolist()):
+                if when > since:
+                    yield name, when, value
+
+    def close(self):
+        for ring in self._rings.values():
+            ring.close()
+        self._rings.clear()
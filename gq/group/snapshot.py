@@ -0,0 +1,170 @@
+# *****************************************************************************
+# Persistent (copy-on-write) snapshots of a group-tree
+# *****************************************************************************
+#
+# A Snapshot node never changes once built. Every "modification" returns a
+# new root that copies only the nodes on the path down to the changed group
+# and shares every other subtree with the version it came from, so keeping
+# many versions of a large tree costs memory in proportion to what changed.
+# Nodes have no parent pointers (they may belong to many versions at once),
+# full names are built up while walking down from the root instead. Keep
+# versions in any sequence (a deque(maxlen=N) for the last N); freeze() and
+# thaw() also make a private copy of a tree, as the balancer replay does.
+
+import hashlib
+
+from diff import DIFF_ATTRS
+
+__all__ = ['Snapshot']
+
+
+class Snapshot(object):
+    """ One immutable node of a snapshot tree, with its values in a dict """
+    __slots__ = ('name', 'values', 'children', '_digest')
+
+    def __init__(self, name, values, children=None):
+        self.name = name
+        self.values = values
+        self.children = children if children is not None else {}
+        self._digest = None
+
+    @classmethod
+    def freeze(cls, grp, attrs=DIFF_ATTRS):
+        """ Snapshot of the tree under the AbstractGroup @grp, keeping the
+            attributes named in @attrs of each group
+        """
+        frozen = dict()
+        for node in grp.all():
+            children = dict((x.name, frozen.pop(id(x))) for x in node.get_children())
+            values = dict((x, getattr(node, x)) for x in attrs)
+            frozen[id(node)] = cls(node.name, values, children)
+        return frozen[id(grp)]
+
+    def thaw(self, grpCLS):
+        """ Build a new mutable tree of @grpCLS groups from this snapshot,
+            setting each value as an attribute of the group
+        """
+        root = grpCLS(self.name)
+        stack = [(root, self)]
+        while stack:
+            grp, snap = stack.pop()
+            for attr, val in snap.values.items():
+                setattr(grp, attr, val)
+            for name in sorted(snap.children):
+                child = grpCLS(name)
+                grp.add_child(child)
+                stack.append((child, snap.children[name]))
+        return root
+
+    def __getattr__(self, attr):
+        if attr == 'values':
+            raise AttributeError(attr)
+        try:
+            return self.values[attr]
+        except KeyError:
+            raise AttributeError(attr)
+
+    @property
+    def is_leaf(self):
+        return not self.children
+
+    def get_children(self):
+        return self.children.itervalues()
+
+    def find(self, name):
+        """ Node with full name @name below this one, or None """
+        node = self
+        for part in name.split('.'):
+            node = node.children.get(part)
+            if node is None:
+                return None
+        return node
+
+    def walk(self):
+        """ Yield (full-name, node) for every node below this one, parents
+            first and siblings in name order
+        """
+        stack = [(x, self.children[x]) for x in sorted(self.children, reverse=True)]
+        while stack:
+            name, node = stack.pop()
+            yield name, node
+            stack.extend((name + '.' + x, node.children[x])
+                         for x in sorted(node.children, reverse=True))
+
+    @property
+    def digest(self):
+        """ Hash of the values and children (names and digests) below this
+            node, its own name excluded. Shared subtrees compute it once.
+        """
+        if self._digest is None:
+            h = hashlib.sha1(repr(sorted(self.values.items())))
+            for name in sorted(self.children):
+                h.update('\0%s\0%s' % (name, self.children[name].digest))
+            self._digest = h.hexdigest()
+        return self._digest
+
+    # ---- Copy-on-write modifications, each returns a new root --------------
+
+    def _replace(self, name, fn):
+        """ New root in which the node @name is replaced with fn(parent, node),
+            where parent is the (already copied) parent snapshot
+        """
+        parts = name.split('.')
+        path = [self]
+        for part in parts[:-1]:
+            child = path[-1].children.get(part)
+            if child is None:
+                raise KeyError(name)
+            path.append(child)
+
+        parent = path.pop()
+        new = Snapshot(parent.name, parent.values, dict(parent.children))
+        fn(new, parent.children.get(parts[-1]))
+
+        for node, part in zip(reversed(path), reversed(parts[:-1])):
+            children = dict(node.children)
+            children[part] = new
+            new = Snapshot(node.name, node.values, children)
+        return new
+
+    def set(self, name, **values):
+        """ Change some values of the group @name """
+        def update(parent, node):
+            if node is None:
+                raise KeyError(name)
+            new_values = dict(node.values)
+            new_values.update(values)
+            parent.children[node.name] = Snapshot(node.name, new_values, node.children)
+        return self._replace(name, update)
+
+    def add(self, name, **values):
+        """ Add a new leaf group @name """
+        def insert(parent, node):
+            if node is not None:
+                raise ValueError("Group %s already exists" % name)
+            short = name.split('.')[-1]
+            parent.children[short] = Snapshot(short, values)
+        return self._replace(name, insert)
+
+    def remove(self, name):
+        """ Remove the group @name and its subtree """
+        def delete(parent, node):
+            if node is None:
+                raise KeyError(name)
+            del parent.children[node.name]
+        return self._replace(name, delete)
+
+    def rename(self, name, new):
+        """ Change the short name of group @name to @new, moving its subtree """
+        def move(parent, node):
+            if node is None:
+                raise KeyError(name)
+            if new in parent.children:
+                raise ValueError("Group %s already exists" % new)
+            del parent.children[node.name]
+            parent.children[new] = Snapshot(new, node.values, node.children)
+        return self._replace(name, move)
+
+    def __repr__(self):
+        vals = " - ".join("%s=%s" % x for x in sorted(self.values.items()))
+        return "<snapshot '%s' - %s>" % (self.name, vals)
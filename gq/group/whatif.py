@@ -0,0 +1,116 @@
+# *****************************************************************************
+# Batch "what-if" balancing: the calculate_surplus() rules evaluated with
+# NumPy for many hypothetical leaf-demand scenarios at once
+# *****************************************************************************
+
+from itertools import groupby
+
+import numpy as np
+
+from compact import CompactTree
+
+__all__ = ['WhatIf', 'batch_surplus']
+
+
+class WhatIf(object):
+    """ The balancing plan for the shape of one DemandGroup tree: weights,
+        thresholds and sibling sets bucketed by weight are worked out once,
+        then surplus() evaluates any number of demand scenarios against it.
+
+        Scenario matrices are (scenarios x leaves) with leaves in the order
+        of self.leaves, results are (scenarios x groups) boolean matrices
+        with groups in the order of self.groups (the root excluded).
+    """
+
+    def __init__(self, root):
+        tree = CompactTree.from_tree(root)
+        n = len(tree)
+
+        self.weight = np.array(tree.weight, dtype=float)
+        self.threshold = np.array(tree.threshold, dtype=float)
+        self.is_leaf = np.array([tree.is_leaf(i) for i in range(n)])
+        self.leaf_pos = np.flatnonzero(self.is_leaf)
+
+        self.groups = [tree.full_name(i) for i in range(1, n)]
+        self.leaves = [tree.full_name(i) for i in self.leaf_pos]
+        self.base = np.array([tree.demand[i] for i in self.leaf_pos], dtype=float)
+
+        # (parent, children) for each intermediate group, children first
+        self.families = list()
+        for p in range(n - 1, -1, -1):
+            if not self.is_leaf[p]:
+                self.families.append((p, np.array(list(tree.children_of(p)))))
+
+        # Sibling sets as weight levels, highest weight first
+        self.levels = list()
+        for p, kids in reversed(self.families):
+            ordered = sorted(kids, key=lambda x: -self.weight[x])
+            self.levels.append([(w, np.array(list(g))) for w, g in
+                                groupby(ordered, key=lambda x: self.weight[x])])
+
+        self._n = n
+
+    def leaf_column(self, name):
+        """ Column of the leaf @name in a scenario matrix """
+        return self.leaves.index(name)
+
+    def scenarios(self, count):
+        """ A (@count x leaves) matrix of the tree's current demand, to edit """
+        return np.tile(self.base, (count, 1))
+
+    def surplus(self, demands):
+        """ Accept-surplus flags calculate_surplus() would set for each row of
+            leaf @demands, as a (scenarios x groups) boolean matrix
+        """
+        demands = np.asarray(demands, dtype=float)
+        if demands.ndim == 1:
+            demands = demands[np.newaxis, :]
+        count = demands.shape[0]
+
+        weighted = self.weight > 0
+        has_demand = np.zeros((count, self._n), dtype=bool)
+        has_slack = np.zeros((count, self._n), dtype=bool)
+
+        leaves = self.leaf_pos
+        over = demands > self.threshold[leaves]
+        has_demand[:, leaves] = weighted[leaves] & over
+        has_slack[:, leaves] = (self.weight[leaves] == 0) | ~over
+
+        # Bottom-up, every family's children are done before its parent
+        for p, kids in self.families:
+            if weighted[p]:
+                has_demand[:, p] = has_demand[:, kids].any(axis=1)
+                has_slack[:, p] = has_slack[:, kids].all(axis=1)
+
+        accept = np.zeros((count, self._n), dtype=bool)
+        for (p, kids), levels in zip(reversed(self.families), self.levels):
+            demand = [has_demand[:, grps].any(axis=1) for _, grps in levels]
+
+            # Any demand in a lower, non-zero weight level
+            lower = [None] * len(levels)
+            seen = np.zeros(count, dtype=bool)
+            for i in range(len(levels) - 1, -1, -1):
+                lower[i] = seen
+                if levels[i][0] > 0:
+                    seen = seen | demand[i]
+
+            already_set = np.zeros(count, dtype=bool)
+            for (_, grps), my_demand, l_demand in zip(levels, demand, lower):
+                flag = ~already_set & (my_demand | ~l_demand)
+                accept[:, grps] = flag[:, np.newaxis]
+                already_set |= flag
+
+        # Intermediate groups without weighted slack among siblings lose it
+        for p, kids in self.families:
+            if self.is_leaf[kids].all():
+                continue
+            weighted_kids = kids[weighted[kids]]
+            slack = has_slack[:, weighted_kids].any(axis=1)
+            accept[:, kids] &= slack[:, np.newaxis]
+
+        return accept[:, 1:]
+
+
+def batch_surplus(root, demands):
+    """ Shortcut for WhatIf(@root).surplus(@demands) """
+    return WhatIf(root).surplus(demands)
@@ -23,7 +23,7 @@ app.config.from_envvar('GQEDITCFG', silent=True)
 BNLT3 = app.config.get('T3ENABLE', False)
 
 from db import db_session
-from db.models import Group, User, Role, build_group_tree_db
+from db.models import Group, User, Role, build_group_tree_db, group_tree
 from util.validation import group_defaults
 from util.app_logging import log_setup
 from util.userload import (admin_permission, edit_permission, balance_permission,
@@ -80,21 +80,21 @@ def logout():
 
 @app.route('/')
 def main_menu():
-    root = build_group_tree_db(Group.query.all())
+    root = group_tree()
     return render_template('main_view.html', groups=namesort(root))
 
 
 @app.route('/edit')
 @edit_permission.require(403)
 def edit_groups():
-    root = build_group_tree_db(Group.query.all())
+    root = group_tree()
     return render_template('edit_group.html', groups=namesort(root))
 
 
 @app.route('/addrm')
 @add_remove_permission.require(403)
 def add_groups():
-    root = build_group_tree_db(Group.query.all())
+    root = group_tree()
     return render_template('group_add_rm.html', groups=namesort(root),
                            defaults=group_defaults)
 
@@ -102,7 +102,7 @@ def add_groups():
 @app.route('/ezq')
 @balance_permission.require(403)
 def ez_quota_chooser():
-    root = build_group_tree_db(Group.query.all())
+    root = group_tree()
     return render_template('quota_group_chooser.html', groups=namesort(root))
 
 
@@ -136,7 +136,7 @@ def usermanager():
 @admin_permission.require(403)
 def user_group_view(uid):
     user = User.query.filter_by(id=uid).first()
-    tree = build_group_tree_db(Group.query.all())
+    tree = group_tree()
     gnames = [x.group_name for x in user.groups]
     return render_template('user_groupedit.html', u=user,
                            groups=namesort(tree), user_groups=gnames)
@@ -15,9 +15,8 @@ engine = create_engine(app.config['DATABASE_URI'],
                        convert_unicode=True,
                        pool_recycle=app.config['DBPOOL_RECYCLE'])
 
-db_session = scoped_session(sessionmaker(autocommit=False,
-                                         autoflush=False,
-                                         bind=engine))
+Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+db_session = scoped_session(Session)
 Base = declarative_base()
 Base.metadata = MetaData(bind=engine)
 Base.query = db_session.query_property()
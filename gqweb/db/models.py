@@ -5,15 +5,20 @@
 # (C) 2015 William Strecker-Kellogg <willsk@bnl.gov>
 # ===========================================================================
 import hashlib
+import threading
+from itertools import chain
 
 from gq.group import AbstractGroup
-from gq.group.db import _build_groups_db
+from gq.group.db import _build_groups_db, VERSION_BUMP
 
-from sqlalchemy import (Table, Column, Integer, String, Boolean, Float, func,
-                        ForeignKey, TIMESTAMP, UniqueConstraint)
+from sqlalchemy import (Table, Column, Integer, BigInteger, String, Boolean, Float,
+                        func, ForeignKey, TIMESTAMP, DateTime, UniqueConstraint)
+from sqlalchemy import event, select, text
+from sqlalchemy.exc import ProgrammingError
 from sqlalchemy.orm import relationship
 
-from . import Base
+from ..application import app
+from . import Base, Session, db_session
 
 
 class Group(Base):
@@ -31,6 +36,25 @@ class Group(Base):
     last_update = Column(TIMESTAMP, nullable=False, server_default=func.now())
     last_surplus_update = Column(TIMESTAMP, nullable=True)
 
+tree_version = Table('tree_version', Base.metadata,
+                     Column('id', Integer, primary_key=True, autoincrement=False),
+                     Column('version', BigInteger, nullable=False, server_default='0'),
+                     Column('updated', TIMESTAMP, nullable=False, server_default=func.now()),
+                     mysql_engine='InnoDB', mysql_charset='utf8',
+                     )
+
+
+@event.listens_for(Session, 'after_flush')
+def bump_tree_version(session, flush_context):
+    """ Bump the tree version in the same transaction as any Group change,
+        like gq.group.db.bump_version() only warning if there's no table
+    """
+    if any(isinstance(x, Group) for x in chain(session.new, session.dirty, session.deleted)):
+        try:
+            session.execute(text(VERSION_BUMP))
+        except ProgrammingError as E:
+            app.logger.warning("Can't bump tree version: %s", E)
+
 user_role_table = Table(
     'user_roles', Base.metadata,
     Column('user_id', Integer, ForeignKey('users.id', ondelete='cascade')),
@@ -84,6 +108,29 @@ q_log = Table('queue_log', Base.metadata,
               mysql_engine='InnoDB', mysql_charset='utf8',
               )
 
+q_rollup = Table('queue_rollup', Base.metadata,
+                 Column('id', Integer, ForeignKey('groups.id', ondelete="cascade"),
+                        primary_key=True),
+                 Column('bucket', DateTime, primary_key=True, index=True),
+                 Column('samples', Integer, nullable=False, server_default='0'),
+                 Column('total', BigInteger, nullable=False, server_default='0'),
+                 Column('first_amount', Integer, nullable=False, server_default='0'),
+                 Column('last_amount', Integer, nullable=False, server_default='0'),
+                 mysql_engine='InnoDB', mysql_charset='utf8',
+                 )
+
+q_hourly = Table('queue_hourly', Base.metadata,
+                 Column('id', Integer, ForeignKey('groups.id', ondelete="cascade"),
+                        primary_key=True),
+                 Column('hour', DateTime, primary_key=True, index=True),
+                 Column('samples', Integer, nullable=False, server_default='0'),
+                 Column('total', BigInteger, nullable=False, server_default='0'),
+                 Column('min_amount', Integer, nullable=False, server_default='0'),
+                 Column('max_amount', Integer, nullable=False, server_default='0'),
+                 Column('avg_amount', Float, nullable=False, server_default='0'),
+                 mysql_engine='InnoDB', mysql_charset='utf8',
+                 )
+
 
 class GroupTree(AbstractGroup):
     def __init__(self, name, **kwargs):
@@ -101,9 +148,6 @@ class GroupTree(AbstractGroup):
         for x in (x for x in self.all() if not x.is_leaf):
             yield x.children.values()
 
-    def rename(self, new):
-        self.name = new
-
     @property
     def uniq_id(self, val=''):
         m = hashlib.md5()
@@ -112,12 +156,39 @@ class GroupTree(AbstractGroup):
 
 
 def build_group_tree_db(db_groups):
+    # Only the column values: a row's __dict__ also holds SQLAlchemy's
+    # instance state, which group_tree() would keep alive past the session,
+    # and misses columns that weren't loaded
+    columns = Group.__table__.columns.keys()
+
     def group_process(f):
         for grp in db_groups:
-            yield grp.__dict__.copy()
+            yield dict((x, getattr(grp, x)) for x in columns)
     return _build_groups_db(GroupTree, None, group_builder=group_process)
 
 
+_tree_cache = {'version': None, 'tree': None}
+_tree_lock = threading.Lock()
+
+
+def group_tree():
+    """ Tree of all groups, only rebuilt when the tree version changed since
+        the last call (or is unknown). Shared between requests, so don't
+        modify it.
+    """
+    try:
+        version = db_session.execute(select([tree_version.c.version])
+                                     .where(tree_version.c.id == 1)).scalar()
+    except ProgrammingError as E:
+        app.logger.warning("Can't read tree version: %s", E)
+        version = None
+    with _tree_lock:
+        if version is None or version != _tree_cache['version']:
+            _tree_cache['tree'] = build_group_tree_db(Group.query.all())
+            _tree_cache['version'] = version
+        return _tree_cache['tree']
+
+
 def build_group_tree_formdata(formdata):
     def group_process(f):
         for grp in sorted(formdata):
@@ -101,22 +101,20 @@ def set_renames(db, formdata):
         @formdata: dictionary of dictionaries from form input
     """
 
-    def gen_tree_list(form):
-        treelist = list(build_group_tree_formdata(formdata))
-        return sorted(treelist, key=lambda x: x.full_name)
+    tree = build_group_tree_formdata(formdata)
 
-    root = gen_tree_list(formdata)
-    existing_names = set(x.full_name for x in root)
-    clean_root = gen_tree_list(formdata)
+    # NOTE: Keep the original names because we modify the tree as we go in
+    #       alphabetical order to allow renames to propogate correctly.
+    orig_names = sorted(x.full_name for x in tree)
 
-    # NOTE: Two copies needed for this traversal because we modify the first
-    #       copy as we go in alphabetical order to allow renames to propogate
-    #       correctly.
-    for group, orig_grp in zip(root, clean_root):
-        params = formdata[orig_grp.full_name]
+    root = sorted(tree, key=lambda x: x.full_name)
+    existing_names = set(orig_names)
+
+    for group, orig_name in zip(root, orig_names):
+        params = formdata[orig_name]
 
         # Detect lowest-level changes in group name
-        old = orig_grp.full_name.split('.')[-1]
+        old = orig_name.split('.')[-1]
         new = params.get('new_name', old)
         if old != new:
             # This will propogate through the tree if the group has children
@@ -127,7 +125,7 @@ def set_renames(db, formdata):
 
         # Find db-object that matches old name and rename it to match the
         # possibly modified group-tree
-        obj = next(x for x in db if x.group_name == orig_grp.full_name)
+        obj = next(x for x in db if x.group_name == orig_name)
         if obj.group_name != group.full_name:
             app.logger.info("Rename group: %s -> %s",
                             obj.group_name, group.full_name)
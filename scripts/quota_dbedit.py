@@ -26,9 +26,10 @@ def get_parents(x):
     return (".".join(x.split(".")[:-i]) for i in range(1, x.count(".") + 1))
 
 
-# Execute database command, or list of commands, and die if something goes wrong
+# Execute database command, or list of commands, and die if something goes wrong.
+# Optional commands fail with just a warning, leaving the others' transaction
 def db_execute(command, database="atlas_groups", host="localhost",
-               user="atlas_update", p="XPASSX"):
+               user="atlas_update", p="XPASSX", optional=()):
     try:
         conn = MySQLdb.connect(db=database, host=host, user=user, passwd=p)
         dbc = conn.cursor()
@@ -40,6 +41,11 @@ def db_execute(command, database="atlas_groups", host="localhost",
             dbc.execute("START TRANSACTION")
             for c in command:
                 dbc.execute(c)
+            for c in optional:
+                try:
+                    dbc.execute(c)
+                except MySQLdb.ProgrammingError, e:
+                    print "Warning %d: %s" % (e.args[0], e.args[1])
             dbc.execute("COMMIT")
         else:
             dbc.execute(command)
@@ -89,7 +95,11 @@ def make_changes(oldquota, quota, group, d, force=False):
     dbcommands = [query % (quota, group)]
     for x in get_parents(group):
         dbcommands.append(query % (d[x] + (quota - oldquota), x))
-    db_execute(dbcommands)
+    # Tell readers of the groups table it changed (see gq.group.db), if
+    # there is a tree_version table
+    bump = "INSERT INTO tree_version (id, version) VALUES (1, 1) " \
+           "ON DUPLICATE KEY UPDATE version=version + 1"
+    db_execute(dbcommands, optional=[bump])
     return True
 
 
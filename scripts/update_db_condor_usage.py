@@ -17,7 +17,7 @@ import gq.config as c
 import gq.config.dbconn as db
 
 from gq.group import AbstractGroup
-from gq.group.db import _build_groups_db
+from gq.group.db import _build_groups_db, bump_version
 from gq.log import setup_logging
 
 
@@ -71,10 +71,14 @@ def populate_group_busy(groups):
 
 def fill_busy_db(groups):
     con, cur = db.get()
+    changed = 0
     for g in groups:
-        cur.execute('UPDATE groups SET busy = %d WHERE group_name = "%s"' %
-                    (g.busy, g.full_name))
+        changed += cur.execute('UPDATE groups SET busy = %d WHERE group_name = "%s"' %
+                               (g.busy, g.full_name))
     cur.execute('UPDATE groups SET last_update = %s', datetime.datetime.now())
+    # Readers only care about busy counts, not the timestamp
+    if changed:
+        bump_version(cur)
     con.commit()
     con.close()
 
@@ -32,6 +32,7 @@ setup(
         'Programming Language :: Python :: 2.7',
     ],
     install_requires=['MySQL-python'],
+    extras_require={'numpy': ['numpy']},
     keywords='htcondor condor group-quota flask',
     packages=find_packages(exclude=['gqweb.*', 'gqweb']),
     package_data={'gq.config': ['*.cfg']},